@@ -1,312 +1,450 @@
 import json
+import hashlib
+import threading
+from concurrent.futures import Future
 from pathlib import Path
-from typing import List, Dict
+from typing import List, Dict, Iterator, Optional
 from dataclasses import asdict
 from novel_parser import NovelParser, Scene, Character
 from character_manager import CharacterManager
-from image_generator import ImageGenerator
-from audio_generator import AudioGenerator
-from video_generator import VideoGenerator
 from config import settings
+from checkpoint import Checkpoint
+from scheduler import Tenant, get_scheduler, completed_future
+from load_policy import LoadPolicy, TaskBudget
+from ffmpeg_supervisor import CancelToken, TaskCancelled
+from novel_index import get_index, estimate_job, get_job_history
+from scene_store import METADATA_NAME, SCENES_FILE, SceneLog, SceneRecord, load_metadata, total_scenes
+from static_assets import fingerprint_asset, precompress
+
+
+# 正式渲染的视频段排在所有草稿视频段之后
+FINAL_RENDER_PRIORITY = 1000000
 
 
 class AnimeGenerator:
-    def __init__(self):
+    def __init__(self, output_dir: str = None):
+        self.output_dir = Path(output_dir or settings.output_dir)
         self.parser = NovelParser()
         self.character_manager = None
         self.image_generator = None
-        self.audio_generator = AudioGenerator()
-        self.video_generator = VideoGenerator()
-        self.output_dir = Path(settings.output_dir)
+        self.checkpoint = None
+        self.budget = None
+        self.policy = None
+        self.progress_callback = None
+        # 编码进度回调，参数为 ffmpeg 报告的 fps、速度与已编码时长
+        self.encode_callback = None
+        self.cancel_token = CancelToken()
+        # 调度队列按账户与任务公平分配工作线程；Web任务由 app 按 API Key 与任务ID设置
+        self.tenant = Tenant(task=self.output_dir.name)
+        self.final_render = None
+        self._metadata_lock = threading.Lock()
+        # 音频、视频生成器在首次使用时才导入并创建，保持启动与任务创建的开销最小
+        self._audio_generator = None
+        self._video_generator = None
         self.output_dir.mkdir(parents=True, exist_ok=True)
     
-    def generate_from_novel(self, novel_text: str, generate_images: bool = True, generate_audio: bool = True, generate_video: bool = True) -> Dict:
+    @property
+    def audio_generator(self):
+        if self._audio_generator is None:
+            from audio_generator import AudioGenerator
+            self._audio_generator = AudioGenerator(output_dir=str(self.output_dir))
+        return self._audio_generator
+    
+    @property
+    def video_generator(self):
+        if self._video_generator is None:
+            from video_generator import VideoGenerator
+            self._video_generator = VideoGenerator(output_dir=str(self.output_dir))
+        return self._video_generator
+    
+    def generate_from_novel(self, novel_text: str, generate_images: bool = True, generate_audio: bool = True, generate_video: bool = True, resume: bool = False) -> Dict:
         print("=" * 50)
         print("开始生成动漫...")
         print("=" * 50)
         
+        novel_digest = hashlib.sha256(novel_text.encode("utf-8")).hexdigest()
+        self.checkpoint = Checkpoint(str(self.output_dir))
+        resumed = resume and self.checkpoint.matches(novel_digest)
+        if resumed:
+            print("↻ 从检查点继续生成，已完成的步骤将被跳过")
+        else:
+            self.checkpoint.reset(novel_text, novel_digest, {
+                "images": generate_images,
+                "audio": generate_audio,
+                "video": generate_video
+            })
+        
+        scheduler = get_scheduler()
+        # 每个任务独立计时与计数，质量档位按当前队列负载逐项选择
+        self.budget = TaskBudget.from_settings(self.cancel_token)
+        self.policy = LoadPolicy(self.budget, self.tenant)
+        
+        # 索引在这里建立一次，场景分解按同一份索引的章节边界切分片段
+        index = get_index(novel_text)
+        estimate = estimate_job(index)
+        print(f"📏 约 {index.tokens} tokens，{len(index.chapters)} 章；预计 {estimate.scenes} 个场景、"
+              f"{estimate.api_calls} 次API调用、约 {estimate.wall_seconds:.0f} 秒")
+        
         print("\n步骤 1/6: 提取角色...")
-        characters = self.parser.extract_characters(novel_text)
+        if self.checkpoint.get("characters") is not None:
+            characters = [Character(**char) for char in self.checkpoint.get("characters")]
+        else:
+            characters = scheduler.run("llm", self.parser.extract_characters, novel_text, tenant=self.tenant)
+            self.checkpoint.save_stage("characters", [asdict(char) for char in characters])
+        self._check_cancelled()
         print(f"✓ 提取到 {len(characters)} 个角色")
         for char in characters:
             print(f"  - {char.name}: {char.description}")
         
         print("\n步骤 2/6: 初始化角色管理器...")
+        from image_generator import ImageGenerator
         self.character_manager = CharacterManager(characters)
-        self.image_generator = ImageGenerator(self.character_manager)
+        self.image_generator = ImageGenerator(self.character_manager, output_dir=str(self.output_dir))
+        self.image_generator.policy = self.policy
+        self.image_generator.budget = self.budget
+        self.image_generator.tenant = self.tenant
+        self.audio_generator.character_manager = self.character_manager
+        self.audio_generator.budget = self.budget
         print("✓ 角色管理器初始化完成")
         
         print("\n步骤 3/6: 分解场景...")
-        scenes = self.parser.split_into_scenes(novel_text, characters)
+        if self.checkpoint.get("scenes") is not None:
+            scenes = [Scene(**scene) for scene in self.checkpoint.get("scenes")]
+        else:
+            scenes = scheduler.run("llm", self.parser.split_into_scenes, novel_text, characters, tenant=self.tenant)
+            self.checkpoint.save_stage("scenes", [asdict(scene) for scene in scenes])
+        self._check_cancelled()
         print(f"✓ 分解为 {len(scenes)} 个场景")
+        self._report_progress(30, f"已分解为 {len(scenes)} 个场景")
         
         print("\n步骤 4/6: 生成角色参考图...")
-        character_refs = {}
+        # 图像生成延迟最长，参考图与所有场景图最先进入图像队列
+        ref_futures = {}
+        image_futures = {}
+        audio_futures = {}
         if generate_images:
+            # 高负载时跳过角色参考图，把图像队列留给场景图
+            skip_references = not self.policy.level_for("image").character_references
             for char in characters:
-                print(f"  正在生成 {char.name} 的参考图...")
-                ref_path = self.image_generator.generate_character_reference(char.name)
+                ref_path = self.checkpoint.character_reference(char.name)
                 if ref_path:
-                    character_refs[char.name] = ref_path
+                    ref_futures[char.name] = completed_future(ref_path)
+                elif skip_references:
+                    print(f"  ⊘ 负载较高，跳过 {char.name} 的参考图")
+                else:
+                    print(f"  正在生成 {char.name} 的参考图...")
+                    ref_futures[char.name] = scheduler.submit("image", self._generate_reference, char.name, tenant=self.tenant)
+            for scene in scenes:
+                image_futures[scene.scene_number] = self._submit_scene_asset(
+                    scheduler, "image", scene, self._generate_scene_image
+                )
         else:
             print("  ⊘ 跳过图像生成")
         
+        if generate_audio:
+            for scene in scenes:
+                audio_futures[scene.scene_number] = self._submit_scene_asset(
+                    scheduler, "tts", scene, self._generate_scene_audio
+                )
+        
         print("\n步骤 5/6: 生成场景内容...")
-        scene_outputs = []
+        # 已编码的视频段记录在检查点中，恢复时直接复用
+        self.video_generator.checkpoint = self.checkpoint
+        self.video_generator.policy = self.policy
+        self.video_generator.cancel_token = self.cancel_token
+        self.video_generator.progress_callback = self._report_encode
+        # 没有 ffmpeg 时不排队编码视频段，任务照常交付已生成的图片与音频
+        encode_segments = generate_video and generate_images and generate_audio and self.video_generator.capabilities.available
+        two_tier = encode_segments and settings.draft_render
+        segment_futures = []
+        draft_futures = []
+        # 场景记录逐条追加到临时的场景文件后即释放，不在内存中保留场景的文字与对话；
+        # 只有不编码视频段时才需要保留每个场景的素材路径用于整体合成
+        scene_log = SceneLog(str(self.output_dir))
+        scene_log.reset()
+        scene_media = []
         
         for scene in scenes:
-            print(f"\n  场景 {scene.scene_number}: {scene.setting}")
-            
-            scene_data = {
-                "scene_number": scene.scene_number,
-                "setting": scene.setting,
-                "narration": scene.narration,
-                "characters": scene.characters,
-                "dialogue": scene.dialogue,
-                "image_path": None,
-                "audio_path": None
-            }
+            # 取消后队列中尚未开始的素材生成会立即跳过，这里不再等待后续场景
+            self._check_cancelled()
+            image_future = image_futures.pop(scene.scene_number, None)
+            audio_future = audio_futures.pop(scene.scene_number, None)
+            scene_data = SceneRecord(
+                scene_number=scene.scene_number,
+                setting=scene.setting,
+                narration=scene.narration,
+                characters=scene.characters,
+                dialogue=scene.dialogue,
+                image_path=image_future.result() if image_future else None,
+                audio_path=audio_future.result() if audio_future else None
+            )
+            print(f"  ✓ 场景 {scene.scene_number}: {scene.setting}")
             
-            if generate_images:
-                print(f"    - 生成场景图像...")
-                image_filename = f"scene_{scene.scene_number:03d}.png"
-                image_path = self.image_generator.generate_scene_image(scene, image_filename)
-                scene_data["image_path"] = image_path
+            # 场景素材就绪后立即编码视频段，与后续场景的生成并行；
+            # 草稿视频段优先编码，正式视频段以较低优先级排队
+            if encode_segments and scene_data.image_path:
+                if two_tier:
+                    draft_futures.append(scheduler.submit(
+                        "ffmpeg",
+                        self.video_generator.encode_segment,
+                        scene.scene_number,
+                        scene_data.image_path,
+                        scene_data.audio_path,
+                        "draft",
+                        priority=scene.scene_number,
+                        tenant=self.tenant
+                    ))
+                segment_futures.append(scheduler.submit(
+                    "ffmpeg",
+                    self.video_generator.encode_segment,
+                    scene.scene_number,
+                    scene_data.image_path,
+                    scene_data.audio_path,
+                    priority=scene.scene_number + (FINAL_RENDER_PRIORITY if two_tier else 0),
+                    tenant=self.tenant
+                ))
             
-            if generate_audio:
-                print(f"    - 生成场景音频...")
-                audio_filename = f"scene_{scene.scene_number:03d}.mp3"
-                audio_path = self.audio_generator.generate_scene_narration(scene, audio_filename)
-                scene_data["audio_path"] = audio_path
+            elif generate_video and not encode_segments:
+                scene_media.append({
+                    "scene_number": scene_data.scene_number,
+                    "image_path": scene_data.image_path,
+                    "audio_path": scene_data.audio_path
+                })
             
-            scene_outputs.append(scene_data)
+            scene_log.append(scene_data)
+            self._report_progress(30 + int(60 * scene_log.count / max(len(scenes), 1)), f"场景 {scene_log.count}/{len(scenes)} 已生成")
+        
+        character_refs = {}
+        for name, future in ref_futures.items():
+            ref_path = future.result()
+            if ref_path:
+                character_refs[name] = ref_path
         
         result = {
             "characters": [asdict(char) for char in characters],
             "character_references": character_refs,
-            "scenes": scene_outputs,
-            "total_scenes": len(scenes)
+            "scenes_file": SCENES_FILE,
+            "total_scenes": scene_log.count,
+            "llm_usage": self.parser.usage.snapshot(),
+            "estimate": estimate.to_dict()
         }
         
-        if generate_video and (generate_images or scene_outputs):
+        self._check_cancelled()
+        if generate_video and (generate_images or scene_log.count):
             print("\n步骤 6/6: 生成视频...")
             video_filename = "anime_output.mp4"
-            video_path = self.video_generator.generate_video_from_scenes(
-                scene_outputs,
-                output_filename=video_filename,
-                fps=1,
-                audio_enabled=generate_audio
-            )
+            if two_tier:
+                draft_files = [path for path in (f.result() for f in draft_futures) if path]
+                draft_path = scheduler.run(
+                    "ffmpeg",
+                    self.video_generator.concat_segments,
+                    draft_files,
+                    self.video_generator.output_dir / "anime_draft.mp4",
+                    tenant=self.tenant
+                )
+                # 草稿视频先交付，正式视频完成后替换 video_path
+                video_path = draft_path
+                result["renders"] = {
+                    "draft": {"status": "completed" if draft_path else "failed", "video_path": draft_path},
+                    "final": {"status": "pending", "video_path": None}
+                }
+            elif encode_segments:
+                segment_files = [path for path in (f.result() for f in segment_futures) if path]
+                video_path = scheduler.run(
+                    "ffmpeg",
+                    self.video_generator.concat_segments,
+                    segment_files,
+                    self.video_generator.output_dir / video_filename,
+                    tenant=self.tenant
+                )
+            else:
+                video_path = scheduler.run(
+                    "ffmpeg",
+                    self.video_generator.generate_video_from_scenes,
+                    scene_media,
+                    output_filename=video_filename,
+                    fps=1,
+                    audio_enabled=generate_audio,
+                    tenant=self.tenant
+                )
             if video_path:
                 result["video_path"] = video_path
         
-        metadata_path = self.output_dir / "anime_metadata.json"
-        with open(metadata_path, 'w', encoding='utf-8') as f:
-            json.dump(result, f, ensure_ascii=False, indent=2)
+        result["quality"] = self.policy.snapshot()
+        result["budget"] = self.budget.snapshot()
+        if settings.image_reuse and generate_images:
+            result["image_reuse"] = dict(self.image_generator.reuse_stats, api_calls_saved=self.image_generator.reuse_stats["hits"])
+        
+        scene_log.publish()
+        metadata_path = self._write_metadata(result)
+        
+        # 恢复的任务跳过了部分步骤、关闭了部分生成的任务调用次数偏少，均不计入历史
+        if not resumed and generate_images and generate_audio:
+            get_job_history().record(
+                index.tokens,
+                len(scenes),
+                sum(result["budget"]["calls"].values()),
+                result["budget"]["elapsed"]
+            )
+        
+        if "renders" in result:
+            self._start_final_render(scheduler, segment_futures, result)
+        else:
+            self.checkpoint.save_stage("completed", True)
         
         print("\n" + "=" * 50)
         print("✓ 动漫生成完成！")
         print(f"✓ 元数据已保存到: {metadata_path}")
         if result.get("video_path"):
-            print(f"✓ 视频已保存到: {result['video_path']}")
+            label = "草稿视频" if "renders" in result else "视频"
+            print(f"✓ {label}已保存到: {result['video_path']}")
+        if "renders" in result:
+            print("… 正式视频正在后台渲染")
         print("=" * 50)
         
         return result
     
-    def generate_preview_html(self, metadata_path: str = None):
-        if metadata_path is None:
-            metadata_path = self.output_dir / "anime_metadata.json"
+    def _write_metadata(self, result: Dict) -> Path:
+        metadata_path = self.output_dir / METADATA_NAME
+        with self._metadata_lock:
+            with open(metadata_path, 'w', encoding='utf-8') as f:
+                json.dump(result, f, ensure_ascii=False, indent=2)
+            precompress(str(metadata_path))
+        return metadata_path
+    
+    def _start_final_render(self, scheduler, segment_futures: List[Future], result: Dict):
+        self.final_render = Future()
+        thread = threading.Thread(
+            target=self._finish_final_render,
+            args=(scheduler, segment_futures, result),
+            name="final-render",
+            daemon=True
+        )
+        thread.start()
+    
+    def _finish_final_render(self, scheduler, segment_futures: List[Future], result: Dict):
+        video_path = None
+        try:
+            segment_files = [path for path in (f.result() for f in segment_futures) if path]
+            video_path = scheduler.run(
+                "ffmpeg",
+                self.video_generator.concat_segments,
+                segment_files,
+                self.video_generator.output_dir / "anime_output.mp4",
+                priority=FINAL_RENDER_PRIORITY * 2,
+                tenant=self.tenant
+            )
+        except Exception as e:
+            print(f"❌ 正式视频渲染失败: {e}")
         
-        with open(metadata_path, 'r', encoding='utf-8') as f:
-            metadata = json.load(f)
+        status = "completed" if video_path else ("cancelled" if self.cancel_token.cancelled else "failed")
+        result["renders"]["final"] = {"status": status, "video_path": video_path}
+        if video_path:
+            result["video_path"] = video_path
+            print(f"✓ 正式视频已保存到: {video_path}")
+        self._write_metadata(result)
+        self.checkpoint.save_stage("completed", True)
+        self.final_render.set_result(video_path)
+    
+    def wait_for_final_render(self, timeout: float = None) -> Optional[str]:
+        if self.final_render is None:
+            return None
+        return self.final_render.result(timeout)
+    
+    def _submit_scene_asset(self, scheduler, resource: str, scene: Scene, generate):
+        kind = "image_path" if resource == "image" else "audio_path"
+        cached_path = self.checkpoint.scene_asset(scene.scene_number, kind)
+        if cached_path:
+            return completed_future(cached_path)
+        return scheduler.submit(resource, self._run_within_deadline, generate, scene, priority=scene.scene_number, tenant=self.tenant)
+    
+    def _run_within_deadline(self, generate, scene: Scene):
+        if self.cancel_token.cancelled:
+            return None
+        # 排队期间已超过截止时间的场景不再生成，视频使用已完成的素材
+        if self.budget.expired():
+            print(f"  ⊘ 已超过任务截止时间，跳过场景 {scene.scene_number} 的素材生成")
+            return None
+        return generate(scene)
+    
+    def _generate_reference(self, character_name: str):
+        ref_path = self.image_generator.generate_character_reference(character_name)
+        self.checkpoint.record_character_reference(character_name, ref_path)
+        return ref_path
+    
+    def _generate_scene_image(self, scene: Scene):
+        image_filename = f"scene_{scene.scene_number:03d}.png"
+        image_path = self.image_generator.generate_scene_image(scene, image_filename)
+        self.checkpoint.record_scene_asset(scene.scene_number, "image_path", image_path)
+        return image_path
+    
+    def _generate_scene_audio(self, scene: Scene):
+        audio_filename = f"scene_{scene.scene_number:03d}.mp3"
+        audio_path = self.audio_generator.generate_scene_audio(scene, audio_filename)
+        self.checkpoint.record_scene_asset(scene.scene_number, "audio_path", audio_path)
+        return audio_path
+    
+    def _report_progress(self, progress: int, message: str):
+        if self.progress_callback:
+            self.progress_callback(progress, message)
+    
+    def _report_encode(self, progress: Dict):
+        if self.encode_callback:
+            self.encode_callback(progress)
+    
+    def cancel(self):
+        # 终止正在运行的编码，排队中的图像、TTS与编码工作开始时直接跳过；已完成的素材保留在检查点中
+        self.cancel_token.cancel()
+    
+    def _check_cancelled(self):
+        if self.cancel_token.cancelled:
+            raise TaskCancelled("任务已取消")
+    
+    def resume(self) -> Dict:
+        checkpoint = Checkpoint(str(self.output_dir))
+        novel_text = checkpoint.load_novel_text()
+        if not checkpoint.exists() or novel_text is None:
+            raise ValueError(f"没有可恢复的检查点: {self.output_dir}")
         
-        html_content = self._build_html(metadata)
+        options = checkpoint.get("options", {})
+        return self.generate_from_novel(
+            novel_text,
+            generate_images=options.get("images", True),
+            generate_audio=options.get("audio", True),
+            generate_video=options.get("video", True),
+            resume=True
+        )
+    
+    def generate_preview_html(self, metadata_path: str = None):
+        if metadata_path is None:
+            metadata = load_metadata(str(self.output_dir))
+        else:
+            with open(metadata_path, 'r', encoding='utf-8') as f:
+                metadata = json.load(f)
         
-        html_path = self.output_dir / "preview.html"
-        with open(html_path, 'w', encoding='utf-8') as f:
-            f.write(html_content)
+        from preview_renderer import page_count, static_page_name
+        total_pages = page_count(total_scenes(metadata))
+        for page in range(1, total_pages + 1):
+            page_path = self.output_dir / static_page_name(page)
+            with open(page_path, 'w', encoding='utf-8') as f:
+                # 流式写出模板渲染结果，避免在内存中拼接整页 HTML
+                f.writelines(self._build_html(metadata, page))
+            precompress(str(page_path))
         
+        html_path = self.output_dir / static_page_name(1)
         print(f"✓ 预览页面已生成: {html_path}")
         return str(html_path)
     
-    def _build_html(self, metadata: Dict) -> str:
-        html = """<!DOCTYPE html>
-<html lang="zh-CN">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>动漫预览</title>
-    <style>
-        body {
-            font-family: "Microsoft YaHei", Arial, sans-serif;
-            max-width: 1200px;
-            margin: 0 auto;
-            padding: 20px;
-            background-color: #f5f5f5;
-        }
-        h1 { color: #333; text-align: center; }
-        .characters {
-            display: flex;
-            flex-wrap: wrap;
-            gap: 20px;
-            margin-bottom: 40px;
-        }
-        .character-card {
-            background: white;
-            padding: 15px;
-            border-radius: 8px;
-            box-shadow: 0 2px 4px rgba(0,0,0,0.1);
-            flex: 1;
-            min-width: 250px;
-        }
-        .character-card h3 { margin-top: 0; color: #2c3e50; }
-        .character-card img {
-            max-width: 100%;
-            border-radius: 4px;
-        }
-        .scene {
-            background: white;
-            padding: 20px;
-            margin-bottom: 30px;
-            border-radius: 8px;
-            box-shadow: 0 2px 4px rgba(0,0,0,0.1);
-        }
-        .scene h2 { color: #2c3e50; margin-top: 0; }
-        .scene img {
-            max-width: 100%;
-            border-radius: 4px;
-            margin: 15px 0;
-        }
-        .scene-setting {
-            background: #ecf0f1;
-            padding: 10px;
-            border-left: 4px solid #3498db;
-            margin: 10px 0;
-        }
-        .narration {
-            line-height: 1.8;
-            color: #555;
-            margin: 15px 0;
-        }
-        .dialogue {
-            margin: 10px 0;
-            padding: 10px;
-            background: #fff9e6;
-            border-left: 3px solid #f39c12;
-        }
-        .dialogue strong { color: #e67e22; }
-        audio {
-            width: 100%;
-            margin: 10px 0;
-        }
-        .video-container {
-            background: white;
-            padding: 20px;
-            margin-bottom: 30px;
-            border-radius: 8px;
-            box-shadow: 0 2px 4px rgba(0,0,0,0.1);
-            text-align: center;
-        }
-        .video-container video {
-            max-width: 100%;
-            border-radius: 4px;
-        }
-    </style>
-</head>
-<body>
-    <h1>🎬 动漫预览</h1>
-"""
-        
-        # 在开头添加视频显示
-        if metadata.get("video_path"):
-            relative_video_path = self._convert_to_relative_path(metadata["video_path"])
-            html += f"""
-    <div class="video-container">
-        <h2>🎥 完整视频</h2>
-        <video controls>
-            <source src="{relative_video_path}" type="video/mp4">
-            您的浏览器不支持视频播放。
-        </video>
-    </div>
-"""
-        
-        html += """
-    <h2>角色介绍</h2>
-    <div class="characters">
-"""
-        
-        for char in metadata.get("characters", []):
-            char_name = char["name"]
-            ref_path = metadata.get("character_references", {}).get(char_name, "")
-            
-            html += f"""
-        <div class="character-card">
-            <h3>{char_name}</h3>
-            <p><strong>描述：</strong>{char["description"]}</p>
-            <p><strong>外貌：</strong>{char["appearance"]}</p>
-            <p><strong>性格：</strong>{char["personality"]}</p>
-"""
-            if ref_path:
-                relative_path = self._convert_to_relative_path(ref_path)
-                html += f'            <img src="{relative_path}" alt="{char_name}">\n'
-            
-            html += "        </div>\n"
-        
-        html += """    </div>
-    
-    <h2>场景</h2>
-"""
-        
-        for scene in metadata.get("scenes", []):
-            html += f"""
-    <div class="scene">
-        <h2>场景 {scene["scene_number"]}</h2>
-        <div class="scene-setting">
-            <strong>场景：</strong>{scene["setting"]}
-        </div>
-"""
-            
-            if scene.get("image_path"):
-                relative_path = self._convert_to_relative_path(scene["image_path"])
-                html += f'        <img src="{relative_path}" alt="场景 {scene["scene_number"]}">\n'
-            
-            html += f"""
-        <div class="narration">
-            {scene["narration"]}
-        </div>
-"""
-            
-            if scene.get("audio_path"):
-                relative_audio_path = self._convert_to_relative_path(scene["audio_path"])
-                html += f"""
-        <audio controls>
-            <source src="{relative_audio_path}" type="audio/mpeg">
-            您的浏览器不支持音频播放。
-        </audio>
-"""
-            
-            if scene.get("dialogue"):
-                html += "        <div class=\"dialogues\">\n"
-                for d in scene["dialogue"]:
-                    html += f"""            <div class="dialogue">
-                <strong>{d.get("speaker", "")}：</strong>{d.get("text", "")}
-            </div>
-"""
-                html += "        </div>\n"
-            
-            html += "    </div>\n"
-        
-        html += """
-</body>
-</html>
-"""
-        return html
+    def _build_html(self, metadata: Dict, page: int = 1) -> Iterator[str]:
+        from preview_renderer import render_preview
+        return render_preview(metadata, self._convert_to_relative_path, page=page, output_dir=str(self.output_dir))
     
     def _convert_to_relative_path(self, file_path: str) -> str:
         if not file_path:
             return ""
         
-        path_obj = Path(file_path)
+        # 使用带内容哈希的文件名，便于浏览器长期缓存
+        path_obj = Path(fingerprint_asset(file_path))
         
         try:
             relative_path = path_obj.relative_to(self.output_dir)
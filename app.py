@@ -1,16 +1,69 @@
 # -*- coding: utf-8 -*-
-from flask import Flask, render_template, request, jsonify, send_from_directory
+from flask import Flask, Response, render_template, request, jsonify, stream_with_context
 from pathlib import Path
 import threading
 import time
 from anime_generator import AnimeGenerator
 from config import settings
-import json
+from static_assets import send_output_file, fingerprint_asset
+from preview_renderer import render_preview
+from request_coalescer import request_key
+from checkpoint import Checkpoint
+from scheduler import DEFAULT_ACCOUNT, Tenant, get_scheduler
+from process_pool import get_cpu_pool, gil_probe
+from task_lifecycle import TaskLifecycle
+from novel_index import get_index, estimate_job
+from image_reuse import get_reuse_index
+from scene_store import load_metadata, metadata_scenes, total_scenes
+from ffmpeg_supervisor import TaskCancelled, get_supervisor
 import os
 
 app = Flask(__name__)
+app.config['USE_X_SENDFILE'] = settings.static_offload == 'sendfile'
 
 generation_status = {}
+# 规范化小说文本的摘要 -> 处理该文本的任务ID（进行中或已完成）
+novel_tasks = {}
+novel_tasks_lock = threading.Lock()
+# 生成中的任务ID -> AnimeGenerator，用于取消任务
+active_generators = {}
+background_lock = threading.Lock()
+
+
+def forget_novel_task(task_id):
+    with novel_tasks_lock:
+        for digest, mapped_task_id in list(novel_tasks.items()):
+            if mapped_task_id == task_id:
+                del novel_tasks[digest]
+
+
+# 已结束任务的状态按TTL淘汰，后台定期清理残留的中间文件与过期素材
+lifecycle = TaskLifecycle(Path(settings.output_dir) / 'tasks', generation_status, on_evict=forget_novel_task)
+
+
+def start_background_services():
+    # CPU 进程池以 spawn 启动子进程时会重新导入入口模块（以及它导入的本模块），
+    # 因此后台线程不在导入时启动，而是在实际处理请求的进程中首次收到请求时启动
+    with background_lock:
+        # 周期性测量线程唤醒延迟，用于观察CPU密集阶段对Web线程的影响
+        gil_probe.start()
+        lifecycle.start()
+
+
+@app.before_request
+def ensure_background_services():
+    start_background_services()
+
+
+def task_output_dir(task_id):
+    return Path(settings.output_dir) / 'tasks' / task_id
+
+
+def account_for(api_key):
+    # 同一 API Key 提交的任务属于同一账户，调度时按账户公平分配；统计中只出现摘要
+    if not api_key:
+        return DEFAULT_ACCOUNT
+    return request_key('account', api_key=api_key)[:len('account:') + 12]
 
 
 @app.route('/')
@@ -21,84 +74,316 @@ def index():
 @app.route('/api/generate', methods=['POST'])
 def generate_anime():
     data = request.json
-    novel_text = data.get('novel_text', '')
-    
+    body, status_code = submit_novel(data.get('novel_text', ''), account_for(request.headers.get('X-API-Key')))
+    return jsonify(body), status_code
+
+
+@app.route('/api/estimate', methods=['POST'])
+def estimate_novel():
+    novel_text = (request.json or {}).get('novel_text', '')
     if not novel_text or not novel_text.strip():
         return jsonify({'error': '小说文本不能为空'}), 400
     
-    task_id = str(int(time.time() * 1000))
+    index = get_index(novel_text)
+    return jsonify({'estimate': estimate_job(index).to_dict(), 'index': index.summary()})
+
+
+@app.route('/api/status/<task_id>')
+def get_status(task_id):
+    body, status_code = task_status(task_id)
+    return jsonify(body), status_code
+
+
+def submit_novel(novel_text, account=DEFAULT_ACCOUNT):
+    # Flask 与 ASGI 两个入口共用的任务提交逻辑，返回 (响应体, 状态码)
+    if not novel_text or not novel_text.strip():
+        return {'error': '小说文本不能为空'}, 400
     
-    generation_status[task_id] = {
-        'status': 'processing',
-        'progress': 0,
-        'message': '开始处理...',
-        'result': None
-    }
+    novel_digest = request_key('novel', text=' '.join(novel_text.split()))
     
-    thread = threading.Thread(
-        target=run_generation,
-        args=(task_id, novel_text)
-    )
-    thread.daemon = True
-    thread.start()
+    # 提交前按本地索引估算规模，超出上限的任务直接拒绝并返回按章节拆分的建议
+    estimate = estimate_job(get_index(novel_text))
+    if estimate.rejected:
+        return {
+            'error': '任务规模超出上限: {}'.format('；'.join(estimate.rejected)),
+            'estimate': estimate.to_dict()
+        }, 413
+    
+    with novel_tasks_lock:
+        # 相同的小说正在生成或已生成时，直接复用已有任务
+        existing_task_id = novel_tasks.get(novel_digest)
+        if existing_task_id and generation_status.get(existing_task_id, {}).get('status') in ('processing', 'completed'):
+            return {
+                'task_id': existing_task_id,
+                'message': '相同的小说已有生成任务，已关联到现有任务'
+            }, 200
+        
+        task_id = str(int(time.time() * 1000))
+        while task_id in generation_status:
+            task_id = str(int(task_id) + 1)
+        
+        generation_status[task_id] = {
+            'status': 'processing',
+            'progress': 0,
+            'message': '开始处理...',
+            'result': None
+        }
+        novel_tasks[novel_digest] = task_id
+    
+    start_generation(task_id, novel_text, novel_digest, account=account)
+    
+    return {
+        'task_id': task_id,
+        'message': '动漫生成任务已启动',
+        'estimate': estimate.to_dict()
+    }, 200
+
+
+def task_status(task_id):
+    if task_id in generation_status:
+        return generation_status[task_id], 200
+    
+    # 进程重启后内存中的状态丢失，根据磁盘上的检查点判断任务是否可以恢复
+    if task_id.isdigit() and (task_output_dir(task_id) / 'checkpoint.json').exists():
+        checkpoint = Checkpoint(str(task_output_dir(task_id)))
+        if not checkpoint.get('completed'):
+            return {
+                'status': 'interrupted',
+                'progress': 0,
+                'message': '任务已中断，可调用 /api/tasks/{}/resume 继续生成'.format(task_id),
+                'result': None
+            }, 200
+        return {
+            'status': 'completed',
+            'progress': 100,
+            'message': '生成完成！',
+            'result': {'preview_url': '/preview/{}'.format(task_id)}
+        }, 200
+    
+    return {'error': '任务不存在'}, 404
+
+
+@app.route('/api/tasks/<task_id>/resume', methods=['POST'])
+def resume_task(task_id):
+    if not task_id.isdigit() or not (task_output_dir(task_id) / 'checkpoint.json').exists():
+        return jsonify({'error': '任务不存在或没有可恢复的检查点'}), 404
+    
+    with novel_tasks_lock:
+        if generation_status.get(task_id, {}).get('status') == 'processing':
+            return jsonify({'error': '任务正在生成中'}), 409
+        
+        generation_status[task_id] = {
+            'status': 'processing',
+            'progress': 0,
+            'message': '正在从检查点恢复...',
+            'result': None
+        }
+    
+    start_generation(task_id, None, None, resume=True, account=account_for(request.headers.get('X-API-Key')))
     
     return jsonify({
         'task_id': task_id,
-        'message': '动漫生成任务已启动'
+        'message': '已从检查点恢复生成任务'
     })
 
 
-@app.route('/api/status/<task_id>')
-def get_status(task_id):
-    if task_id not in generation_status:
+@app.route('/api/tasks/<task_id>/cancel', methods=['POST'])
+def cancel_task(task_id):
+    generator = active_generators.get(task_id)
+    if generator is None:
+        return jsonify({'error': '任务不存在或已结束'}), 404
+    
+    generator.cancel()
+    generation_status[task_id]['message'] = '正在取消...'
+    return jsonify({
+        'task_id': task_id,
+        'message': '已取消任务，已完成的素材保留在检查点中，可通过恢复接口继续'
+    })
+
+
+@app.route('/api/scheduler')
+def scheduler_status():
+    return jsonify(get_scheduler().queue_depths())
+
+
+@app.route('/api/scheduler/tenants')
+def scheduler_tenants():
+    return jsonify(get_scheduler().tenant_stats())
+
+
+@app.route('/api/gc', methods=['GET', 'POST'])
+def garbage_collection():
+    if request.method == 'POST':
+        report = lifecycle.collect()
+        return jsonify(report)
+    return jsonify(lifecycle.snapshot())
+
+
+@app.route('/api/metrics')
+def runtime_metrics():
+    return jsonify({
+        'gil_latency': gil_probe.snapshot(),
+        'cpu_pool': get_cpu_pool().snapshot(),
+        'image_reuse': get_reuse_index().snapshot(),
+        'ffmpeg': get_supervisor().snapshot(),
+        'active_tasks': sum(1 for status in generation_status.values() if status.get('status') == 'processing')
+    })
+
+
+@app.route('/preview')
+def preview():
+    return render_preview_response(Path(settings.output_dir), '/preview')
+
+
+@app.route('/preview/<task_id>')
+def preview_task(task_id):
+    if not task_id.isdigit():
+        return jsonify({'error': '任务不存在'}), 404
+    return render_preview_response(task_output_dir(task_id), '/preview/{}'.format(task_id))
+
+
+def render_preview_response(output_dir, base_url):
+    metadata = load_metadata(str(output_dir))
+    if metadata is None:
+        return jsonify({'error': '尚未生成任何动漫'}), 404
+    
+    page = request.args.get('page', 1, type=int)
+    chunks = render_preview(
+        metadata,
+        output_url,
+        page=page,
+        page_url=lambda n: '{}?page={}'.format(base_url, n),
+        output_dir=str(output_dir)
+    )
+    return Response(stream_with_context(chunks), mimetype='text/html')
+
+
+@app.route('/api/tasks/<task_id>/scenes')
+def task_scenes(task_id):
+    if not task_id.isdigit():
         return jsonify({'error': '任务不存在'}), 404
+    metadata = load_metadata(str(task_output_dir(task_id)))
+    if metadata is None:
+        return jsonify({'error': '任务尚未生成元数据'}), 404
     
-    return jsonify(generation_status[task_id])
+    # 按偏移分页读取场景，不加载整个场景列表
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    limit = min(max(request.args.get('limit', settings.preview_page_size, type=int), 1), 500)
+    scenes = metadata_scenes(str(task_output_dir(task_id)), metadata, offset, limit)
+    return jsonify({
+        'total': total_scenes(metadata),
+        'offset': offset,
+        'limit': limit,
+        'scenes': scenes
+    })
 
 
 @app.route('/output/<path:filename>')
 def serve_output(filename):
-    return send_from_directory(settings.output_dir, filename)
+    return send_output_file(settings.output_dir, filename)
+
+
+def output_url(file_path):
+    if not file_path:
+        return ''
+    
+    try:
+        relative_path = Path(fingerprint_asset(file_path)).relative_to(settings.output_dir)
+    except ValueError:
+        return file_path
+    
+    return '/output/{}'.format(relative_path.as_posix())
+
+
+def start_generation(task_id, novel_text, novel_digest, resume=False, account=DEFAULT_ACCOUNT):
+    thread = threading.Thread(
+        target=run_generation,
+        args=(task_id, novel_text, novel_digest, resume, account)
+    )
+    thread.daemon = True
+    thread.start()
 
 
-def run_generation(task_id, novel_text):
+def run_generation(task_id, novel_text, novel_digest=None, resume=False, account=DEFAULT_ACCOUNT):
     try:
         generation_status[task_id]['message'] = '正在初始化生成器...'
         generation_status[task_id]['progress'] = 10
         
-        generator = AnimeGenerator()
+        # 每个任务使用独立的输出目录，检查点也保存在其中
+        generator = AnimeGenerator(output_dir=str(task_output_dir(task_id)))
+        generator.progress_callback = lambda progress, message: generation_status[task_id].update(
+            progress=progress,
+            message=message
+        )
+        generator.encode_callback = lambda encode: generation_status[task_id].update(encode=encode)
+        generator.tenant = Tenant(account, task_id)
+        active_generators[task_id] = generator
         
         generation_status[task_id]['message'] = '正在生成动漫...'
         generation_status[task_id]['progress'] = 20
         
-        result = generator.generate_from_novel(
-            novel_text,
-            generate_images=True,
-            generate_audio=True,
-            generate_video=True
-        )
-        
-        generation_status[task_id]['message'] = '正在生成预览页面...'
-        generation_status[task_id]['progress'] = 90
-        
-        preview_html = generator.generate_preview_html()
-        
-        relative_preview_path = os.path.relpath(preview_html, settings.output_dir)
+        if resume:
+            result = generator.resume()
+        else:
+            result = generator.generate_from_novel(
+                novel_text,
+                generate_images=True,
+                generate_audio=True,
+                generate_video=True
+            )
         
         generation_status[task_id]['status'] = 'completed'
         generation_status[task_id]['progress'] = 100
         generation_status[task_id]['message'] = '生成完成！'
         generation_status[task_id]['result'] = {
-            'preview_url': '/output/{}'.format(relative_preview_path),
+            'preview_url': '/preview/{}'.format(task_id),
             'characters_count': len(result['characters']),
             'scenes_count': result['total_scenes'],
-            'video_path': result.get('video_path')
+            'video_path': result.get('video_path'),
+            'quality': result.get('quality'),
+            'budget': result.get('budget'),
+            'renders': result.get('renders')
         }
         
+        # 草稿视频已可观看，任务标记为完成；正式视频在后台渲染完成后更新状态
+        if generator.final_render is not None:
+            generation_status[task_id]['message'] = '草稿视频已生成，正式视频渲染中...'
+            video_path = generator.wait_for_final_render()
+            generation_status[task_id]['result'].update(
+                video_path=result.get('video_path'),
+                renders=result.get('renders')
+            )
+            if video_path:
+                generation_status[task_id]['message'] = '生成完成！'
+            elif generator.cancel_token.cancelled:
+                generation_status[task_id]['message'] = '生成完成（已取消正式视频渲染，保留草稿视频）'
+            else:
+                generation_status[task_id]['message'] = '生成完成（正式视频渲染失败，保留草稿视频）'
+        
+        lifecycle.mark_finished(task_id)
+        
+    except TaskCancelled:
+        generation_status[task_id]['status'] = 'cancelled'
+        generation_status[task_id]['message'] = '任务已取消'
+        lifecycle.mark_finished(task_id)
+        release_novel_task(task_id, novel_digest)
+        
     except Exception as e:
         generation_status[task_id]['status'] = 'error'
         generation_status[task_id]['message'] = '生成失败: {}'.format(str(e))
         generation_status[task_id]['progress'] = 0
+        lifecycle.mark_finished(task_id)
+        release_novel_task(task_id, novel_digest)
+    
+    finally:
+        active_generators.pop(task_id, None)
+
+
+def release_novel_task(task_id, novel_digest):
+    # 失败或取消的任务不再占用文本摘要，重新提交同一文本时创建新任务
+    with novel_tasks_lock:
+        if novel_digest and novel_tasks.get(novel_digest) == task_id:
+            del novel_tasks[novel_digest]
 
 
 if __name__ == '__main__':
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import contextlib
+import json
+import os
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.exceptions import HTTPException
+from starlette.requests import Request
+from starlette.responses import FileResponse, JSONResponse, Response, StreamingResponse
+from starlette.routing import Mount, Route
+from a2wsgi import WSGIMiddleware
+from werkzeug.security import safe_join
+from config import settings
+from static_assets import PRECOMPRESS_SUFFIXES, accel_redirect_path, cache_control_header, resolve_output_file
+import app as flask_app
+
+
+# 高频的提交、状态查询与文件下载由事件循环直接处理，不占用线程；
+# 其余页面与管理接口仍由 Flask 应用处理，两者共享同一份任务状态
+
+
+async def generate_anime(request: Request):
+    try:
+        data = await request.json()
+    except ValueError:
+        data = {}
+    # 文本摘要计算与启动生成线程放到线程池，避免大文本阻塞事件循环
+    body, status_code = await run_in_threadpool(
+        flask_app.submit_novel,
+        data.get('novel_text', ''),
+        flask_app.account_for(request.headers.get('x-api-key'))
+    )
+    return JSONResponse(body, status_code=status_code)
+
+
+async def lookup_status(task_id: str):
+    status = flask_app.generation_status.get(task_id)
+    if status is not None:
+        return status, 200
+    # 内存中没有时需要读取磁盘上的检查点
+    return await run_in_threadpool(flask_app.task_status, task_id)
+
+
+async def get_status(request: Request):
+    body, status_code = await lookup_status(request.path_params['task_id'])
+    return JSONResponse(body, status_code=status_code)
+
+
+async def status_events(request: Request):
+    task_id = request.path_params['task_id']
+    
+    async def events():
+        # Server-Sent Events：状态变化时推送，任务结束后关闭连接，代替前端的定时轮询
+        last_payload = None
+        while True:
+            body, status_code = await lookup_status(task_id)
+            payload = json.dumps(body, ensure_ascii=False)
+            if payload != last_payload:
+                yield 'data: {}\n\n'.format(payload)
+                last_payload = payload
+            if status_code != 200 or not flask_app.lifecycle.is_active(task_id):
+                break
+            if await request.is_disconnected():
+                break
+            await asyncio.sleep(settings.status_stream_interval)
+    
+    return StreamingResponse(events(), media_type='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+
+async def serve_output(request: Request):
+    filename = request.path_params['filename']
+    resolved = resolve_output_file(settings.output_dir, filename, request.headers.get('accept-encoding', ''))
+    if resolved is None:
+        raise HTTPException(status_code=404)
+    served_name, mimetype, content_encoding = resolved
+    
+    served_path = safe_join(settings.output_dir, served_name)
+    try:
+        stat_result = await run_in_threadpool(os.stat, served_path)
+    except OSError:
+        raise HTTPException(status_code=404)
+    
+    headers = {'Cache-Control': cache_control_header(filename)}
+    if content_encoding:
+        headers['Content-Encoding'] = content_encoding
+    if filename.endswith(PRECOMPRESS_SUFFIXES):
+        headers['Vary'] = 'Accept-Encoding'
+    
+    if settings.static_offload == 'x-accel-redirect':
+        headers['X-Accel-Redirect'] = accel_redirect_path(served_name)
+        return Response(media_type=mimetype, headers=headers)
+    if settings.static_offload == 'sendfile':
+        headers['X-Sendfile'] = os.path.abspath(served_path)
+        return Response(media_type=mimetype, headers=headers)
+    
+    # FileResponse 分块读取文件并支持 Range 请求；ETag 命中时直接返回 304
+    response = FileResponse(served_path, media_type=mimetype, headers=headers, stat_result=stat_result)
+    if request.headers.get('if-none-match') == response.headers.get('etag'):
+        return Response(status_code=304, headers={
+            'ETag': response.headers['etag'],
+            'Cache-Control': headers['Cache-Control']
+        })
+    return response
+
+
+@contextlib.asynccontextmanager
+async def lifespan(_app):
+    flask_app.start_background_services()
+    yield
+
+
+app = Starlette(lifespan=lifespan, routes=[
+    Route('/api/generate', generate_anime, methods=['POST']),
+    Route('/api/status/{task_id}', get_status),
+    Route('/api/status/{task_id}/events', status_events),
+    Route('/output/{filename:path}', serve_output),
+    # 首页、预览、恢复与监控接口交给 Flask 应用
+    Mount('/', app=WSGIMiddleware(flask_app.app, workers=settings.asgi_wsgi_threads))
+])
+
+
+def main():
+    import uvicorn
+    
+    # 任务状态、取消句柄与调度器都保存在进程内存中，多个工作进程之间无法共享
+    if settings.asgi_workers > 1:
+        raise SystemExit(f"ASGI_WORKERS={settings.asgi_workers} 不受支持：任务状态保存在进程内存中，只能使用单个工作进程")
+    
+    uvicorn.run(
+        'asgi_app:app',
+        host=settings.web_host,
+        port=settings.web_port,
+        workers=1,
+        backlog=settings.asgi_backlog,
+        limit_concurrency=settings.asgi_limit_concurrency or None,
+        timeout_keep_alive=settings.asgi_keepalive_seconds,
+        access_log=settings.asgi_access_log
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,34 @@
+import os
+import shutil
+import uuid
+from pathlib import Path
+from typing import Optional
+from config import settings
+
+
+class SharedAssetStore:
+    def __init__(self, root: str = None):
+        # 所有节点挂载同一目录（NFS、对象存储网关等），以任务ID划分子目录
+        self.root = Path(root or settings.shared_asset_dir)
+        self.root.mkdir(parents=True, exist_ok=True)
+    
+    def path(self, job_id: str, name: str) -> Path:
+        return self.root / job_id / name
+    
+    def exists(self, job_id: str, name: str) -> bool:
+        return self.path(job_id, name).exists()
+    
+    def put(self, job_id: str, local_path: str, name: Optional[str] = None) -> str:
+        name = name or Path(local_path).name
+        target = self.path(job_id, name)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        # 先写临时文件再原子替换，其他节点不会读到写了一半的文件
+        tmp_path = target.with_name(f".{target.name}.{uuid.uuid4().hex}.tmp")
+        shutil.copyfile(local_path, tmp_path)
+        os.replace(tmp_path, target)
+        return name
+    
+    def fetch(self, job_id: str, name: str, destination: Path) -> Path:
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(self.path(job_id, name), destination)
+        return destination
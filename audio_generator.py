@@ -1,20 +1,77 @@
 import os
+import re
 import base64
+import hashlib
+import shutil
 import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Optional
-import requests
+from typing import List, Optional, Tuple
 from config import settings
 from novel_parser import Scene
+from request_coalescer import coalescer, request_key
+from clients import get_http_session
+from ffmpeg_supervisor import run_ffmpeg
+from rate_limiter import get_limiter
+
+
+SENTENCE_END_PATTERN = re.compile(r'(?<=[。！？!?；;…\n])')
+CLAUSE_END_PATTERN = re.compile(r'(?<=[，、,：:])')
+
+
+def split_tts_text(text: str, max_chars: int) -> List[str]:
+    text = text.strip()
+    if len(text) <= max_chars:
+        return [text] if text else []
+    
+    pieces = []
+    for sentence in SENTENCE_END_PATTERN.split(text):
+        if len(sentence) <= max_chars:
+            pieces.append(sentence)
+            continue
+        # 超长句子退而按逗号等分句符切分，仍过长则硬切
+        for clause in CLAUSE_END_PATTERN.split(sentence):
+            pieces.extend(clause[i:i + max_chars] for i in range(0, len(clause), max_chars))
+    
+    chunks = []
+    current = ""
+    for piece in pieces:
+        if current and len(current) + len(piece) > max_chars:
+            chunks.append(current)
+            current = ""
+        current += piece
+    if current.strip():
+        chunks.append(current)
+    
+    return [chunk.strip() for chunk in chunks if chunk.strip()]
+
+
+def _strip_id3(data: bytes) -> bytes:
+    if len(data) < 10 or not data.startswith(b"ID3"):
+        return data
+    # ID3v2 头部长度为 4 个 7 位同步安全整数
+    size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+    return data[10 + size:]
+
+
+def concat_mp3(parts: List[bytes]) -> bytes:
+    # 只保留第一段的 ID3 标签，后续分段的 MP3 帧直接首尾相接
+    return parts[0] + b"".join(_strip_id3(part) for part in parts[1:])
 
 
 class AudioGenerator:
-    def __init__(self):
+    def __init__(self, character_manager=None, output_dir: str = None):
         self.qiniu_api_key = settings.qiniu_api_key
         self.qiniu_base_url = settings.qiniu_base_url
         self.qiniu_backup_url = settings.qiniu_backup_url
-        self.output_dir = Path(settings.output_dir) / "audio"
+        self.character_manager = character_manager
+        self.output_dir = Path(output_dir or settings.output_dir) / "audio"
         self.output_dir.mkdir(parents=True, exist_ok=True)
+        # 逐句音频缓存，跨场景、跨任务复用
+        self.line_cache_dir = Path(settings.cache_dir) / "tts"
+        self.line_cache_dir.mkdir(parents=True, exist_ok=True)
+        # 由 AnimeGenerator 设置，限制单个任务的TTS调用次数与时长
+        self.budget = None
     
     def generate_scene_narration(self, scene: Scene, output_filename: str) -> Optional[str]:
         if not self.qiniu_api_key:
@@ -52,7 +109,113 @@ class AudioGenerator:
         
         return " ".join(parts)
     
-    def generate_dialogue(self, speaker: str, text: str, output_filename: str, voice: str = "qiniu_zh_female_wwxkjx") -> Optional[str]:
+    def generate_scene_audio(self, scene: Scene, output_filename: str) -> Optional[str]:
+        if not self.qiniu_api_key:
+            print(f"⚠️ 未配置七牛云 API Key，跳过音频生成")
+            return None
+        
+        lines = self._build_scene_lines(scene)
+        if not lines:
+            return None
+        
+        try:
+            # 各句并行合成，已缓存的句子不再请求TTS
+            with ThreadPoolExecutor(max_workers=max(1, min(settings.tts_max_workers, len(lines)))) as pool:
+                line_paths = list(pool.map(lambda line: self._synthesize_line(*line), lines))
+            
+            line_paths = [path for path in line_paths if path]
+            if not line_paths:
+                return None
+            
+            output_path = self.output_dir / output_filename
+            self._stitch_lines(line_paths, output_path)
+            
+            print(f"✓ 音频已保存到: {output_path} ({len(line_paths)}/{len(lines)} 句)")
+            return str(output_path)
+        
+        except Exception as e:
+            print(f"生成场景音频时出错: {e}")
+            return None
+    
+    def _build_scene_lines(self, scene: Scene) -> List[Tuple[str, str]]:
+        lines = []
+        
+        if scene.setting and scene.setting.strip():
+            lines.append((f"{scene.setting}。", settings.tts_voice_type))
+        
+        for dialogue in scene.dialogue:
+            text = dialogue.get("text", "")
+            if text and text.strip():
+                lines.append((text, self.voice_for(dialogue.get("speaker", ""))))
+        
+        return lines
+    
+    def voice_for(self, speaker: str) -> str:
+        if self.character_manager and speaker in self.character_manager.characters:
+            return self.character_manager.get_voice_type(speaker)
+        return settings.tts_voice_type
+    
+    def _line_cache_path(self, text: str, voice_type: str) -> Path:
+        digest = hashlib.sha256(f"{voice_type}\n{text}".encode("utf-8")).hexdigest()
+        return self.line_cache_dir / f"{digest}.mp3"
+    
+    def _synthesize_line(self, text: str, voice_type: str) -> Optional[Path]:
+        cache_path = self._line_cache_path(text, voice_type)
+        if cache_path.exists():
+            return cache_path
+        
+        audio_data = self._call_qiniu_tts(text, voice_type)
+        if not audio_data:
+            return None
+        
+        tmp_path = cache_path.with_name(f"{cache_path.name}.{os.getpid()}.{time.monotonic_ns()}.tmp")
+        with open(tmp_path, 'wb') as f:
+            f.write(audio_data)
+        os.replace(tmp_path, cache_path)
+        return cache_path
+    
+    def _stitch_lines(self, line_paths: List[Path], output_path: Path):
+        if len(line_paths) == 1:
+            shutil.copyfile(line_paths[0], output_path)
+            return
+        
+        # 每句末尾补齐固定时长的静音，再统一重采样并拼接为一条场景音轨
+        inputs = []
+        filters = []
+        for idx, path in enumerate(line_paths):
+            inputs.extend(["-i", str(Path(path).absolute())])
+            pad = f",apad=pad_dur={settings.tts_line_gap}" if idx < len(line_paths) - 1 else ""
+            filters.append(f"[{idx}:a]aresample=24000,aformat=channel_layouts=mono{pad}[a{idx}]")
+        
+        concat_inputs = "".join(f"[a{idx}]" for idx in range(len(line_paths)))
+        filters.append(f"{concat_inputs}concat=n={len(line_paths)}:v=0:a=1[out]")
+        
+        cmd = [
+            "ffmpeg",
+            *inputs,
+            "-filter_complex", ";".join(filters),
+            "-map", "[out]",
+            "-c:a", "libmp3lame",
+            "-b:a", "64k",
+            "-y",
+            str(output_path)
+        ]
+        
+        try:
+            result = run_ffmpeg(cmd, output_path.name, cancel_token=self.budget.cancel_token if self.budget else None)
+            if result.returncode == 0:
+                return
+            print(f"⚠️ 音频拼接失败，改为直接拼接: {result.stderr[-500:]}")
+        except FileNotFoundError:
+            print("⚠️ 未检测到 ffmpeg，音频将直接拼接（句间无停顿）")
+        
+        # MP3 帧可以直接首尾相接播放
+        with open(output_path, 'wb') as out:
+            for path in line_paths:
+                with open(path, 'rb') as f:
+                    shutil.copyfileobj(f, out)
+    
+    def generate_dialogue(self, speaker: str, text: str, output_filename: str, voice: str = None) -> Optional[str]:
         if not self.qiniu_api_key:
             print(f"⚠️ 未配置七牛云 API Key，跳过对话音频生成")
             return None
@@ -61,13 +224,12 @@ class AudioGenerator:
             return None
         
         try:
-            audio_data = self._call_qiniu_tts(text, voice)
-            if not audio_data:
+            line_path = self._synthesize_line(text, voice or self.voice_for(speaker))
+            if not line_path:
                 return None
             
             output_path = self.output_dir / output_filename
-            with open(output_path, 'wb') as f:
-                f.write(audio_data)
+            shutil.copyfile(line_path, output_path)
             
             print(f"✓ 对话音频已保存到: {output_path}")
             return str(output_path)
@@ -80,6 +242,43 @@ class AudioGenerator:
         if voice_type is None:
             voice_type = settings.tts_voice_type
         
+        chunks = split_tts_text(text, settings.tts_chunk_chars) or [text]
+        
+        # 长文本按句切分后并行合成，失败时只重试失败的分段；短文本作为单个分段同样按此重试
+        results: List[Optional[bytes]] = [None] * len(chunks)
+        pending = list(range(len(chunks)))
+        with ThreadPoolExecutor(max_workers=max(1, min(settings.tts_max_workers, len(chunks)))) as pool:
+            for attempt in range(settings.tts_chunk_retries + 1):
+                audio_parts = pool.map(lambda idx: self._synthesize_chunk(chunks[idx], voice_type), pending)
+                for idx, audio_data in zip(pending, audio_parts):
+                    results[idx] = audio_data
+                
+                pending = [idx for idx in pending if results[idx] is None]
+                if not pending:
+                    break
+                if attempt < settings.tts_chunk_retries:
+                    print(f"⚠️ {len(pending)}/{len(chunks)} 个TTS分段失败，重试失败分段 (第 {attempt + 1} 次)")
+                    time.sleep(0.5 * 2 ** attempt)
+        
+        if pending:
+            print(f"❌ {len(pending)}/{len(chunks)} 个TTS分段合成失败，跳过音频生成")
+            return None
+        
+        return concat_mp3(results)
+    
+    def _synthesize_chunk(self, text: str, voice_type: str) -> Optional[bytes]:
+        # 预算与取消按调用方各自检查：合并请求的函数不依赖任务状态，结果可安全地交给其他任务
+        if self.budget and not self.budget.charge("tts"):
+            print("⚠️ 已超出任务的时间或API调用预算，跳过TTS请求")
+            return None
+        
+        # 并发的相同文本与音色只请求一次TTS
+        key = request_key("tts", voice_type=voice_type, text=text, encoding="mp3", speed_ratio=1.0)
+        return coalescer.run(key, self._request_tts, text, voice_type)
+    
+    def _request_tts(self, text: str, voice_type: str) -> Optional[bytes]:
+        import requests
+        
         headers = {
             "Authorization": f"Bearer {self.qiniu_api_key}",
             "Content-Type": "application/json"
@@ -100,48 +299,32 @@ class AudioGenerator:
             (self.qiniu_backup_url, "备用URL")
         ]
         
+        # 每个端点只请求一次，重试由 _call_qiniu_tts 按分段统一进行，单个分段的耗时有上限
         for base_url, url_label in urls_to_try:
             url = f"{base_url}/voice/tts"
-            max_retries = 3
-            
-            for attempt in range(max_retries):
-                try:
-                    response = requests.post(url, json=payload, headers=headers, timeout=30)
-                    response.raise_for_status()
-                    result = response.json()
-                    
-                    if "data" in result:
-                        if attempt > 0 or url_label == "备用URL":
-                            print(f"✓ TTS API调用成功 ({url_label}, 尝试 {attempt + 1}/{max_retries})")
-                        return base64.b64decode(result["data"])
-                    else:
-                        print(f"⚠️ TTS API返回格式错误 ({url_label}): {result}")
-                        break
-                
-                except requests.exceptions.HTTPError as e:
-                    print(f"   错误响应内容: {e.response.text if e.response else 'N/A'}")
-                    if e.response.status_code == 500:
-                        wait_time = (2 ** attempt) * 0.5
-                        print(f"⚠️ 服务器错误 (500) - {url_label}, 尝试 {attempt + 1}/{max_retries}")
-                        if attempt < max_retries - 1:
-                            print(f"   等待 {wait_time:.1f} 秒后重试...")
-                            time.sleep(wait_time)
-                        else:
-                            print(f"   已达到最大重试次数，尝试下一个URL")
-                    else:
-                        print(f"⚠️ HTTP错误 ({e.response.status_code}) - {url_label}: {e}")
-                        break
-                
-                except requests.exceptions.Timeout:
-                    print(f"⚠️ 请求超时 - {url_label}, 尝试 {attempt + 1}/{max_retries}")
-                    if attempt == max_retries - 1:
-                        print(f"   已达到最大重试次数，尝试下一个URL")
+            try:
+                with get_limiter("tts"):
+                    response = get_http_session().post(url, json=payload, headers=headers, timeout=30)
+                response.raise_for_status()
+                result = response.json()
                 
-                except Exception as e:
-                    print(f"⚠️ 调用TTS API时出错 ({url_label}): {type(e).__name__}: {e}")
-                    import traceback
-                    print(f"   堆栈跟踪: {traceback.format_exc()}")
-                    break
+                if "data" in result:
+                    if url_label == "备用URL":
+                        print(f"✓ TTS API调用成功 ({url_label})")
+                    return base64.b64decode(result["data"])
+                print(f"⚠️ TTS API返回格式错误 ({url_label}): {result}")
+            
+            except requests.exceptions.HTTPError as e:
+                print(f"   错误响应内容: {e.response.text if e.response else 'N/A'}")
+                print(f"⚠️ HTTP错误 ({e.response.status_code}) - {url_label}: {e}")
+            
+            except requests.exceptions.Timeout:
+                print(f"⚠️ 请求超时 - {url_label}")
+            
+            except Exception as e:
+                print(f"⚠️ 调用TTS API时出错 ({url_label}): {type(e).__name__}: {e}")
+                import traceback
+                print(f"   堆栈跟踪: {traceback.format_exc()}")
         
         print(f"❌ 所有TTS API端点均失败，跳过音频生成")
         return None
@@ -0,0 +1,181 @@
+import glob
+import hashlib
+import json
+import os
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import Dict, List
+from anime_generator import AnimeGenerator
+from novel_parser import llm_usage
+from rate_limiter import limiter_stats
+from request_coalescer import coalescer
+from config import settings
+
+
+MANIFEST_NAME = "manifest.json"
+
+
+def collect_novel_files(source: str) -> List[Path]:
+    path = Path(source)
+    if path.is_dir():
+        files = sorted(path.glob("*.txt"))
+    else:
+        files = sorted(Path(p) for p in glob.glob(source, recursive=True))
+    return [f for f in files if f.is_file()]
+
+
+def _text_digest(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class BatchRunner:
+    def __init__(self, novel_files: List[Path], output_root: str = None, jobs: int = 2,
+                 generate_images: bool = True, generate_audio: bool = True, generate_video: bool = True):
+        self.novel_files = novel_files
+        # 输出目录按相对于所有输入文件公共目录的路径命名，递归匹配到的同名文件（a/ch1.txt 与 b/ch1.txt）互不覆盖
+        parents = [str(f.resolve().parent) for f in novel_files]
+        self.input_root = Path(os.path.commonpath(parents)) if parents else Path(".")
+        self.output_root = Path(output_root or Path(settings.output_dir) / "batch")
+        self.output_root.mkdir(parents=True, exist_ok=True)
+        self.jobs = max(1, jobs)
+        self.generate_images = generate_images
+        self.generate_audio = generate_audio
+        self.generate_video = generate_video
+    
+    def _novel_output_dir(self, novel_file: Path) -> Path:
+        relative = novel_file.resolve().relative_to(self.input_root)
+        return self.output_root / relative.parent / relative.stem
+    
+    def _load_manifest(self, output_dir: Path) -> Dict:
+        manifest_path = output_dir / MANIFEST_NAME
+        if not manifest_path.exists():
+            return {}
+        try:
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return {}
+    
+    def _write_manifest(self, output_dir: Path, manifest: Dict):
+        output_dir.mkdir(parents=True, exist_ok=True)
+        manifest_path = output_dir / MANIFEST_NAME
+        tmp_path = manifest_path.with_name(MANIFEST_NAME + ".tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, manifest_path)
+    
+    def _process_novel(self, novel_file: Path) -> Dict:
+        output_dir = self._novel_output_dir(novel_file)
+        novel_text = novel_file.read_text(encoding='utf-8')
+        digest = _text_digest(novel_text)
+        options = {
+            "images": self.generate_images,
+            "audio": self.generate_audio,
+            "video": self.generate_video
+        }
+        
+        # 已完成且源文件与生成选项均未变化的小说直接跳过，实现崩溃后续跑
+        manifest = self._load_manifest(output_dir)
+        same_job = manifest.get("source_digest") == digest and manifest.get("options") == options
+        if same_job and manifest.get("status") == "completed":
+            return {**manifest, "skipped": True}
+        # 中断或失败的小说从检查点继续，已完成的资源不再重复生成
+        resume = same_job
+        
+        if not novel_text.strip():
+            manifest = {"source": str(novel_file), "status": "error", "error": "小说文件为空"}
+            self._write_manifest(output_dir, manifest)
+            return manifest
+        
+        manifest = {
+            "source": str(novel_file),
+            "source_digest": digest,
+            "options": options,
+            "status": "processing",
+            "started_at": time.time()
+        }
+        self._write_manifest(output_dir, manifest)
+        
+        try:
+            generator = AnimeGenerator(output_dir=str(output_dir))
+            result = generator.generate_from_novel(
+                novel_text,
+                generate_images=self.generate_images,
+                generate_audio=self.generate_audio,
+                generate_video=self.generate_video,
+                resume=resume
+            )
+            generator.wait_for_final_render()
+            generator.generate_preview_html()
+            
+            manifest.update({
+                "status": "completed",
+                "characters": len(result["characters"]),
+                "scenes": result["total_scenes"],
+                "video_path": result.get("video_path")
+            })
+        except Exception as e:
+            manifest.update({
+                "status": "error",
+                "error": str(e),
+                "traceback": traceback.format_exc()
+            })
+        
+        manifest["finished_at"] = time.time()
+        manifest["elapsed"] = manifest["finished_at"] - manifest["started_at"]
+        self._write_manifest(output_dir, manifest)
+        return manifest
+    
+    def run(self) -> Dict:
+        started = time.time()
+        outcomes = []
+        
+        with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+            futures = {pool.submit(self._process_novel, f): f for f in self.novel_files}
+            for future in as_completed(futures):
+                novel_file = futures[future]
+                outcome = future.result()
+                outcomes.append(outcome)
+                
+                if outcome.get("skipped"):
+                    print(f"⊘ 跳过已完成: {novel_file.name}")
+                elif outcome["status"] == "completed":
+                    print(f"✓ 完成: {novel_file.name} ({outcome['scenes']} 个场景, {outcome['elapsed']:.1f} 秒)")
+                else:
+                    print(f"❌ 失败: {novel_file.name}: {outcome.get('error')}")
+        
+        return self._build_report(outcomes, time.time() - started)
+    
+    def _build_report(self, outcomes: List[Dict], wall_time: float) -> Dict:
+        processed = [o for o in outcomes if not o.get("skipped")]
+        completed = [o for o in processed if o["status"] == "completed"]
+        total_scenes = sum(o.get("scenes", 0) for o in completed)
+        
+        return {
+            "novels": len(outcomes),
+            "completed": len(completed),
+            "failed": len(processed) - len(completed),
+            "skipped": len(outcomes) - len(processed),
+            "scenes": total_scenes,
+            "wall_time": wall_time,
+            "novels_per_hour": len(completed) / wall_time * 3600 if wall_time else 0.0,
+            "scenes_per_minute": total_scenes / wall_time * 60 if wall_time else 0.0,
+            "api_calls": limiter_stats(),
+            "coalesced_requests": dict(coalescer.stats),
+            "llm_tokens": llm_usage.snapshot()
+        }
+
+
+def print_batch_report(report: Dict):
+    print("\n📊 批量处理统计:")
+    print(f"  - 小说总数: {report['novels']}（完成 {report['completed']}，失败 {report['failed']}，跳过 {report['skipped']}）")
+    print(f"  - 场景总数: {report['scenes']}")
+    print(f"  - 总耗时: {report['wall_time']:.1f} 秒")
+    print(f"  - 吞吐量: {report['novels_per_hour']:.2f} 部/小时, {report['scenes_per_minute']:.2f} 场景/分钟")
+    for name, stats in sorted(report["api_calls"].items()):
+        print(f"  - {name} 调用: {stats['calls']} 次, 累计排队 {stats['wait_seconds']:.1f} 秒")
+    print(f"  - 合并的重复请求: {report['coalesced_requests']['coalesced']}")
+    tokens = report["llm_tokens"]
+    print(f"  - LLM 输入 {tokens['prompt_tokens']} tokens（缓存命中 {tokens['cached_tokens']}，{tokens['cache_hit_ratio']:.0%}），输出 {tokens['completion_tokens']} tokens")
@@ -1,6 +1,8 @@
 from typing import Dict, List
 from dataclasses import dataclass
 from novel_parser import Character
+from config import settings
+from character_registry import CharacterRegistry, get_character_registry
 
 
 @dataclass
@@ -9,17 +11,19 @@ class CharacterVisualProfile:
     base_appearance: str
     reference_prompt: str
     seed: int
+    registry_key: str
 
 
 class CharacterManager:
-    def __init__(self, characters: List[Character]):
+    def __init__(self, characters: List[Character], registry: CharacterRegistry = None):
         self.characters = {c.name: c for c in characters}
+        self.registry = registry or get_character_registry()
         self.visual_profiles: Dict[str, CharacterVisualProfile] = {}
         self._initialize_visual_profiles()
     
     def _initialize_visual_profiles(self):
         for name, character in self.characters.items():
-            seed = hash(name) % 1000000
+            entry = self.registry.register(character)
             
             reference_prompt = self._create_reference_prompt(character)
             
@@ -27,7 +31,8 @@ class CharacterManager:
                 name=name,
                 base_appearance=character.appearance,
                 reference_prompt=reference_prompt,
-                seed=seed
+                seed=entry["seed"],
+                registry_key=entry["key"]
             )
     
     def _create_reference_prompt(self, character: Character) -> str:
@@ -48,5 +53,21 @@ consistent with character design, detailed and expressive"""
         
         return prompt.strip()
     
+    def get_character_fragment(self, character_name: str) -> str:
+        if character_name not in self.characters:
+            return ""
+        
+        base = self.characters[character_name]
+        return f"{base.appearance}, anime style, consistent with character design, detailed and expressive"
+    
+    def get_voice_type(self, character_name: str) -> str:
+        profile = self.visual_profiles.get(character_name)
+        voice_pool = [v.strip() for v in settings.tts_voice_pool.split(",") if v.strip()]
+        if not profile or not voice_pool:
+            return settings.tts_voice_type
+        
+        # 与种子一样基于稳定摘要分配，同一角色在不同运行中音色不变
+        return voice_pool[int(profile.registry_key, 16) % len(voice_pool)]
+    
     def get_visual_profile(self, character_name: str) -> CharacterVisualProfile:
         return self.visual_profiles.get(character_name)
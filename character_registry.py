@@ -0,0 +1,106 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Optional
+from novel_parser import Character
+from config import settings
+
+
+def character_key(name: str, appearance: str) -> str:
+    # 使用稳定摘要而不是 hash()，后者在每个进程中都会随机化
+    payload = "{}\n{}".format(name.strip(), " ".join(appearance.split()))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def stable_seed(key: str) -> int:
+    return int(key, 16) % 1000000
+
+
+class CharacterRegistry:
+    def __init__(self, registry_dir: str = None):
+        self.registry_dir = Path(registry_dir or Path(settings.cache_dir) / "characters")
+        self.registry_dir.mkdir(parents=True, exist_ok=True)
+        self.index_path = self.registry_dir / "registry.json"
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Dict] = self._load()
+    
+    def _load(self) -> Dict[str, Dict]:
+        if not self.index_path.exists():
+            return {}
+        
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"⚠️ 角色注册表读取失败，将重新创建: {e}")
+            return {}
+    
+    def _save(self):
+        # 先合并其他进程写入的条目，再原子替换索引文件
+        merged = self._load()
+        merged.update(self._entries)
+        self._entries = merged
+        
+        tmp_path = self.index_path.with_name(self.index_path.name + f".{os.getpid()}.tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._entries, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.index_path)
+    
+    def get(self, key: str) -> Optional[Dict]:
+        return self._entries.get(key)
+    
+    def register(self, character: Character) -> Dict:
+        key = character_key(character.name, character.appearance)
+        
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = {
+                    "name": character.name,
+                    "appearance": character.appearance,
+                    "seed": stable_seed(key),
+                    "reference_image": None,
+                    "created_at": time.time()
+                }
+                self._entries[key] = entry
+                self._save()
+        
+        return {"key": key, **entry}
+    
+    def reference_image(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if not entry or not entry.get("reference_image"):
+            return None
+        
+        image_path = self.registry_dir / entry["reference_image"]
+        return str(image_path) if image_path.exists() else None
+    
+    def store_reference(self, key: str, image_path: str) -> Optional[str]:
+        if key not in self._entries or not Path(image_path).exists():
+            return None
+        
+        stored_name = f"{key}{Path(image_path).suffix}"
+        shutil.copyfile(image_path, self.registry_dir / stored_name)
+        
+        with self._lock:
+            self._entries[key]["reference_image"] = stored_name
+            self._entries[key]["updated_at"] = time.time()
+            self._save()
+        
+        return str(self.registry_dir / stored_name)
+
+
+_default_registry: Optional[CharacterRegistry] = None
+_default_registry_lock = threading.Lock()
+
+
+def get_character_registry() -> CharacterRegistry:
+    global _default_registry
+    with _default_registry_lock:
+        if _default_registry is None:
+            _default_registry = CharacterRegistry()
+        return _default_registry
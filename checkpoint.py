@@ -0,0 +1,164 @@
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+
+CHECKPOINT_NAME = "checkpoint.json"
+NOVEL_TEXT_NAME = "novel.txt"
+# 每个场景素材、视频段与参考图各追加一行，不重写整个检查点；恢复时按顺序重放
+ASSET_JOURNAL_NAME = "checkpoint_assets.jsonl"
+ASSET_SECTIONS = ("character_references", "scene_assets", "segments")
+# 场景分解结果只写入一次，单独保存，检查点中只记录场景数
+SCENES_STAGE_NAME = "checkpoint_scenes.jsonl"
+
+
+class Checkpoint:
+    def __init__(self, output_dir: str):
+        self.output_dir = Path(output_dir)
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.path = self.output_dir / CHECKPOINT_NAME
+        self.journal_path = self.output_dir / ASSET_JOURNAL_NAME
+        self.scenes_path = self.output_dir / SCENES_STAGE_NAME
+        self._lock = threading.Lock()
+        self.data: Dict[str, Any] = self._load()
+        self.assets: Dict[str, Dict[str, Any]] = {section: {} for section in ASSET_SECTIONS}
+        if self.data:
+            self._replay_journal()
+        # 旧版本的检查点把素材记录内联在 JSON 中，转存到记录文件，之后保存检查点时不会丢失
+        for section in ASSET_SECTIONS:
+            for key, value in (self.data.pop(section, None) or {}).items():
+                self._append(section, key, value)
+
+    def _load(self) -> Dict[str, Any]:
+        if not self.path.exists():
+            return {}
+
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"⚠️ 检查点文件损坏，将重新生成: {e}")
+            return {}
+
+    def _replay_journal(self):
+        if not self.journal_path.exists():
+            return
+        with open(self.journal_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # 进程崩溃时最后一行可能不完整
+                    continue
+                self.assets.setdefault(record["section"], {})[record["key"]] = record["value"]
+
+    def _append(self, section: str, key: str, value: Any):
+        self.assets[section][key] = value
+        line = json.dumps({"section": section, "key": key, "value": value}, ensure_ascii=False)
+        with open(self.journal_path, 'a', encoding='utf-8') as f:
+            f.write(line + "\n")
+
+    def _save(self):
+        self.data["updated_at"] = time.time()
+        tmp_path = self.path.with_name(CHECKPOINT_NAME + ".tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.data, f, ensure_ascii=False)
+        # 原子替换，进程在写入过程中崩溃也不会留下半个检查点
+        os.replace(tmp_path, self.path)
+
+    def exists(self) -> bool:
+        return bool(self.data)
+
+    def matches(self, novel_digest: str) -> bool:
+        return self.data.get("novel_digest") == novel_digest
+
+    def reset(self, novel_text: str, novel_digest: str, options: Dict[str, bool]):
+        with open(self.output_dir / NOVEL_TEXT_NAME, 'w', encoding='utf-8') as f:
+            f.write(novel_text)
+
+        with self._lock:
+            self.data = {
+                "novel_digest": novel_digest,
+                "options": options,
+                "created_at": time.time()
+            }
+            self.assets = {section: {} for section in ASSET_SECTIONS}
+            open(self.journal_path, 'w').close()
+            self.scenes_path.unlink(missing_ok=True)
+            self._save()
+
+    def load_novel_text(self) -> Optional[str]:
+        novel_path = self.output_dir / NOVEL_TEXT_NAME
+        if not novel_path.exists():
+            return None
+        return novel_path.read_text(encoding='utf-8')
+
+    def get(self, key: str, default: Any = None) -> Any:
+        if key == "scenes" and "scene_count" in self.data:
+            return self._load_scenes()
+        return self.data.get(key, default)
+
+    def save_stage(self, key: str, value: Any):
+        with self._lock:
+            if key == "scenes":
+                self._write_scenes(value)
+                self.data["scene_count"] = len(value)
+            else:
+                self.data[key] = value
+            self._save()
+
+    def _write_scenes(self, scenes: List[Dict]):
+        tmp_path = self.scenes_path.with_name(SCENES_STAGE_NAME + ".tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for scene in scenes:
+                f.write(json.dumps(scene, ensure_ascii=False) + "\n")
+        os.replace(tmp_path, self.scenes_path)
+
+    def _load_scenes(self) -> Optional[List[Dict]]:
+        if not self.scenes_path.exists():
+            return None
+        with open(self.scenes_path, 'r', encoding='utf-8') as f:
+            scenes = [json.loads(line) for line in f if line.strip()]
+        return scenes if len(scenes) == self.data["scene_count"] else None
+
+    def character_reference(self, name: str) -> Optional[str]:
+        path = self.assets["character_references"].get(name)
+        return path if path and Path(path).exists() else None
+
+    def record_character_reference(self, name: str, path: str):
+        with self._lock:
+            self._append("character_references", name, path)
+
+    def scene_asset(self, scene_number: int, kind: str) -> Optional[str]:
+        path = self.assets["scene_assets"].get(f"{scene_number}:{kind}")
+        if path is None:
+            # 旧版本按场景号嵌套保存
+            path = (self.assets["scene_assets"].get(str(scene_number)) or {}).get(kind)
+        return path if path and Path(path).exists() else None
+
+    def record_scene_asset(self, scene_number: int, kind: str, path: Optional[str]):
+        if not path:
+            return
+        with self._lock:
+            self._append("scene_assets", f"{scene_number}:{kind}", path)
+
+    def _segment_key(self, index: int, profile: str) -> str:
+        return str(index) if profile == "final" else f"{profile}:{index}"
+
+    def segment(self, index: int, image_path: str, audio_path: Optional[str], profile: str = "final") -> Optional[str]:
+        entry = self.assets["segments"].get(self._segment_key(index, profile))
+        # 输入素材变化后已编码的视频段作废
+        if not entry or entry.get("image_path") != image_path or entry.get("audio_path") != audio_path:
+            return None
+        return entry["path"] if Path(entry["path"]).exists() else None
+
+    def record_segment(self, index: int, image_path: str, audio_path: Optional[str], path: str, profile: str = "final"):
+        with self._lock:
+            self._append("segments", self._segment_key(index, profile), {
+                "image_path": image_path,
+                "audio_path": audio_path,
+                "path": path
+            })
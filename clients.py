@@ -0,0 +1,44 @@
+import threading
+from typing import Optional
+from config import settings
+
+
+# openai 与 requests 导入较慢，首次真正需要客户端时才导入
+_lock = threading.Lock()
+_openai_client = None
+_http_session = None
+
+
+def uses_qiniu() -> bool:
+    return bool(settings.qiniu_api_key)
+
+
+def get_openai_client():
+    global _openai_client
+    with _lock:
+        # 进程内所有生成器共享同一个客户端及其连接池
+        if _openai_client is None:
+            from openai import OpenAI
+            if settings.qiniu_api_key:
+                _openai_client = OpenAI(
+                    api_key=settings.qiniu_api_key,
+                    base_url=settings.qiniu_base_url
+                )
+            elif settings.openai_api_key:
+                _openai_client = OpenAI(api_key=settings.openai_api_key)
+        return _openai_client
+
+
+def get_http_session():
+    global _http_session
+    with _lock:
+        if _http_session is None:
+            import requests
+            _http_session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=4,
+                pool_maxsize=max(settings.tts_concurrency, settings.image_concurrency)
+            )
+            _http_session.mount("https://", adapter)
+            _http_session.mount("http://", adapter)
+        return _http_session
@@ -1,3 +1,4 @@
+import os
 from pydantic_settings import BaseSettings
 
 
@@ -10,13 +11,95 @@ class Settings(BaseSettings):
     anthropic_api_key: str = ""
     
     image_model: str = "gemini-2.5-flash-image"
+    # 相似场景图片复用：出场角色相同且地点与画面关键词的相似度达到阈值时复用已有图片（可轻微裁切变化）
+    image_reuse: bool = False
+    image_reuse_threshold: float = 0.8
+    image_reuse_vary: bool = True
+    image_prompt_token_budget: int = 0
     tts_voice_type: str = "qiniu_zh_female_wwxkjx"
+    # 角色音色池（逗号分隔），按角色稳定摘要分配；旁白使用 tts_voice_type
+    tts_voice_pool: str = "qiniu_zh_female_tmjxxy,qiniu_zh_male_whxkxg,qiniu_zh_female_kljxdd,qiniu_zh_male_ljfdxz"
+    tts_max_workers: int = 4
+    tts_line_gap: float = 0.35
+    tts_chunk_chars: int = 150
+    tts_chunk_retries: int = 2
+    
+    # 进程内共享的并发与速率限制（每分钟调用数，0 表示不限速）
+    llm_concurrency: int = 4
+    llm_rate_per_minute: float = 0
+    image_concurrency: int = 4
+    image_rate_per_minute: float = 0
+    tts_concurrency: int = 8
+    tts_rate_per_minute: float = 0
+    # 视频段编码为CPU密集型任务，默认使用一半的CPU核心
+    ffmpeg_concurrency: int = max(1, (os.cpu_count() or 2) // 2)
+    # 单个视频段或场景音频编码的最长时间与任意编码的无进展时长（秒），超过后终止该进程，0 表示不限制；
+    # 整段视频编码与最终拼接的时长随场景数增长，只做停滞检测
+    ffmpeg_timeout_seconds: float = 900
+    ffmpeg_stall_seconds: float = 120
+    # 多租户公平调度：每个账户在每类资源上同时执行的最大工作数（0 表示不限制），
+    # 以及账户权重（"账户:权重,账户:权重"，账户为 API Key 摘要，未列出的权重为 1）
+    tenant_max_active: int = 0
+    tenant_weights: str = ""
+    # 图片解码、校验等CPU密集型后处理使用的独立进程数，0 表示在当前线程中执行
+    cpu_pool_workers: int = 2
+    # 先以低分辨率快速渲染草稿视频，正式视频在后台以较低优先级渲染
+    draft_render: bool = True
+    
+    # 负载自适应质量：队列中每个工作线程平均排队的任务数达到阈值后降级
+    adaptive_quality: bool = True
+    quality_reduced_backlog: float = 2.0
+    quality_minimal_backlog: float = 6.0
+    # 单个任务的截止时间（秒）与API调用预算，0 表示不限制
+    task_deadline_seconds: float = 0
+    task_api_call_budget: int = 0
     text_model: str = "qwen3-max"
+    # 长篇小说按段落切分成不超过该字数的片段，并行分解场景
+    parser_chunk_chars: int = 6000
+    parser_max_workers: int = 4
+    # LLM 输出无法修复时，请求补全剩余条目的最大次数
+    parser_repair_attempts: int = 2
+    
+    # 任务准入：按本地索引估算的 token 数与场景数上限，超出时拒绝并给出按章节拆分的建议（0 表示不限制）
+    max_job_tokens: int = 0
+    max_job_scenes: int = 0
+    
     output_dir: str = "output"
+    preview_page_size: int = 50
+    cache_dir: str = "cache"
+    
+    # 分布式模式：任务队列（留空使用 cache_dir 下的 SQLite，或 redis://host:6379/0）与各节点共享的素材目录
+    task_queue_url: str = ""
+    shared_asset_dir: str = "shared_assets"
+    task_lease_seconds: float = 600
+    task_max_attempts: int = 3
+    
+    # 任务生命周期：状态保留时长、素材保留时长与磁盘配额（0 表示不限制），后台清理间隔
+    task_status_ttl_seconds: float = 3600
+    artifact_ttl_hours: float = 168
+    task_disk_quota_mb: float = 0
+    global_disk_quota_mb: float = 0
+    gc_interval_seconds: float = 600
+    # 清理的根目录（逗号分隔，相对 output_dir）：tasks 为Web任务，batch 为批量任务，"." 为命令行直接写在 output_dir 下的输出
+    gc_roots: str = "tasks,batch,."
     
     web_host: str = "0.0.0.0"
     web_port: int = 8088
     
+    # ASGI 入口（asgi_app.py）：工作进程数（任务状态在进程内存中，只支持 1）、监听队列长度、最大并发连接数（0 表示不限）、
+    # keep-alive 超时、处理 Flask 路由的线程数、SSE 状态推送间隔
+    asgi_workers: int = 1
+    asgi_backlog: int = 2048
+    asgi_limit_concurrency: int = 0
+    asgi_keepalive_seconds: int = 5
+    asgi_wsgi_threads: int = 10
+    asgi_access_log: bool = False
+    status_stream_interval: float = 1.0
+    
+    # 静态文件发送方式：""（应用直接发送）、"sendfile"（X-Sendfile）或 "x-accel-redirect"（Nginx）
+    static_offload: str = ""
+    static_accel_prefix: str = "/protected-output"
+    
     class Config:
         env_file = ".env"
         env_file_encoding = "utf-8"
@@ -0,0 +1,211 @@
+import hashlib
+import json
+import shutil
+import time
+from dataclasses import asdict
+from pathlib import Path
+from typing import Dict, List, Optional
+from novel_parser import NovelParser
+from config import settings
+from task_queue import SceneTask, get_task_queue
+from asset_store import SharedAssetStore
+from static_assets import precompress
+from scene_store import METADATA_NAME, SCENES_FILE, SceneLog, SceneRecord
+
+
+class DistributedCoordinator:
+    def __init__(self, output_dir: str = None, queue=None, store: SharedAssetStore = None, poll_interval: float = 1.0):
+        self.output_dir = Path(output_dir or settings.output_dir)
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.queue = queue or get_task_queue()
+        self.store = store or SharedAssetStore()
+        self.poll_interval = poll_interval
+        self.parser = NovelParser()
+        self.progress_callback = None
+    
+    def generate_from_novel(self, novel_text: str, generate_images: bool = True, generate_audio: bool = True, generate_video: bool = True) -> Dict:
+        print("=" * 50)
+        print("开始分布式生成动漫...")
+        print("=" * 50)
+        
+        options = {"images": generate_images, "audio": generate_audio, "video": generate_video}
+        job_id = hashlib.sha256(
+            (novel_text + json.dumps(options, sort_keys=True)).encode("utf-8")
+        ).hexdigest()[:16]
+        
+        # 文本解析只在协调节点执行一次，工作节点只处理场景级的工作单元
+        print("\n步骤 1/4: 解析角色与场景...")
+        characters = self.parser.extract_characters(novel_text)
+        scenes = self.parser.split_into_scenes(novel_text, characters)
+        character_dicts = [asdict(char) for char in characters]
+        print(f"✓ {len(characters)} 个角色，{len(scenes)} 个场景，任务 {job_id}")
+        
+        print("\n步骤 2/4: 提交场景任务...")
+        submitted = 0
+        if generate_images:
+            for char in characters:
+                submitted += self.queue.put(SceneTask(job_id, "reference", char.name, {
+                    "characters": character_dicts,
+                    "name": char.name,
+                    "asset_name": f"character_ref_{char.name}.png"
+                }))
+        for scene in scenes:
+            key = f"{scene.scene_number:03d}"
+            if generate_images:
+                submitted += self.queue.put(SceneTask(job_id, "image", key, {
+                    "characters": character_dicts,
+                    "scene": asdict(scene),
+                    "asset_name": f"scene_{key}.png"
+                }))
+            if generate_audio:
+                submitted += self.queue.put(SceneTask(job_id, "audio", key, {
+                    "characters": character_dicts,
+                    "scene": asdict(scene),
+                    "asset_name": f"scene_{key}.mp3"
+                }))
+        print(f"✓ 新提交 {submitted} 个任务（已完成的任务直接复用）")
+        
+        print("\n步骤 3/4: 等待工作节点...")
+        encode_segments = generate_video and generate_images and generate_audio
+        results = self._wait_for_scenes(job_id, scenes, encode_segments)
+        
+        print("\n步骤 4/4: 合并结果...")
+        result = self._merge(job_id, characters, scenes, results, encode_segments)
+        
+        print("\n" + "=" * 50)
+        print("✓ 动漫生成完成！")
+        if result.get("video_path"):
+            print(f"✓ 视频已保存到: {result['video_path']}")
+        print("=" * 50)
+        return result
+    
+    def _wait_for_scenes(self, job_id: str, scenes: List, encode_segments: bool) -> Dict[str, Dict]:
+        last_report = 0.0
+        while True:
+            results = self.queue.results(job_id)
+            
+            # 场景图片与音频都完成后立即提交该场景的视频段编码
+            if encode_segments:
+                for scene in scenes:
+                    key = f"{scene.scene_number:03d}"
+                    image = results.get(f"{job_id}:image:{key}")
+                    audio = results.get(f"{job_id}:audio:{key}")
+                    if f"{job_id}:segment:{key}" in results or not self._finished(image) or not self._finished(audio):
+                        continue
+                    image_asset = self._asset(image)
+                    if not image_asset:
+                        continue
+                    self.queue.put(SceneTask(job_id, "segment", key, {
+                        "scene_number": scene.scene_number,
+                        "image": image_asset,
+                        "audio": self._asset(audio),
+                        "asset_name": f"segment_{key}.mp4"
+                    }))
+                results = self.queue.results(job_id)
+            
+            pending = [task_id for task_id, entry in results.items() if not self._finished(entry)]
+            waiting_segments = encode_segments and any(
+                self._asset(results.get(f"{job_id}:image:{scene.scene_number:03d}"))
+                and f"{job_id}:segment:{scene.scene_number:03d}" not in results
+                for scene in scenes
+            )
+            done = len(results) - len(pending)
+            self._report_progress(30 + int(60 * done / max(len(results), 1)), f"工作单元 {done}/{len(results)} 已完成")
+            if not pending and not waiting_segments:
+                return results
+            
+            if time.monotonic() - last_report >= 10:
+                print(f"  … {done}/{len(results)} 个工作单元已完成")
+                last_report = time.monotonic()
+            time.sleep(self.poll_interval)
+    
+    def _merge(self, job_id: str, characters: List, scenes: List, results: Dict[str, Dict], encode_segments: bool) -> Dict:
+        # 把共享存储中的素材复制到本地输出目录，目录结构与单机生成一致，预览页可直接使用
+        images_dir = self.output_dir / "images"
+        audio_dir = self.output_dir / "audio"
+        
+        character_refs = {}
+        for char in characters:
+            path = self._collect(job_id, results.get(f"{job_id}:reference:{char.name}"), images_dir)
+            if path:
+                character_refs[char.name] = path
+        
+        scene_log = SceneLog(str(self.output_dir))
+        scene_log.reset()
+        segment_names = []
+        for scene in scenes:
+            key = f"{scene.scene_number:03d}"
+            scene_log.append(SceneRecord(
+                scene_number=scene.scene_number,
+                setting=scene.setting,
+                narration=scene.narration,
+                characters=scene.characters,
+                dialogue=scene.dialogue,
+                image_path=self._collect(job_id, results.get(f"{job_id}:image:{key}"), images_dir),
+                audio_path=self._collect(job_id, results.get(f"{job_id}:audio:{key}"), audio_dir)
+            ))
+            segment_name = self._asset(results.get(f"{job_id}:segment:{key}"))
+            if segment_name:
+                segment_names.append(segment_name)
+        
+        workers = sorted({entry["worker"] for entry in results.values() if entry.get("worker")})
+        result = {
+            "characters": [asdict(char) for char in characters],
+            "character_references": character_refs,
+            "scenes_file": SCENES_FILE,
+            "total_scenes": scene_log.count,
+            "llm_usage": self.parser.usage.snapshot(),
+            "distributed": {
+                "job_id": job_id,
+                "workers": workers,
+                "failed_tasks": sorted(task_id for task_id, entry in results.items() if entry["status"] == "failed")
+            }
+        }
+        
+        if encode_segments:
+            video_path = self._concat(job_id, segment_names)
+            if video_path:
+                result["video_path"] = video_path
+        
+        scene_log.publish()
+        metadata_path = self.output_dir / METADATA_NAME
+        with open(metadata_path, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        precompress(str(metadata_path))
+        print(f"✓ 元数据已保存到: {metadata_path}")
+        return result
+    
+    def generate_preview_html(self) -> str:
+        # 合并后的输出目录与单机生成一致，直接复用单机的预览页生成
+        from anime_generator import AnimeGenerator
+        return AnimeGenerator(output_dir=str(self.output_dir)).generate_preview_html()
+    
+    def _concat(self, job_id: str, segment_names: List[str]) -> Optional[str]:
+        from video_generator import VideoGenerator
+        
+        generator = VideoGenerator(output_dir=str(self.output_dir))
+        temp_dir = generator.output_dir / "temp"
+        # concat_segments 会删除输入文件，先把视频段复制到本地
+        segment_files = [self.store.fetch(job_id, name, temp_dir / name) for name in segment_names]
+        return generator.concat_segments(segment_files, generator.output_dir / "anime_output.mp4")
+    
+    def _collect(self, job_id: str, entry: Optional[Dict], target_dir: Path) -> Optional[str]:
+        name = self._asset(entry)
+        if not name:
+            return None
+        target = target_dir / name
+        target_dir.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(self.store.path(job_id, name), target)
+        return str(target)
+    
+    def _finished(self, entry: Optional[Dict]) -> bool:
+        return entry is not None and entry["status"] in ("done", "failed")
+    
+    def _asset(self, entry: Optional[Dict]) -> Optional[str]:
+        if not entry or entry["status"] != "done" or not entry.get("result"):
+            return None
+        return entry["result"].get("asset")
+    
+    def _report_progress(self, progress: int, message: str):
+        if self.progress_callback:
+            self.progress_callback(progress, message)
@@ -0,0 +1,250 @@
+import itertools
+import subprocess
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, List, Optional
+from config import settings
+
+
+# 失败时只保留 stderr 的最后若干行用于诊断，长时间编码不会积累大量输出
+STDERR_TAIL_LINES = 40
+MONITOR_INTERVAL = 0.5
+
+
+class TaskCancelled(Exception):
+    pass
+
+
+class CancelToken:
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._processes = set()
+    
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+    
+    def cancel(self):
+        # 设置取消标志并立即终止该任务正在运行的 ffmpeg 进程；排队中的工作在开始前检查标志
+        with self._lock:
+            self._event.set()
+            processes = list(self._processes)
+        for process in processes:
+            _kill(process)
+    
+    def attach(self, process: subprocess.Popen) -> bool:
+        with self._lock:
+            if self._event.is_set():
+                return False
+            self._processes.add(process)
+            return True
+    
+    def detach(self, process: subprocess.Popen):
+        with self._lock:
+            self._processes.discard(process)
+
+
+def _kill(process: subprocess.Popen):
+    try:
+        process.kill()
+    except OSError:
+        pass
+
+
+def _parse_seconds(block: Dict[str, str]) -> Optional[float]:
+    # 旧版本 ffmpeg 的 out_time_ms 实际单位也是微秒
+    for key in ("out_time_us", "out_time_ms"):
+        value = block.get(key, "")
+        if value.isdigit():
+            return int(value) / 1000000
+    return None
+
+
+def _parse_float(value: Optional[str]) -> Optional[float]:
+    try:
+        return float(value.rstrip("x"))
+    except (AttributeError, ValueError):
+        return None
+
+
+class Encode:
+    def __init__(self, encode_id: int, label: str, process: subprocess.Popen, timeout: float, duration: Optional[float]):
+        self.encode_id = encode_id
+        self.label = label
+        self.process = process
+        self.timeout = timeout
+        self.duration = duration
+        self.started_at = time.monotonic()
+        self.last_activity = self.started_at
+        self.outcome = None
+        self.progress: Dict = {}
+    
+    def update(self, block: Dict[str, str]) -> Dict:
+        out_time = _parse_seconds(block)
+        progress = {
+            "label": self.label,
+            "frame": int(block["frame"]) if block.get("frame", "").isdigit() else None,
+            "fps": _parse_float(block.get("fps")),
+            "speed": _parse_float(block.get("speed")),
+            "out_time": out_time,
+            "percent": None
+        }
+        if out_time is not None and self.duration:
+            progress["percent"] = min(100.0, round(out_time / self.duration * 100, 1))
+        self.progress = progress
+        self.last_activity = time.monotonic()
+        return progress
+    
+    def snapshot(self) -> Dict:
+        return dict(self.progress, label=self.label, elapsed=round(time.monotonic() - self.started_at, 1))
+
+
+class FFmpegSupervisor:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._active: Dict[int, Encode] = {}
+        self._monitor = None
+        self.stats = {"completed": 0, "failed": 0, "timed_out": 0, "stalled": 0, "cancelled": 0}
+    
+    def run(
+        self,
+        cmd: List[str],
+        label: str,
+        timeout: float = None,
+        cancel_token: Optional[CancelToken] = None,
+        on_progress: Optional[Callable[[Dict], None]] = None,
+        duration: float = None
+    ) -> subprocess.CompletedProcess:
+        if cancel_token and cancel_token.cancelled:
+            raise TaskCancelled(f"任务已取消，跳过 {label}")
+        
+        # 进度以 key=value 形式写到 stdout，每个进度块以 progress=continue/end 结尾
+        command = [cmd[0], "-nostdin", "-nostats", "-progress", "pipe:1", *cmd[1:]]
+        process = subprocess.Popen(
+            command,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            errors="replace"
+        )
+        encode = Encode(
+            next(self._ids),
+            label,
+            process,
+            settings.ffmpeg_timeout_seconds if timeout is None else timeout,
+            duration
+        )
+        if cancel_token and not cancel_token.attach(process):
+            _kill(process)
+        self._register(encode)
+        
+        stderr_tail = deque(maxlen=STDERR_TAIL_LINES)
+        stderr_reader = threading.Thread(
+            target=self._drain_stderr,
+            args=(encode, stderr_tail),
+            name=f"ffmpeg-stderr-{encode.encode_id}",
+            daemon=True
+        )
+        stderr_reader.start()
+        
+        try:
+            block = {}
+            for line in process.stdout:
+                key, _, value = line.strip().partition("=")
+                if not key:
+                    continue
+                block[key] = value
+                if key == "progress":
+                    progress = encode.update(block)
+                    block = {}
+                    if on_progress:
+                        on_progress(progress)
+            returncode = process.wait()
+            stderr_reader.join()
+        finally:
+            if process.poll() is None:
+                _kill(process)
+                process.wait()
+            if cancel_token:
+                cancel_token.detach(process)
+            self._unregister(encode)
+        
+        if cancel_token and cancel_token.cancelled:
+            encode.outcome = "cancelled"
+        self._record(encode.outcome or ("completed" if returncode == 0 else "failed"))
+        if encode.outcome == "cancelled":
+            raise TaskCancelled(f"任务已取消，已终止 {label}")
+        
+        stderr = "\n".join(stderr_tail)
+        if encode.outcome == "timed_out":
+            stderr += f"\n编码超过 {encode.timeout:.0f} 秒，已终止"
+        elif encode.outcome == "stalled":
+            stderr += f"\n编码 {settings.ffmpeg_stall_seconds:.0f} 秒没有进展，已终止"
+        return subprocess.CompletedProcess(command, returncode, "", stderr)
+    
+    def _drain_stderr(self, encode: Encode, stderr_tail: deque):
+        for line in encode.process.stderr:
+            stderr_tail.append(line.rstrip())
+            encode.last_activity = time.monotonic()
+    
+    def _register(self, encode: Encode):
+        with self._lock:
+            self._active[encode.encode_id] = encode
+            if self._monitor is None:
+                self._monitor = threading.Thread(target=self._monitor_loop, name="ffmpeg-monitor", daemon=True)
+                self._monitor.start()
+    
+    def _unregister(self, encode: Encode):
+        with self._lock:
+            self._active.pop(encode.encode_id, None)
+    
+    def _record(self, outcome: str):
+        with self._lock:
+            self.stats[outcome] += 1
+    
+    def _monitor_loop(self):
+        # 一个监控线程负责所有编码的超时与停滞检测，超限的进程被终止后由 run() 报告失败
+        while True:
+            time.sleep(MONITOR_INTERVAL)
+            now = time.monotonic()
+            with self._lock:
+                encodes = list(self._active.values())
+            for encode in encodes:
+                if encode.outcome is not None:
+                    continue
+                if encode.timeout > 0 and now - encode.started_at > encode.timeout:
+                    encode.outcome = "timed_out"
+                elif settings.ffmpeg_stall_seconds > 0 and now - encode.last_activity > settings.ffmpeg_stall_seconds:
+                    encode.outcome = "stalled"
+                else:
+                    continue
+                print(f"⚠️ ffmpeg 编码 {encode.label} {'超时' if encode.outcome == 'timed_out' else '停滞'}，已终止")
+                _kill(encode.process)
+    
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                "active": [encode.snapshot() for encode in self._active.values()],
+                "timeout_seconds": settings.ffmpeg_timeout_seconds,
+                "stall_seconds": settings.ffmpeg_stall_seconds,
+                **self.stats
+            }
+
+
+_supervisor: Optional[FFmpegSupervisor] = None
+_supervisor_lock = threading.Lock()
+
+
+def get_supervisor() -> FFmpegSupervisor:
+    global _supervisor
+    with _supervisor_lock:
+        if _supervisor is None:
+            _supervisor = FFmpegSupervisor()
+        return _supervisor
+
+
+def run_ffmpeg(cmd: List[str], label: str, **kwargs) -> subprocess.CompletedProcess:
+    return get_supervisor().run(cmd, label, **kwargs)
@@ -1,42 +1,77 @@
 import os
-import base64
+import shutil
+import threading
 from pathlib import Path
-from typing import List, Optional
-from openai import OpenAI, APITimeoutError, RateLimitError, APIError
+from typing import List, Optional, Union
 from config import settings
+from clients import get_openai_client, get_http_session, uses_qiniu
+from rate_limiter import get_limiter
 from character_manager import CharacterManager
 from novel_parser import Scene
-import requests
+from prompt_compiler import PromptCompiler
+from request_coalescer import coalescer, request_key
+from process_pool import get_cpu_pool
+from image_reuse import SceneSignature, get_reuse_index
 import time
 import logging
 
 # 配置日志
 logger = logging.getLogger(__name__)
 
+# 各模型接受的正方形尺寸（从小到大）；未列出的模型只请求 1024x1024，较小的质量档位在保存时缩小
+SUPPORTED_IMAGE_SIZES = {
+    "dall-e-2": ("256x256", "512x512", "1024x1024")
+}
+DEFAULT_IMAGE_SIZES = ("1024x1024",)
+
+
+def _side(size: str) -> int:
+    return int(size.split("x")[0])
+
+
+def request_size(size: str) -> str:
+    # 选择模型支持的、不小于目标尺寸的最小尺寸
+    supported = SUPPORTED_IMAGE_SIZES.get(settings.image_model, DEFAULT_IMAGE_SIZES)
+    for candidate in supported:
+        if _side(candidate) >= _side(size):
+            return candidate
+    return supported[-1]
+
 class ImageGenerator:
-    def __init__(self, character_manager: CharacterManager):
+    def __init__(self, character_manager: CharacterManager, output_dir: str = None):
         self.character_manager = character_manager
+        self.prompt_compiler = PromptCompiler(character_manager, settings.image_model)
         
-        if settings.qiniu_api_key:
-            self.client = OpenAI(
-                api_key=settings.qiniu_api_key,
-                base_url=settings.qiniu_base_url
-            )
-            self.use_qiniu = True
-        elif settings.openai_api_key:
-            self.client = OpenAI(api_key=settings.openai_api_key)
-            self.use_qiniu = False
-        else:
-            self.client = None
-            self.use_qiniu = False
-            
-        self.output_dir = Path(settings.output_dir) / "images"
+        self._client = None
+        self.use_qiniu = uses_qiniu()
+        
+        self.output_dir = Path(output_dir or settings.output_dir) / "images"
         self.output_dir.mkdir(parents=True, exist_ok=True)
         
         # 添加默认超时参数和重试次数
         self.api_timeout = 60  # 秒
         self.max_retries = 3
         self.retry_delay = 2  # 秒
+        self.image_size = "1024x1024"
+        # 由 AnimeGenerator 设置，按负载选择图片尺寸并限制API调用次数
+        self.policy = None
+        self.budget = None
+        # 由 AnimeGenerator 设置为所属的账户与任务，图片只在同一任务内复用
+        self.tenant = None
+        # 本生成器（即本任务）的图片复用统计，进程级统计见 get_reuse_index().snapshot()
+        self.reuse_stats = {"lookups": 0, "hits": 0}
+        self._reuse_lock = threading.Lock()
+    
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = get_openai_client()
+        return self._client
+    
+    def _current_image_size(self) -> str:
+        if self.policy:
+            return self.policy.level_for("image").image_size
+        return self.image_size
     
     def generate_scene_image(self, scene: Scene, output_filename: str) -> Optional[str]:
         if not self.client:
@@ -44,39 +79,91 @@ class ImageGenerator:
             return None
         
         prompt = self._build_scene_prompt(scene)
+        size = self._current_image_size()
+        output_path = self.output_dir / output_filename
+        
+        # 同一任务中同一地点、同一组角色的相似场景直接复用已生成的图片；没有具名角色的场景不复用
+        signature = SceneSignature.from_scene(scene, self.character_manager) if settings.image_reuse and scene.characters else None
+        if signature:
+            score = get_reuse_index().reuse(signature, size, output_path, self._reuse_owner())
+            with self._reuse_lock:
+                self.reuse_stats["lookups"] += 1
+                if score is not None:
+                    self.reuse_stats["hits"] += 1
+            if score is not None:
+                print(f"  ♻ 场景 {scene.scene_number} 与已有图片相似度 {score:.2f}，复用图片")
+                return str(output_path)
+        
+        try:
+            image_data = self._request_image(prompt, size)
+        except Exception as e:
+            logger.error(f"生成图像时出错: {e}")
+            return None
+        
+        if image_data is None:
+            return None
+        
+        if not self._save_image(image_data, output_path, size):
+            return None
+        if signature:
+            get_reuse_index().add(signature, size, str(output_path), self._reuse_owner())
+        return str(output_path)
+    
+    def _reuse_owner(self):
+        # 未设置租户时（命令行或独立使用）按输出目录区分
+        return self.tenant or str(self.output_dir)
+    
+    def _build_scene_prompt(self, scene: Scene) -> str:
+        return self.prompt_compiler.compile(scene)
+    
+    def _request_image(self, prompt: str, size: str) -> Optional[bytes]:
+        # 预算与取消按调用方各自检查：合并请求的函数不依赖任务状态，结果可安全地交给其他任务
+        if self.budget and not self.budget.charge("image"):
+            print("⚠️ 已超出任务的时间或API调用预算，跳过图像生成")
+            return None
+        
+        size = request_size(size)
+        # 并发的相同请求（同一模型、提示词和尺寸）只调用一次上游API
+        key = request_key(
+            "image",
+            provider="qiniu" if self.use_qiniu else "openai",
+            model=settings.image_model,
+            prompt=prompt,
+            size=size
+        )
+        return coalescer.run(key, self._generate_image_data, prompt, size)
+    
+    def _generate_image_data(self, prompt: str, size: str) -> Optional[Union[str, bytes]]:
+        # 七牛返回 base64 文本，解码推迟到保存时在独立进程中进行
+        from openai import APITimeoutError, RateLimitError, APIError
         
         # 使用重试逻辑
         for attempt in range(self.max_retries):
             try:
-                if self.use_qiniu:
-                    response = self.client.images.generate(
-                        model=settings.image_model,
-                        prompt=prompt,
-                        size="1024x1024",
-                        n=1,
-                        response_format="b64_json",
-                        timeout=self.api_timeout  # 添加超时参数
-                    )
-                    
-                    image_data = response.data[0].b64_json
-                    output_path = self.output_dir / output_filename
-                    self._save_base64_image(image_data, output_path)
-                else:
-                    response = self.client.images.generate(
-                        model=settings.image_model,
-                        prompt=prompt,
-                        size="1024x1024",
-                        quality="standard",
-                        n=1,
-                        timeout=self.api_timeout  # 添加超时参数
-                    )
-                    
-                    image_url = response.data[0].url
-                    output_path = self.output_dir / output_filename
-                    self._download_image(image_url, output_path)
-                
-                return str(output_path)
-                
+                with get_limiter("image"):
+                    if self.use_qiniu:
+                        response = self.client.images.generate(
+                            model=settings.image_model,
+                            prompt=prompt,
+                            size=size,
+                            n=1,
+                            response_format="b64_json",
+                            timeout=self.api_timeout  # 添加超时参数
+                        )
+                        
+                        return response.data[0].b64_json
+                    else:
+                        response = self.client.images.generate(
+                            model=settings.image_model,
+                            prompt=prompt,
+                            size=size,
+                            quality="standard",
+                            n=1,
+                            timeout=self.api_timeout  # 添加超时参数
+                        )
+                        
+                        return self._download_image(response.data[0].url)
+            
             except APITimeoutError:
                 if attempt < self.max_retries - 1:
                     wait_time = self.retry_delay * (2 ** attempt)
@@ -96,57 +183,21 @@ class ImageGenerator:
             except APIError as e:
                 logger.error(f"⚠️ OpenAI API错误: {e}")
                 return None
-            except Exception as e:
-                logger.error(f"生成图像时出错: {e}")
-                return None
     
-    def _build_scene_prompt(self, scene: Scene) -> str:
-        character_descriptions = []
-        for char_name in scene.characters:
-            char_prompt = self.character_manager.get_character_prompt_for_scene(
-                char_name, 
-                scene.setting
-            )
-            if char_prompt:
-                character_descriptions.append(f"{char_name}: {char_prompt}")
-        
-        prompt_parts = [
-            "anime style scene,",
-            scene.image_prompt,
-            f"setting: {scene.setting}",
-        ]
-        
-        if character_descriptions:
-            prompt_parts.append("characters: " + "; ".join(character_descriptions))
-        
-        prompt_parts.extend([
-            "high quality anime art style",
-            "consistent character design",
-            "detailed background",
-            "cinematic composition"
-        ])
-        
-        final_prompt = " ".join(prompt_parts)
-        
-        if len(final_prompt) > 1000:
-            final_prompt = final_prompt[:1000]
-        
-        return final_prompt
-    
-    def _save_base64_image(self, b64_data: str, output_path: Path):
-        image_bytes = base64.b64decode(b64_data)
-        with open(output_path, 'wb') as f:
-            f.write(image_bytes)
+    def _save_image(self, image_data: Union[str, bytes], output_path: Path, size: str) -> bool:
+        # 解码、校验与写文件在独立进程中完成，不阻塞Web与I/O线程
+        try:
+            get_cpu_pool().store_image(image_data, str(output_path), _side(size))
+        except Exception as e:
+            logger.error(f"保存图像失败（返回的数据不是有效图片）: {e}")
+            return False
         print(f"✓ 图像已保存到: {output_path}")
+        return True
     
-    def _download_image(self, url: str, output_path: Path):
-        response = requests.get(url, timeout=self.api_timeout)
+    def _download_image(self, url: str) -> bytes:
+        response = get_http_session().get(url, timeout=self.api_timeout)
         response.raise_for_status()
-        
-        with open(output_path, 'wb') as f:
-            f.write(response.content)
-        
-        print(f"✓ 图像已保存到: {output_path}")
+        return response.content
     
     def generate_character_reference(self, character_name: str) -> Optional[str]:
         if not self.client:
@@ -157,57 +208,29 @@ class ImageGenerator:
         if not profile:
             return None
         
-        # 使用重试逻辑
-        for attempt in range(self.max_retries):
-            try:
-                output_path = self.output_dir / f"character_ref_{character_name}.png"
-                
-                if self.use_qiniu:
-                    response = self.client.images.generate(
-                        model=settings.image_model,
-                        prompt=profile.reference_prompt,
-                        size="1024x1024",
-                        n=1,
-                        response_format="b64_json",
-                        timeout=self.api_timeout  # 添加超时参数
-                    )
-                    
-                    image_data = response.data[0].b64_json
-                    self._save_base64_image(image_data, output_path)
-                else:
-                    response = self.client.images.generate(
-                        model=settings.image_model,
-                        prompt=profile.reference_prompt,
-                        size="1024x1024",
-                        quality="standard",
-                        n=1,
-                        timeout=self.api_timeout  # 添加超时参数
-                    )
-                    
-                    image_url = response.data[0].url
-                    self._download_image(image_url, output_path)
-                
-                return str(output_path)
-                
-            except APITimeoutError:
-                if attempt < self.max_retries - 1:
-                    wait_time = self.retry_delay * (2 ** attempt)
-                    logger.warning(f"⚠️ API请求超时，{wait_time}秒后重试 (尝试 {attempt+1}/{self.max_retries})")
-                    time.sleep(wait_time)
-                else:
-                    logger.error(f"❌ API请求超时，已达到最大重试次数 ({self.max_retries})")
-                    return None
-            except RateLimitError:
-                if attempt < self.max_retries - 1:
-                    wait_time = self.retry_delay * (2 ** attempt)
-                    logger.warning(f"⚠️ API速率限制，{wait_time}秒后重试 (尝试 {attempt+1}/{self.max_retries})")
-                    time.sleep(wait_time)
-                else:
-                    logger.error(f"❌ API速率限制，已达到最大重试次数 ({self.max_retries})")
-                    return None
-            except APIError as e:
-                logger.error(f"⚠️ OpenAI API错误: {e}")
-                return None
-            except Exception as e:
-                logger.error(f"生成角色参考图时出错: {e}")
-                return None
\ No newline at end of file
+        output_path = self.output_dir / f"character_ref_{character_name}.png"
+        
+        # 同一角色（名字与外貌一致）在续集或后续章节中直接复用已有参考图
+        registry = self.character_manager.registry
+        cached_ref = registry.reference_image(profile.registry_key)
+        if cached_ref:
+            shutil.copyfile(cached_ref, output_path)
+            print(f"✓ 复用已有角色参考图: {character_name}")
+            return str(output_path)
+        
+        size = self._current_image_size()
+        try:
+            image_data = self._request_image(profile.reference_prompt, size)
+        except Exception as e:
+            logger.error(f"生成角色参考图时出错: {e}")
+            return None
+        
+        if image_data is None:
+            return None
+        
+        if not self._save_image(image_data, output_path, size):
+            return None
+        # 负载降级时生成的小尺寸参考图只用于本任务，不写入注册表，以免之后的任务一直复用低质量的参考图
+        if size == self.image_size:
+            registry.store_reference(profile.registry_key, str(output_path))
+        return str(output_path)
@@ -0,0 +1,159 @@
+import random
+import re
+import shutil
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, FrozenSet, Hashable, List, Optional, Tuple
+from config import settings
+from character_registry import character_key
+
+
+TERM_PATTERN = re.compile(r'[a-z]{3,}|[\u4e00-\u9fff]+')
+STOPWORDS = frozenset(
+    "the and with from into onto that this their there while scene anime style high quality detailed "
+    "illustration character characters setting background view shot".split()
+)
+MAX_ENTRIES_PER_BUCKET = 200
+# 分桶按任务划分，只保留最近使用的若干个分桶
+MAX_BUCKETS = 500
+
+
+def _terms(text: str) -> FrozenSet[str]:
+    # 英文按单词，中文按相邻两字切分，得到可比较的词项集合
+    terms = set()
+    for token in TERM_PATTERN.findall(text.lower()):
+        if token.isascii():
+            if token not in STOPWORDS:
+                terms.add(token)
+        elif len(token) == 1:
+            terms.add(token)
+        else:
+            terms.update(token[i:i + 2] for i in range(len(token) - 1))
+    return frozenset(terms)
+
+
+def _jaccard(a: FrozenSet[str], b: FrozenSet[str]) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+@dataclass(frozen=True)
+class SceneSignature:
+    characters: FrozenSet[str]
+    setting: FrozenSet[str]
+    terms: FrozenSet[str]
+    
+    @classmethod
+    def from_scene(cls, scene, character_manager) -> "SceneSignature":
+        # 角色按名字与外貌的稳定摘要比较，同名但外貌不同的角色不会复用彼此的图片
+        keys = set()
+        for name in scene.characters:
+            character = character_manager.characters.get(name) if character_manager else None
+            keys.add(character_key(name, character.appearance) if character else name)
+        return cls(frozenset(keys), _terms(scene.setting), _terms(scene.image_prompt))
+    
+    def similarity(self, other: "SceneSignature") -> float:
+        # 出场角色必须完全相同且不为空（没有具名角色的场景之间缺少可靠的对应关系）；地点与画面关键词各占一半权重
+        if not self.characters or self.characters != other.characters:
+            return 0.0
+        return 0.5 * _jaccard(self.setting, other.setting) + 0.5 * _jaccard(self.terms, other.terms)
+
+
+class ImageReuseIndex:
+    def __init__(self, threshold: float = None):
+        self.threshold = settings.image_reuse_threshold if threshold is None else threshold
+        self._lock = threading.Lock()
+        # (任务, 图片尺寸, 角色集合) -> [(签名, 图片路径)]，只在同一分桶内比较，不同任务与账户之间不会复用图片
+        self._buckets: "OrderedDict[Tuple[Hashable, str, FrozenSet[str]], List[Tuple[SceneSignature, str]]]" = OrderedDict()
+        self.stats = {"lookups": 0, "hits": 0, "varied": 0}
+    
+    def find(self, signature: SceneSignature, size: str, owner: Hashable) -> Optional[Tuple[str, float]]:
+        if not signature.characters:
+            return None
+        with self._lock:
+            self.stats["lookups"] += 1
+            candidates = list(self._buckets.get((owner, size, signature.characters), []))
+        
+        best = None
+        for candidate, path in candidates:
+            score = signature.similarity(candidate)
+            if score >= self.threshold and (best is None or score > best[1]) and Path(path).exists():
+                best = (path, score)
+        return best
+    
+    def reuse(self, signature: SceneSignature, size: str, output_path: Path, owner: Hashable) -> Optional[float]:
+        match = self.find(signature, size, owner)
+        if match is None:
+            return None
+        
+        source, score = match
+        varied = settings.image_reuse_vary and score < 1.0 and _vary_image(source, output_path)
+        if not varied:
+            shutil.copyfile(source, output_path)
+        with self._lock:
+            self.stats["hits"] += 1
+            if varied:
+                self.stats["varied"] += 1
+        return score
+    
+    def add(self, signature: SceneSignature, size: str, image_path: str, owner: Hashable):
+        if not signature.characters:
+            return
+        key = (owner, size, signature.characters)
+        with self._lock:
+            bucket = self._buckets.setdefault(key, [])
+            self._buckets.move_to_end(key)
+            bucket.append((signature, image_path))
+            del bucket[:-MAX_ENTRIES_PER_BUCKET]
+            while len(self._buckets) > MAX_BUCKETS:
+                self._buckets.popitem(last=False)
+    
+    def snapshot(self) -> Dict:
+        with self._lock:
+            lookups = self.stats["lookups"]
+            return {
+                "enabled": settings.image_reuse,
+                "threshold": self.threshold,
+                "entries": sum(len(bucket) for bucket in self._buckets.values()),
+                "lookups": lookups,
+                "hits": self.stats["hits"],
+                "varied": self.stats["varied"],
+                "hit_rate": self.stats["hits"] / lookups if lookups else 0.0,
+                # 每次命中省下一次图像生成调用
+                "api_calls_saved": self.stats["hits"]
+            }
+
+
+def _vary_image(source: str, output_path: Path) -> bool:
+    # 轻微的裁切平移：画面内容不变，相邻场景不会显得完全静止
+    try:
+        from PIL import Image
+    except ImportError:
+        return False
+    
+    try:
+        with Image.open(source) as image:
+            width, height = image.size
+            rng = random.Random(str(output_path))
+            margin_x, margin_y = int(width * 0.05), int(height * 0.05)
+            left, top = rng.randint(0, margin_x), rng.randint(0, margin_y)
+            cropped = image.crop((left, top, left + width - margin_x, top + height - margin_y))
+            cropped.resize((width, height), Image.LANCZOS).save(output_path, format=image.format or "PNG")
+        return True
+    except OSError:
+        return False
+
+
+_reuse_index: Optional[ImageReuseIndex] = None
+_reuse_index_lock = threading.Lock()
+
+
+def get_reuse_index() -> ImageReuseIndex:
+    global _reuse_index
+    with _reuse_index_lock:
+        if _reuse_index is None:
+            _reuse_index = ImageReuseIndex()
+        return _reuse_index
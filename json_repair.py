@@ -0,0 +1,133 @@
+import json
+import re
+import typing
+from dataclasses import fields
+from typing import Any, Dict, List, Tuple
+
+
+FENCE_PATTERN = re.compile(r'```(?:json)?\s*\n(.*?)(?:\n```|$)', re.DOTALL)
+TRAILING_COMMA_PATTERN = re.compile(r',\s*([}\]])')
+
+
+def _strip_wrapping(text: str) -> str:
+    text = text.strip()
+    match = FENCE_PATTERN.search(text)
+    if match:
+        text = match.group(1)
+    
+    # 去掉JSON前面的说明文字
+    starts = [i for i in (text.find('['), text.find('{')) if i >= 0]
+    return text[min(starts):] if starts else text
+
+
+def _remove_trailing_commas(text: str) -> str:
+    # 只替换字符串之外的尾随逗号
+    result = []
+    in_string = escaped = False
+    for i, ch in enumerate(text):
+        if in_string:
+            result.append(ch)
+            if escaped:
+                escaped = False
+            elif ch == '\\':
+                escaped = True
+            elif ch == '"':
+                in_string = False
+            continue
+        if ch == '"':
+            in_string = True
+        elif ch == ',' and TRAILING_COMMA_PATTERN.match(text, i):
+            continue
+        result.append(ch)
+    return "".join(result)
+
+
+def _complete_items(text: str) -> Tuple[List[Any], bool]:
+    # 逐个解析顶层数组中的元素，遇到截断或损坏的元素时停止
+    decoder = json.JSONDecoder()
+    items = []
+    pos = text.find('[') + 1
+    while True:
+        while pos < len(text) and text[pos] in ' \t\r\n,':
+            pos += 1
+        if pos >= len(text):
+            return items, True
+        if text[pos] == ']':
+            return items, False
+        try:
+            item, pos = decoder.raw_decode(text, pos)
+        except json.JSONDecodeError:
+            return items, True
+        items.append(item)
+
+
+def parse_json_array(text: str) -> Tuple[List[Any], bool]:
+    # 返回 (已解析的元素, 是否不完整)；输出被截断或有元素无法解析时视为不完整
+    text = _remove_trailing_commas(_strip_wrapping(text))
+    if not text:
+        return [], True
+    
+    try:
+        # raw_decode 忽略JSON之后多余的说明文字
+        value, _ = json.JSONDecoder().raw_decode(text)
+        if isinstance(value, dict):
+            return [value], False
+        if isinstance(value, list):
+            return value, False
+    except json.JSONDecodeError:
+        pass
+    
+    if not text.startswith('['):
+        return [], True
+    return _complete_items(text)
+
+
+def _matches(value: Any, annotation: Any) -> bool:
+    origin = typing.get_origin(annotation)
+    if origin in (list, List):
+        (item_type,) = typing.get_args(annotation) or (Any,)
+        return isinstance(value, list) and all(_matches(v, item_type) for v in value)
+    if origin in (dict, Dict):
+        key_type, value_type = typing.get_args(annotation) or (Any, Any)
+        return isinstance(value, dict) and all(
+            _matches(k, key_type) and _matches(v, value_type) for k, v in value.items()
+        )
+    if annotation is Any:
+        return True
+    if annotation is int:
+        return isinstance(value, int) and not isinstance(value, bool)
+    return isinstance(value, annotation)
+
+
+def validate_item(item: Any, schema) -> List[str]:
+    # 按 dataclass 的字段与类型检查一个元素，返回错误描述列表
+    if not isinstance(item, dict):
+        return ["不是JSON对象"]
+    
+    errors = []
+    hints = typing.get_type_hints(schema)
+    for f in fields(schema):
+        if f.name not in item:
+            errors.append(f"缺少字段 {f.name}")
+        elif not _matches(item[f.name], hints[f.name]):
+            errors.append(f"字段 {f.name} 类型错误")
+    return errors
+
+
+def coerce_item(item: Dict, schema) -> Dict:
+    # 修正常见的轻微偏差：数字写成字符串、单个字符串代替列表、多余字段
+    hints = typing.get_type_hints(schema)
+    coerced = {}
+    for f in fields(schema):
+        if f.name not in item:
+            continue
+        value = item[f.name]
+        annotation = hints[f.name]
+        if annotation is int and isinstance(value, str) and value.strip().isdigit():
+            value = int(value)
+        elif annotation is str and isinstance(value, (int, float)):
+            value = str(value)
+        elif typing.get_origin(annotation) in (list, List) and isinstance(value, str):
+            value = [value] if value else []
+        coerced[f.name] = value
+    return coerced
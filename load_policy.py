@@ -0,0 +1,115 @@
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass
+from typing import Dict, Optional
+from config import settings
+from scheduler import Tenant, get_scheduler
+from ffmpeg_supervisor import CancelToken
+
+
+@dataclass(frozen=True)
+class QualityLevel:
+    name: str
+    image_size: str
+    audio_bitrate: str
+    x264_preset: str
+    character_references: bool
+
+
+# 按负载从低到高排列，越靠后越便宜
+QUALITY_LEVELS = (
+    QualityLevel("full", "1024x1024", "160k", "medium", True),
+    QualityLevel("reduced", "768x768", "96k", "veryfast", True),
+    QualityLevel("minimal", "512x512", "64k", "ultrafast", False),
+)
+
+
+class TaskBudget:
+    def __init__(self, deadline_seconds: float = 0, api_calls: int = 0, cancel_token: Optional[CancelToken] = None):
+        self.deadline_seconds = deadline_seconds
+        self.api_calls = api_calls
+        self.cancel_token = cancel_token or CancelToken()
+        self.started_at = time.monotonic()
+        self._lock = threading.Lock()
+        self.calls = Counter()
+        self.refused = Counter()
+
+    @classmethod
+    def from_settings(cls, cancel_token: Optional[CancelToken] = None) -> "TaskBudget":
+        return cls(settings.task_deadline_seconds, settings.task_api_call_budget, cancel_token)
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started_at
+
+    def remaining_fraction(self) -> float:
+        if self.deadline_seconds <= 0:
+            return 1.0
+        return max(0.0, 1.0 - self.elapsed() / self.deadline_seconds)
+
+    def expired(self) -> bool:
+        # 取消的任务与超时的任务一样不再发起新的调用
+        if self.cancel_token.cancelled:
+            return True
+        return self.deadline_seconds > 0 and self.elapsed() >= self.deadline_seconds
+
+    def charge(self, resource: str) -> bool:
+        # 超过截止时间或API调用预算后拒绝新的调用，任务用已有素材尽快收尾
+        with self._lock:
+            over_calls = self.api_calls > 0 and sum(self.calls.values()) >= self.api_calls
+            if over_calls or self.expired():
+                self.refused[resource] += 1
+                return False
+            self.calls[resource] += 1
+            return True
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                "deadline_seconds": self.deadline_seconds,
+                "api_call_budget": self.api_calls,
+                "elapsed": self.elapsed(),
+                "calls": dict(self.calls),
+                "refused": dict(self.refused),
+                "cancelled": self.cancel_token.cancelled
+            }
+
+
+class LoadPolicy:
+    def __init__(self, budget: Optional[TaskBudget] = None, tenant: Optional[Tenant] = None):
+        self.budget = budget
+        self.tenant = tenant
+        self._lock = threading.Lock()
+        self.decisions: Dict[str, Counter] = {}
+
+    def backlog(self, resource: str) -> float:
+        queue = get_scheduler().queues[resource]
+        # 长篇小说一次提交全部场景，按自身排队数计算会让空闲服务器上的任务中途自行降级
+        queued = queue.queued_by_others(self.tenant) if self.tenant else queue.depth()["queued"]
+        return queued / queue.workers
+
+    def level_for(self, resource: str) -> QualityLevel:
+        index = 0
+        if settings.adaptive_quality:
+            backlog = self.backlog(resource)
+            if backlog >= settings.quality_minimal_backlog:
+                index = 2
+            elif backlog >= settings.quality_reduced_backlog:
+                index = 1
+
+        # 临近截止时间时不再等待高质量结果
+        if self.budget and self.budget.deadline_seconds > 0:
+            remaining = self.budget.remaining_fraction()
+            if remaining <= 0.25:
+                index = 2
+            elif remaining <= 0.5:
+                index = max(index, 1)
+
+        level = QUALITY_LEVELS[index]
+        with self._lock:
+            self.decisions.setdefault(resource, Counter())[level.name] += 1
+        return level
+
+    def snapshot(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            return {resource: dict(counts) for resource, counts in self.decisions.items()}
@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+
+USER_THREAD_PREFIX = "loadtest-user-"
+
+
+def percentile(samples: List[float], p: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+
+def current_rss_mb() -> float:
+    # Linux 下读取 /proc 获得当前常驻内存，其他平台退回到峰值
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    except (OSError, ValueError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+class LatencyRecorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+    
+    def record(self, endpoint: str, elapsed_ms: float, ok: bool):
+        with self._lock:
+            self.samples.setdefault(endpoint, []).append(elapsed_ms)
+            self.errors.setdefault(endpoint, 0)
+            if not ok:
+                self.errors[endpoint] += 1
+    
+    def summary(self) -> Dict[str, Dict]:
+        with self._lock:
+            return {
+                endpoint: {
+                    "requests": len(samples),
+                    "errors": self.errors[endpoint],
+                    "error_rate": self.errors[endpoint] / len(samples),
+                    "p50_ms": percentile(samples, 0.5),
+                    "p95_ms": percentile(samples, 0.95),
+                    "p99_ms": percentile(samples, 0.99),
+                    "max_ms": max(samples)
+                }
+                for endpoint, samples in self.samples.items()
+            }
+
+
+class ResourceSampler:
+    # 周期性记录服务端线程数（排除模拟用户的线程）与进程内存
+    def __init__(self, interval: float = 0.5):
+        self.interval = interval
+        self.thread_counts: List[int] = []
+        self.rss_mb: List[float] = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="loadtest-sampler", daemon=True)
+    
+    def start(self):
+        self.rss_mb.append(current_rss_mb())
+        self._thread.start()
+    
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.rss_mb.append(current_rss_mb())
+    
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            server_threads = [
+                t for t in threading.enumerate()
+                if not t.name.startswith(USER_THREAD_PREFIX) and t is not self._thread
+            ]
+            self.thread_counts.append(len(server_threads))
+            self.rss_mb.append(current_rss_mb())
+    
+    def summary(self) -> Dict:
+        return {
+            "peak_threads": max(self.thread_counts, default=threading.active_count()),
+            "rss_start_mb": self.rss_mb[0],
+            "rss_peak_mb": max(self.rss_mb),
+            "rss_end_mb": self.rss_mb[-1],
+            "memory_growth_mb": self.rss_mb[-1] - self.rss_mb[0]
+        }
+
+
+def install_mock_backends(args):
+    # 替换 LLM、图像、TTS 与 ffmpeg 调用，只保留固定延迟，Web层、调度器与文件写入照常运行
+    import novel_parser
+    import image_generator
+    import audio_generator
+    import video_generator
+    from PIL import Image
+    
+    buffer = io.BytesIO()
+    Image.new("RGB", (64, 64), (200, 80, 80)).save(buffer, format="PNG")
+    png_bytes = buffer.getvalue()
+    mp3_bytes = b"\xff\xfb\x90\x64" + b"\x00" * 413
+    
+    def delayed(func, seconds):
+        def wrapper(*a, **kw):
+            time.sleep(seconds * random.uniform(0.5, 1.5))
+            return func(*a, **kw)
+        return wrapper
+    
+    parser_class = novel_parser.NovelParser
+    parser_class.client = property(lambda self: None)
+    parser_class.extract_characters = delayed(parser_class.extract_characters, args.llm_latency)
+    parser_class.split_into_scenes = delayed(parser_class.split_into_scenes, args.llm_latency)
+    
+    image_generator.ImageGenerator.client = property(lambda self: object())
+    image_generator.ImageGenerator._generate_image_data = delayed(lambda self, prompt, size: png_bytes, args.image_latency)
+    audio_generator.AudioGenerator._request_tts = delayed(lambda self, text, voice: mp3_bytes, args.tts_latency)
+    
+    def stitch_lines(self, line_paths, output_path):
+        with open(output_path, 'wb') as out:
+            for path in line_paths:
+                out.write(Path(path).read_bytes())
+    audio_generator.AudioGenerator._stitch_lines = stitch_lines
+    
+    def encode_segment(self, segment_key, image_path, audio_path, profile="final"):
+        time.sleep(args.video_latency * random.uniform(0.5, 1.5))
+        temp_dir = self.output_dir / "temp"
+        temp_dir.mkdir(parents=True, exist_ok=True)
+        suffix = "" if profile == "final" else f"_{profile}"
+        path = temp_dir / f"segment_{segment_key:03d}{suffix}.mp4"
+        path.write_bytes(b"\x00" * 1024)
+        return path
+    
+    def write_video(self, output_path):
+        Path(output_path).write_bytes(b"\x00" * 4096)
+        return str(output_path)
+    
+    video_generator.VideoGenerator.encode_segment = encode_segment
+    video_generator.VideoGenerator.concat_segments = lambda self, files, output_path: write_video(self, output_path)
+    video_generator.VideoGenerator.generate_video_from_scenes = (
+        lambda self, scenes, output_filename="anime_output.mp4", **kw: write_video(self, self.output_dir / output_filename)
+    )
+
+
+def start_local_server(args, work_dir: str) -> str:
+    from config import settings
+    
+    # 输出与缓存写到临时目录，不影响正式数据；关闭后台清理，避免干扰测量
+    settings.output_dir = str(Path(work_dir) / "output")
+    settings.cache_dir = str(Path(work_dir) / "cache")
+    settings.gc_interval_seconds = 0
+    install_mock_backends(args)
+    
+    if args.server == "asgi":
+        import uvicorn
+        import asgi_app
+        
+        config = uvicorn.Config(asgi_app.app, host="127.0.0.1", port=0, log_level="warning",
+                                backlog=settings.asgi_backlog, access_log=False)
+        server = uvicorn.Server(config)
+        threading.Thread(target=server.run, name="loadtest-server", daemon=True).start()
+        while not server.started:
+            time.sleep(0.05)
+        port = server.servers[0].sockets[0].getsockname()[1]
+    else:
+        from werkzeug.serving import make_server
+        import app
+        
+        logging.getLogger("werkzeug").setLevel(logging.WARNING)
+        # 与 python app.py 相同：每个请求一个线程
+        server = make_server("127.0.0.1", 0, app.app, threaded=True)
+        threading.Thread(target=server.serve_forever, name="loadtest-server", daemon=True).start()
+        port = server.server_port
+    return f"http://127.0.0.1:{port}"
+
+
+def simulate_user(user_id: int, base_url: str, args, recorder: LatencyRecorder, outcomes: Dict):
+    import requests
+    
+    session = requests.Session()
+    time.sleep(random.uniform(0, args.ramp))
+    # 每个用户提交不同的文本，避免被相同小说的任务合并
+    paragraphs = [f"第{user_id}号读者的故事，第{n + 1}幕。主角走进新的场景，发生了新的事情。" for n in range(args.scenes)]
+    
+    started = time.perf_counter()
+    try:
+        response = session.post(f"{base_url}/api/generate", json={"novel_text": "\n\n".join(paragraphs)}, timeout=args.request_timeout)
+        recorder.record("generate", (time.perf_counter() - started) * 1000, response.ok)
+        task_id = response.json().get("task_id") if response.ok else None
+    except (requests.RequestException, ValueError):
+        recorder.record("generate", (time.perf_counter() - started) * 1000, False)
+        task_id = None
+    if not task_id:
+        outcomes[user_id] = "submit_failed"
+        return
+    
+    # 与 templates/index.html 相同的定时轮询
+    deadline = started + args.job_timeout
+    while time.perf_counter() < deadline:
+        time.sleep(args.poll_interval)
+        poll_started = time.perf_counter()
+        try:
+            response = session.get(f"{base_url}/api/status/{task_id}", timeout=args.request_timeout)
+            recorder.record("status", (time.perf_counter() - poll_started) * 1000, response.ok)
+            status = response.json().get("status") if response.ok else None
+        except (requests.RequestException, ValueError):
+            recorder.record("status", (time.perf_counter() - poll_started) * 1000, False)
+            continue
+        if status in ("completed", "error"):
+            outcomes[user_id] = status
+            recorder.record("job", (time.perf_counter() - started) * 1000, status == "completed")
+            return
+    outcomes[user_id] = "timeout"
+
+
+def check_thresholds(report: Dict, args) -> List[str]:
+    breaches = []
+    for endpoint in ("generate", "status"):
+        stats = report["endpoints"].get(endpoint)
+        if not stats:
+            continue
+        if args.max_p99_ms and stats["p99_ms"] > args.max_p99_ms:
+            breaches.append(f"{endpoint} p99 {stats['p99_ms']:.0f}ms > {args.max_p99_ms:.0f}ms")
+        if stats["error_rate"] > args.max_error_rate:
+            breaches.append(f"{endpoint} 错误率 {stats['error_rate']:.2%} > {args.max_error_rate:.2%}")
+    
+    unfinished = sum(1 for outcome in report["outcomes"].values() if outcome != "completed")
+    if unfinished / max(args.users, 1) > args.max_error_rate:
+        breaches.append(f"{unfinished}/{args.users} 个任务未完成")
+    
+    process = report.get("process")
+    if process:
+        if args.max_threads and process["peak_threads"] > args.max_threads:
+            breaches.append(f"线程数峰值 {process['peak_threads']} > {args.max_threads}")
+        if args.max_memory_growth_mb and process["memory_growth_mb"] > args.max_memory_growth_mb:
+            breaches.append(f"内存增长 {process['memory_growth_mb']:.1f}MB > {args.max_memory_growth_mb:.1f}MB")
+    return breaches
+
+
+def print_report(report: Dict):
+    print("\n📊 压测结果:")
+    print(f"  - 用户数: {report['users']}，耗时 {report['elapsed']:.1f}s")
+    for endpoint, stats in report["endpoints"].items():
+        print(f"  - {endpoint}: {stats['requests']} 次，错误率 {stats['error_rate']:.2%}，"
+              f"p50 {stats['p50_ms']:.0f}ms / p95 {stats['p95_ms']:.0f}ms / p99 {stats['p99_ms']:.0f}ms / max {stats['max_ms']:.0f}ms")
+    counts: Dict[str, int] = {}
+    for outcome in report["outcomes"].values():
+        counts[outcome] = counts.get(outcome, 0) + 1
+    print(f"  - 任务结果: {', '.join(f'{k} {v}' for k, v in sorted(counts.items()))}")
+    process = report.get("process")
+    if process:
+        print(f"  - 服务端线程峰值: {process['peak_threads']}")
+        print(f"  - 内存: 起始 {process['rss_start_mb']:.1f}MB，峰值 {process['rss_peak_mb']:.1f}MB，"
+              f"结束 {process['rss_end_mb']:.1f}MB（增长 {process['memory_growth_mb']:.1f}MB）")
+
+
+def run(args) -> Dict:
+    work_dir = tempfile.mkdtemp(prefix="anime-loadtest-")
+    sampler: Optional[ResourceSampler] = None
+    if args.target:
+        base_url = args.target.rstrip("/")
+    else:
+        base_url = start_local_server(args, work_dir)
+        sampler = ResourceSampler()
+        sampler.start()
+    print(f"🚀 {args.users} 个用户 → {base_url}（{'外部服务' if args.target else args.server + ' + 模拟后端'}）")
+    
+    recorder = LatencyRecorder()
+    outcomes: Dict[int, str] = {}
+    started = time.perf_counter()
+    users = [
+        threading.Thread(
+            target=simulate_user,
+            args=(user_id, base_url, args, recorder, outcomes),
+            name=f"{USER_THREAD_PREFIX}{user_id}",
+            daemon=True
+        )
+        for user_id in range(args.users)
+    ]
+    # 生成过程的输出写入日志文件，终端只显示压测结果
+    with open(Path(work_dir) / "server.log", 'w', encoding='utf-8') as log, contextlib.redirect_stdout(log):
+        for thread in users:
+            thread.start()
+        for thread in users:
+            thread.join()
+    
+    report = {
+        "users": args.users,
+        "server": args.target or args.server,
+        "elapsed": time.perf_counter() - started,
+        "endpoints": recorder.summary(),
+        "outcomes": outcomes,
+        "work_dir": work_dir
+    }
+    if sampler:
+        sampler.stop()
+        report["process"] = sampler.summary()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="模拟多个用户提交并轮询生成任务，测量Web层的延迟、错误率、线程与内存")
+    parser.add_argument("--users", type=int, default=200, help="模拟的用户数（默认 200）")
+    parser.add_argument("--ramp", type=float, default=5.0, help="用户在该秒数内陆续开始提交（默认 5）")
+    parser.add_argument("--poll-interval", type=float, default=2.0, help="状态轮询间隔，与网页一致（默认 2 秒）")
+    parser.add_argument("--scenes", type=int, default=3, help="每部模拟小说的段落（场景）数")
+    parser.add_argument("--server", choices=["flask", "asgi"], default="flask", help="在进程内启动的服务：flask（app.py）或 asgi（asgi_app.py）")
+    parser.add_argument("--target", help="改为压测已运行的服务，例如 http://127.0.0.1:8088（不使用模拟后端，也不统计线程与内存）")
+    parser.add_argument("--llm-latency", type=float, default=1.0, help="模拟LLM调用的平均耗时（秒）")
+    parser.add_argument("--image-latency", type=float, default=2.0, help="模拟图像生成的平均耗时（秒）")
+    parser.add_argument("--tts-latency", type=float, default=0.5, help="模拟TTS请求的平均耗时（秒）")
+    parser.add_argument("--video-latency", type=float, default=0.2, help="模拟视频段编码的平均耗时（秒）")
+    parser.add_argument("--request-timeout", type=float, default=30.0, help="单个HTTP请求的超时")
+    parser.add_argument("--job-timeout", type=float, default=600.0, help="单个任务从提交到完成的最长等待时间")
+    parser.add_argument("--max-p99-ms", type=float, default=1000.0, help="generate/status 的 p99 延迟上限（毫秒，0 表示不检查）")
+    parser.add_argument("--max-error-rate", type=float, default=0.01, help="请求错误率与未完成任务比例的上限")
+    parser.add_argument("--max-threads", type=int, default=0, help="服务端线程数峰值上限（0 表示不检查）")
+    parser.add_argument("--max-memory-growth-mb", type=float, default=0, help="进程内存增长上限（0 表示不检查）")
+    parser.add_argument("--report", help="把完整结果写入该 JSON 文件")
+    args = parser.parse_args()
+    
+    report = run(args)
+    print_report(report)
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    
+    breaches = check_thresholds(report, args)
+    if breaches:
+        print("\n❌ 超出阈值:")
+        for breach in breaches:
+            print(f"  - {breach}")
+        sys.exit(1)
+    print("\n✓ 全部指标在阈值内")
+
+
+if __name__ == "__main__":
+    main()
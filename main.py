@@ -1,24 +1,167 @@
 #!/usr/bin/env python3
 
+import argparse
+import importlib
 import sys
+import time
 from pathlib import Path
-from anime_generator import AnimeGenerator
+
+
+# 启动剖析时依次导入的模块，顺序与实际生成流程中的首次使用顺序一致
+STARTUP_MODULES = [
+    "config",
+    "anime_generator",
+    "novel_parser",
+    "clients",
+    "image_generator",
+    "audio_generator",
+    "video_generator",
+    "preview_renderer",
+    "openai",
+    "requests",
+]
+
+
+def build_arg_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description="根据小说文本生成动漫",
+        epilog=(
+            "示例:\n"
+            "  python main.py novel.txt\n"
+            "  python main.py novel.txt --no-images\n"
+            "  python main.py novel.txt --no-audio\n"
+            "  python main.py novel.txt --no-video\n"
+            "  python main.py --batch chapters/ --jobs 4\n"
+            "  python main.py --batch 'books/**/*.txt' --output-dir output/batch\n"
+            "  python main.py --resume output\n"
+            "  python main.py novel.txt --distributed\n"
+            "  python main.py novel.txt --estimate\n"
+            "  python main.py --profile-startup"
+        ),
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("novel_file", nargs="?", help="小说文本文件路径")
+    parser.add_argument("--no-images", action="store_true", help="跳过图像生成")
+    parser.add_argument("--no-audio", action="store_true", help="跳过音频生成")
+    parser.add_argument("--no-video", action="store_true", help="跳过视频生成")
+    parser.add_argument("--batch", metavar="目录或通配符", help="批量处理目录下的 .txt 文件或匹配通配符的文件")
+    parser.add_argument("--jobs", type=int, default=2, help="批量模式下同时处理的小说数量（默认 2）")
+    parser.add_argument("--output-dir", help="输出目录（批量模式下每部小说使用其中的一个子目录）")
+    parser.add_argument("--resume", metavar="输出目录", help="从该输出目录中的检查点继续中断的生成")
+    parser.add_argument("--distributed", action="store_true", help="把场景任务提交到共享队列，由 worker.py 工作节点并行处理")
+    parser.add_argument("--estimate", action="store_true", help="只打印章节、token 数与预计的场景数、API调用次数和耗时，不生成")
+    parser.add_argument("--profile-startup", action="store_true", help="打印各模块导入与首次初始化的耗时后退出")
+    return parser
+
+
+def profile_startup():
+    print("⏱ 启动耗时剖析（每行为该步骤新增的耗时）:")
+    total_start = time.perf_counter()
+    for module_name in STARTUP_MODULES:
+        already_loaded = module_name in sys.modules
+        start = time.perf_counter()
+        try:
+            importlib.import_module(module_name)
+        except ImportError as e:
+            print(f"  - import {module_name}: 失败 ({e})")
+            continue
+        elapsed = (time.perf_counter() - start) * 1000
+        note = "（已由前面的模块加载）" if already_loaded else ""
+        print(f"  - import {module_name}: {elapsed:.1f} ms{note}")
+    
+    from anime_generator import AnimeGenerator
+    from video_generator import probe_ffmpeg
+    
+    start = time.perf_counter()
+    AnimeGenerator()
+    print(f"  - AnimeGenerator(): {(time.perf_counter() - start) * 1000:.1f} ms")
+    
+    for label in ("首次", "缓存"):
+        start = time.perf_counter()
+        capabilities = probe_ffmpeg()
+        print(f"  - ffmpeg 探测（{label}）: {(time.perf_counter() - start) * 1000:.1f} ms")
+    if capabilities.available:
+        print(f"    {capabilities.version}，{len(capabilities.encoders)} 个编码器，硬件加速: {', '.join(sorted(capabilities.hwaccels)) or '无'}")
+    
+    print(f"  - 合计: {(time.perf_counter() - total_start) * 1000:.1f} ms")
+
+
+def print_estimate(novel_text: str):
+    from novel_index import get_index, estimate_job
+    
+    index = get_index(novel_text)
+    estimate = estimate_job(index)
+    print(f"📏 {index.chars} 字，约 {index.tokens} tokens，{len(index.paragraphs)} 段，{len(index.chapters)} 章")
+    for chapter in index.chapters:
+        print(f"  - {chapter.title}: {chapter.chars} 字，约 {chapter.tokens} tokens")
+    source = f"基于最近 {estimate.samples} 个任务" if estimate.samples else "无历史记录，使用默认经验值"
+    print(f"预计（{source}）: {estimate.scenes} 个场景，{estimate.llm_calls} 次LLM调用，"
+          f"{estimate.api_calls} 次图像/TTS调用，约 {estimate.wall_seconds:.0f} 秒")
+    for reason in estimate.rejected:
+        print(f"⚠️ {reason}")
+    for n, part in enumerate(estimate.split, 1):
+        print(f"  建议拆分 {n}: {part['first_chapter']} ~ {part['last_chapter']}（约 {part['tokens']} tokens）")
+
+
+def run_batch(args):
+    from batch_runner import BatchRunner, collect_novel_files, print_batch_report
+    
+    novel_files = collect_novel_files(args.batch)
+    if not novel_files:
+        print(f"错误：'{args.batch}' 中没有找到小说文件")
+        sys.exit(1)
+    
+    print(f"📚 共 {len(novel_files)} 部小说，并发 {args.jobs}")
+    runner = BatchRunner(
+        novel_files,
+        output_root=args.output_dir,
+        jobs=args.jobs,
+        generate_images=not args.no_images,
+        generate_audio=not args.no_audio,
+        generate_video=not args.no_video
+    )
+    report = runner.run()
+    print_batch_report(report)
+    
+    if report["failed"]:
+        sys.exit(1)
 
 
 def main():
-    if len(sys.argv) < 2:
-        print("使用方法: python main.py <小说文本文件路径> [--no-images] [--no-audio] [--no-video]")
-        print("\n示例:")
-        print("  python main.py novel.txt")
-        print("  python main.py novel.txt --no-images")
-        print("  python main.py novel.txt --no-audio")
-        print("  python main.py novel.txt --no-video")
+    parser = build_arg_parser()
+    args = parser.parse_args()
+    
+    if args.profile_startup:
+        profile_startup()
+        return
+    
+    if args.batch:
+        run_batch(args)
+        return
+    
+    # 生成器及其依赖（openai、requests 等）只在真正需要时导入，--help 与参数错误可以立即返回
+    from anime_generator import AnimeGenerator
+    
+    if args.resume:
+        generator = AnimeGenerator(output_dir=args.resume)
+        try:
+            result = generator.resume()
+        except ValueError as e:
+            print(f"错误：{e}")
+            sys.exit(1)
+        generator.wait_for_final_render()
+        preview_path = generator.generate_preview_html()
+        print(f"\n💡 提示: 打开 {preview_path} 查看生成的动漫")
+        return
+    
+    if not args.novel_file:
+        parser.print_help()
         sys.exit(1)
     
-    novel_file = sys.argv[1]
-    generate_images = "--no-images" not in sys.argv
-    generate_audio = "--no-audio" not in sys.argv
-    generate_video = "--no-video" not in sys.argv
+    novel_file = args.novel_file
+    generate_images = not args.no_images
+    generate_audio = not args.no_audio
+    generate_video = not args.no_video
     
     if not Path(novel_file).exists():
         print(f"错误：文件 '{novel_file}' 不存在")
@@ -31,7 +174,15 @@ def main():
         print("错误：小说文件为空")
         sys.exit(1)
     
-    generator = AnimeGenerator()
+    if args.estimate:
+        print_estimate(novel_text)
+        return
+    
+    if args.distributed:
+        from coordinator import DistributedCoordinator
+        generator = DistributedCoordinator(output_dir=args.output_dir)
+    else:
+        generator = AnimeGenerator(output_dir=args.output_dir)
     
     result = generator.generate_from_novel(
         novel_text,
@@ -40,7 +191,10 @@ def main():
         generate_video=generate_video
     )
     
-    generator.generate_preview_html()
+    if not args.distributed:
+        # 草稿视频已可观看，等待后台的正式视频渲染完成后再生成预览页
+        generator.wait_for_final_render()
+    preview_path = generator.generate_preview_html()
     
     print("\n📊 生成统计:")
     print(f"  - 角色数量: {len(result['characters'])}")
@@ -49,7 +203,7 @@ def main():
         print(f"  - 角色参考图: {len(result['character_references'])}")
     if generate_video and result.get('video_path'):
         print(f"  - 视频: {result['video_path']}")
-    print(f"\n💡 提示: 打开 output/preview.html 查看生成的动漫")
+    print(f"\n💡 提示: 打开 {preview_path} 查看生成的动漫")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,287 @@
+import hashlib
+import json
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional
+from config import settings
+from prompt_compiler import estimate_tokens
+
+
+CHAPTER_PATTERN = re.compile(
+    r'^(第[0-9０-９零一二三四五六七八九十百千万〇两]+[章回节卷集部篇]|序章|序言|楔子|引子|尾声|后记|番外'
+    r'|chapter\s+[0-9ivxlc]+|prologue|epilogue)',
+    re.IGNORECASE
+)
+CHAPTER_TITLE_MAX_CHARS = 40
+ZERO_WIDTH_PATTERN = re.compile('[\u200b\u200c\u200d\u2060\ufeff]')
+
+# 没有历史记录时使用的经验值
+DEFAULT_RATES = {
+    "scenes_per_1k_tokens": 4.0,
+    "api_calls_per_scene": 4.0,
+    "seconds_per_scene": 15.0
+}
+HISTORY_WINDOW = 50
+INDEX_CACHE_SIZE = 8
+
+
+def normalize_text(text: str) -> str:
+    text = ZERO_WIDTH_PATTERN.sub('', text.replace('\r\n', '\n').replace('\r', '\n'))
+    lines = [line.strip() for line in text.split('\n')]
+    
+    # 网络小说常见每行一段、以全角空格缩进且没有空行，此时按行分段
+    if '' not in lines[1:-1] and sum(1 for line in lines if line) > 1:
+        return '\n\n'.join(line for line in lines if line)
+    
+    paragraphs = re.split(r'\n{2,}', '\n'.join(lines))
+    return '\n\n'.join(p for p in (p.strip() for p in paragraphs) if p)
+
+
+@dataclass
+class Chapter:
+    title: str
+    start: int
+    end: int
+    chars: int
+    tokens: int
+
+
+@dataclass
+class NovelIndex:
+    digest: str
+    paragraphs: List[str]
+    chapters: List[Chapter]
+    chars: int
+    tokens: int
+    
+    def chapter_text(self, chapter: Chapter) -> str:
+        return '\n\n'.join(self.paragraphs[chapter.start:chapter.end])
+    
+    def chunks(self, max_chars: int) -> List[str]:
+        # 片段尽量在章节边界处切开：整章放得下就并入当前片段，否则另起一段
+        if max_chars <= 0:
+            return ['\n\n'.join(self.paragraphs)] if self.paragraphs else []
+        
+        chunks = []
+        current: List[str] = []
+        current_len = 0
+        for chapter in self.chapters:
+            if current and current_len + chapter.chars > max_chars:
+                chunks.append('\n\n'.join(current))
+                current, current_len = [], 0
+            if chapter.chars > max_chars:
+                chunks.extend(pack_paragraphs(self.paragraphs[chapter.start:chapter.end], max_chars))
+                continue
+            current.extend(self.paragraphs[chapter.start:chapter.end])
+            current_len += chapter.chars
+        if current:
+            chunks.append('\n\n'.join(current))
+        return chunks
+    
+    def summary(self) -> Dict:
+        return {
+            "chars": self.chars,
+            "tokens": self.tokens,
+            "paragraphs": len(self.paragraphs),
+            "chapters": [{"title": c.title, "chars": c.chars, "tokens": c.tokens} for c in self.chapters]
+        }
+
+
+def pack_paragraphs(paragraphs: List[str], max_chars: int) -> List[str]:
+    chunks = []
+    current: List[str] = []
+    current_len = 0
+    for para in paragraphs:
+        # 单个超长段落按字数硬切，其余段落尽量保持完整
+        pieces = [para[i:i + max_chars] for i in range(0, len(para), max_chars)]
+        for piece in pieces:
+            if current and current_len + len(piece) > max_chars:
+                chunks.append('\n\n'.join(current))
+                current, current_len = [], 0
+            current.append(piece)
+            current_len += len(piece)
+    if current:
+        chunks.append('\n\n'.join(current))
+    return chunks
+
+
+def build_index(novel_text: str) -> NovelIndex:
+    paragraphs = [p for p in normalize_text(novel_text).split('\n\n') if p]
+    heading_positions = [
+        i for i, para in enumerate(paragraphs)
+        if len(para) <= CHAPTER_TITLE_MAX_CHARS and CHAPTER_PATTERN.match(para)
+    ]
+    
+    # 第一个章节标题之前的内容（或没有章节标题的全文）作为单独的一章
+    boundaries = heading_positions if heading_positions and heading_positions[0] == 0 else [0] + heading_positions
+    chapters = []
+    for n, start in enumerate(boundaries):
+        end = boundaries[n + 1] if n + 1 < len(boundaries) else len(paragraphs)
+        if start >= end:
+            continue
+        title = paragraphs[start] if start in heading_positions else ('全文' if not heading_positions else '开篇')
+        body = paragraphs[start:end]
+        chapters.append(Chapter(
+            title=title,
+            start=start,
+            end=end,
+            chars=sum(len(p) for p in body),
+            tokens=sum(estimate_tokens(p) for p in body)
+        ))
+    
+    return NovelIndex(
+        digest=hashlib.sha256(novel_text.encode('utf-8')).hexdigest(),
+        paragraphs=paragraphs,
+        chapters=chapters,
+        chars=sum(c.chars for c in chapters),
+        tokens=sum(c.tokens for c in chapters)
+    )
+
+
+_index_cache: 'OrderedDict[str, NovelIndex]' = OrderedDict()
+_index_cache_lock = threading.Lock()
+
+
+def get_index(novel_text: str) -> NovelIndex:
+    # 同一文本在准入估算、场景分解与生成器之间只建立一次索引
+    digest = hashlib.sha256(novel_text.encode('utf-8')).hexdigest()
+    with _index_cache_lock:
+        if digest in _index_cache:
+            _index_cache.move_to_end(digest)
+            return _index_cache[digest]
+    
+    index = build_index(novel_text)
+    with _index_cache_lock:
+        _index_cache[digest] = index
+        while len(_index_cache) > INDEX_CACHE_SIZE:
+            _index_cache.popitem(last=False)
+    return index
+
+
+class JobHistory:
+    def __init__(self, path: str = None):
+        self.path = Path(path or Path(settings.cache_dir) / "job_stats.jsonl")
+        self._lock = threading.Lock()
+        self._records: Optional[List[Dict]] = None
+    
+    def _load(self) -> List[Dict]:
+        if self._records is None:
+            self._records = []
+            if self.path.exists():
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    for line in f:
+                        try:
+                            self._records.append(json.loads(line))
+                        except json.JSONDecodeError:
+                            continue
+                self._records = self._records[-HISTORY_WINDOW:]
+        return self._records
+    
+    def record(self, tokens: int, scenes: int, api_calls: int, wall_seconds: float):
+        if tokens <= 0 or scenes <= 0:
+            return
+        entry = {"tokens": tokens, "scenes": scenes, "api_calls": api_calls, "wall_seconds": round(wall_seconds, 2)}
+        with self._lock:
+            records = self._load()
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry) + '\n')
+            records.append(entry)
+            del records[:-HISTORY_WINDOW]
+    
+    def rates(self) -> Dict:
+        with self._lock:
+            records = list(self._load())
+        if not records:
+            return {**DEFAULT_RATES, "samples": 0}
+        
+        tokens = sum(r["tokens"] for r in records)
+        scenes = sum(r["scenes"] for r in records)
+        return {
+            "scenes_per_1k_tokens": scenes / tokens * 1000,
+            "api_calls_per_scene": sum(r["api_calls"] for r in records) / scenes,
+            "seconds_per_scene": sum(r["wall_seconds"] for r in records) / scenes,
+            "samples": len(records)
+        }
+
+
+@dataclass
+class JobEstimate:
+    chars: int
+    tokens: int
+    chapters: int
+    scenes: int
+    llm_calls: int
+    api_calls: int
+    wall_seconds: float
+    samples: int
+    rejected: List[str] = field(default_factory=list)
+    split: List[Dict] = field(default_factory=list)
+    
+    def to_dict(self) -> Dict:
+        return asdict(self)
+
+
+def estimate_job(index: NovelIndex, history: 'JobHistory' = None) -> JobEstimate:
+    rates = (history or get_job_history()).rates()
+    scenes = max(1, round(index.tokens / 1000 * rates["scenes_per_1k_tokens"]))
+    estimate = JobEstimate(
+        chars=index.chars,
+        tokens=index.tokens,
+        chapters=len(index.chapters),
+        scenes=scenes,
+        # 角色提取一次，场景分解每个片段一次
+        llm_calls=1 + len(index.chunks(settings.parser_chunk_chars)),
+        api_calls=round(scenes * rates["api_calls_per_scene"]),
+        wall_seconds=round(scenes * rates["seconds_per_scene"], 1),
+        samples=rates["samples"]
+    )
+    
+    if settings.max_job_tokens > 0 and estimate.tokens > settings.max_job_tokens:
+        estimate.rejected.append(f"约 {estimate.tokens} tokens，超过上限 {settings.max_job_tokens}")
+    if settings.max_job_scenes > 0 and estimate.scenes > settings.max_job_scenes:
+        estimate.rejected.append(f"预计 {estimate.scenes} 个场景，超过上限 {settings.max_job_scenes}")
+    if estimate.rejected:
+        estimate.split = split_plan(index, rates)
+    return estimate
+
+
+def split_plan(index: NovelIndex, rates: Dict) -> List[Dict]:
+    # 按章节把超限的小说分成若干个不超过上限的部分，单章超限时该章单独成为一部分
+    limits = []
+    if settings.max_job_tokens > 0:
+        limits.append(settings.max_job_tokens)
+    if settings.max_job_scenes > 0:
+        limits.append(int(settings.max_job_scenes * 1000 / rates["scenes_per_1k_tokens"]))
+    max_tokens = min(limits) if limits else index.tokens
+    
+    parts = []
+    for chapter in index.chapters:
+        if parts and parts[-1]["tokens"] + chapter.tokens <= max_tokens:
+            parts[-1]["last_chapter"] = chapter.title
+            parts[-1]["end_paragraph"] = chapter.end
+            parts[-1]["tokens"] += chapter.tokens
+        else:
+            parts.append({
+                "first_chapter": chapter.title,
+                "last_chapter": chapter.title,
+                "start_paragraph": chapter.start,
+                "end_paragraph": chapter.end,
+                "tokens": chapter.tokens
+            })
+    return parts
+
+
+_job_history: Optional[JobHistory] = None
+_job_history_lock = threading.Lock()
+
+
+def get_job_history() -> JobHistory:
+    global _job_history
+    with _job_history_lock:
+        if _job_history is None:
+            _job_history = JobHistory()
+        return _job_history
@@ -1,13 +1,18 @@
 import re
-import json
-from typing import List, Dict
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Tuple
 from dataclasses import dataclass
-from openai import OpenAI
 from config import settings
+from clients import get_openai_client
+from rate_limiter import get_limiter
+from request_coalescer import coalescer, request_key
+from json_repair import parse_json_array, validate_item, coerce_item
 
 
 @dataclass
 class Character:
+    __slots__ = ("name", "description", "appearance", "personality")
     name: str
     description: str
     appearance: str
@@ -16,6 +21,8 @@ class Character:
 
 @dataclass
 class Scene:
+    # 长篇小说可能有数千个场景，使用 __slots__ 减少每个对象的内存
+    __slots__ = ("scene_number", "characters", "setting", "narration", "dialogue", "image_prompt")
     scene_number: int
     characters: List[str]
     setting: str
@@ -24,66 +31,175 @@ class Scene:
     image_prompt: str
 
 
-class NovelParser:
-    def __init__(self):
-        if settings.qiniu_api_key:
-            self.client = OpenAI(
-                api_key=settings.qiniu_api_key,
-                base_url=settings.qiniu_base_url
-            )
-        elif settings.openai_api_key:
-            self.client = OpenAI(api_key=settings.openai_api_key)
-        else:
-            self.client = None
-    
-    def _extract_json(self, text: str) -> any:
-        text = text.strip()
-        
-        json_match = re.search(r'```(?:json)?\s*\n(.*?)\n```', text, re.DOTALL)
-        if json_match:
-            text = json_match.group(1)
-        
-        text = text.strip()
-        
-        try:
-            return json.loads(text)
-        except json.JSONDecodeError as e:
-            raise ValueError(f"Failed to parse JSON from LLM response. Error: {e}. Response text: {text[:200]}...")
-    
-    def extract_characters(self, novel_text: str) -> List[Character]:
-        if not self.client:
-            return self._extract_characters_simple(novel_text)
-        
-        prompt = f"""分析以下小说文本，提取所有主要角色的信息。对于每个角色，提供：
+CHARACTER_SYSTEM_PROMPT = """你是一个专业的小说分析助手。
+分析用户提供的小说文本，提取所有主要角色的信息。对于每个角色，提供：
 1. 角色名字
 2. 角色描述（背景、职业等）
 3. 外貌特征（详细描述，用于图像生成）
 4. 性格特点
 
-小说文本：
-{novel_text}
-
 请以JSON格式返回，格式如下：
 [
-  {{
+  {
     "name": "角色名",
     "description": "角色描述",
     "appearance": "外貌特征（详细、具体，适合用于AI图像生成）",
     "personality": "性格特点"
-  }}
-]
-"""
+  }
+]"""
+
+SCENE_SYSTEM_PROMPT = """你是一个专业的小说场景分析师。
+将用户提供的小说片段分解成多个场景，每个场景应该：
+1. 包含明确的时间和地点
+2. 列出场景中出现的角色
+3. 提供场景描述和旁白
+4. 提取对话
+5. 生成适合用于AI图像生成的详细视觉提示词
+
+请以JSON格式返回，格式如下：
+[
+  {
+    "scene_number": 1,
+    "characters": ["角色1", "角色2"],
+    "setting": "场景地点和时间",
+    "narration": "场景旁白描述",
+    "dialogue": [
+      {"speaker": "角色1", "text": "对话内容"},
+      {"speaker": "角色2", "text": "对话内容"}
+    ],
+    "image_prompt": "详细的英文图像生成提示词，描述场景、角色位置、动作、氛围等"
+  }
+]"""
+
+CONTINUATION_PROMPT = """上面的输出{problem}。前 {count} 个条目已正确接收。
+请从第 {next} 个条目开始，按相同的JSON数组格式输出剩余的全部条目（包括修正后的第 {next} 个），不要重复已接收的条目，也不要输出其他文字。"""
+
+
+def split_novel_text(novel_text: str, max_chars: int) -> List[str]:
+    # novel_index 经由 prompt_compiler 间接依赖本模块，在函数内导入
+    from novel_index import get_index
+    return get_index(novel_text).chunks(max_chars)
+
+
+class TokenUsage:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.completion_tokens = 0
+    
+    def record(self, usage: Dict[str, int]):
+        with self._lock:
+            self.calls += 1
+            self.prompt_tokens += usage.get("prompt_tokens", 0)
+            self.cached_tokens += usage.get("cached_tokens", 0)
+            self.completion_tokens += usage.get("completion_tokens", 0)
+    
+    def snapshot(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "prompt_tokens": self.prompt_tokens,
+                "cached_tokens": self.cached_tokens,
+                "completion_tokens": self.completion_tokens,
+                "cache_hit_ratio": self.cached_tokens / self.prompt_tokens if self.prompt_tokens else 0.0
+            }
+
+
+# 进程内所有解析器的累计用量，批量模式统计报告使用
+llm_usage = TokenUsage()
+
+
+def _usage_to_dict(usage) -> Dict[str, int]:
+    if usage is None:
+        return {}
+    details = getattr(usage, "prompt_tokens_details", None)
+    return {
+        "prompt_tokens": getattr(usage, "prompt_tokens", 0) or 0,
+        "cached_tokens": getattr(details, "cached_tokens", 0) or 0,
+        "completion_tokens": getattr(usage, "completion_tokens", 0) or 0
+    }
+
+
+class NovelParser:
+    def __init__(self):
+        self._client = None
+        self.usage = TokenUsage()
+    
+    @property
+    def client(self):
+        # 首次调用LLM时才创建客户端，避免启动时导入 openai
+        if self._client is None:
+            self._client = get_openai_client()
+        return self._client
+    
+    def _chat(self, messages: List[Dict[str, str]], temperature: float = 0.7) -> str:
+        # 相同模型、消息和温度的并发请求共享一次LLM调用
+        key = request_key("llm", model=settings.text_model, messages=messages, temperature=temperature)
+        content, _ = coalescer.run(key, self._request_chat, messages, temperature)
+        return content
+    
+    def _request_chat(self, messages: List[Dict[str, str]], temperature: float) -> Tuple[str, Dict[str, int]]:
+        with get_limiter("llm"):
+            response = self.client.chat.completions.create(
+                model=settings.text_model,
+                messages=messages,
+                temperature=temperature
+            )
+        # 只记录实际发出的请求，被合并的重复请求不重复计数
+        usage = _usage_to_dict(getattr(response, "usage", None))
+        self.usage.record(usage)
+        llm_usage.record(usage)
+        return response.choices[0].message.content, usage
+    
+    def _chat_items(self, messages: List[Dict[str, str]], schema) -> List[Dict]:
+        conversation = list(messages)
+        content = self._chat(conversation)
+        items: List[Dict] = []
+        
+        for attempt in range(settings.parser_repair_attempts + 1):
+            # 修复常见的格式问题后逐条校验，只保留第一个问题之前的有效条目
+            parsed, incomplete = parse_json_array(content)
+            problem = None
+            for item in parsed:
+                if isinstance(item, dict):
+                    item = coerce_item(item, schema)
+                errors = validate_item(item, schema)
+                if errors:
+                    problem = f"第 {len(items) + 1} 个条目不符合格式（{'；'.join(errors)}）"
+                    break
+                items.append(item)
+            
+            if problem is None and not incomplete:
+                return items
+            if problem is None:
+                problem = "被截断或无法解析"
+            if attempt == settings.parser_repair_attempts:
+                break
+            
+            # 只请求缺失或无效的条目，不重新发送整段分析
+            print(f"  ⚠️ LLM 输出{problem}，从第 {len(items) + 1} 个条目开始请求补全...")
+            conversation += [
+                {"role": "assistant", "content": content},
+                {"role": "user", "content": CONTINUATION_PROMPT.format(problem=problem, count=len(items), next=len(items) + 1)}
+            ]
+            content = self._chat(conversation)
         
-        response = self.client.chat.completions.create(
-            model=settings.text_model,
-            messages=[
-                {"role": "system", "content": "你是一个专业的小说分析助手。"},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.7
-        )
+        if not items:
+            raise ValueError(f"Failed to parse JSON from LLM response: {problem}. Response text: {content[:200]}...")
+        print(f"  ⚠️ LLM 输出仍不完整，使用已解析的 {len(items)} 个条目")
+        return items
+    
+    def extract_characters(self, novel_text: str) -> List[Character]:
+        if not self.client:
+            return self._extract_characters_simple(novel_text)
         
-        characters_data = self._extract_json(response.choices[0].message.content)
+        # 固定的指令与格式说明放在前面，变化的小说文本放在最后，便于服务端缓存共享前缀
+        characters_data = self._chat_items([
+            {"role": "system", "content": CHARACTER_SYSTEM_PROMPT},
+            {"role": "user", "content": f"小说文本：\n{novel_text}"}
+        ], Character)
         return [Character(**char) for char in characters_data]
     
     def _extract_characters_simple(self, novel_text: str) -> List[Character]:
@@ -100,47 +216,40 @@ class NovelParser:
         if not self.client:
             return self._split_scenes_simple(novel_text, characters)
         
-        character_names = [c.name for c in characters]
+        # 片段在章节边界处切分，索引与准入估算共用
+        chunks = split_novel_text(novel_text, settings.parser_chunk_chars)
+        if not chunks:
+            return []
         
-        prompt = f"""将以下小说分解成多个场景，每个场景应该：
-1. 包含明确的时间和地点
-2. 列出场景中出现的角色
-3. 提供场景描述和旁白
-4. 提取对话
-5. 生成适合用于AI图像生成的详细视觉提示词
-
-已知角色：{', '.join(character_names)}
-
-小说文本：
-{novel_text}
-
-请以JSON格式返回，格式如下：
-[
-  {{
-    "scene_number": 1,
-    "characters": ["角色1", "角色2"],
-    "setting": "场景地点和时间",
-    "narration": "场景旁白描述",
-    "dialogue": [
-      {{"speaker": "角色1", "text": "对话内容"}},
-      {{"speaker": "角色2", "text": "对话内容"}}
-    ],
-    "image_prompt": "详细的英文图像生成提示词，描述场景、角色位置、动作、氛围等"
-  }}
-]
-"""
+        # 系统指令、输出格式与角色表对所有片段完全相同，构成可缓存的公共前缀
+        prefix = [
+            {"role": "system", "content": SCENE_SYSTEM_PROMPT},
+            {"role": "system", "content": self._character_sheet(characters)}
+        ]
+        
+        def split_chunk(index: int) -> List[Dict]:
+            suffix = f"小说片段（第 {index + 1}/{len(chunks)} 段）：\n{chunks[index]}"
+            return self._chat_items(prefix + [{"role": "user", "content": suffix}], Scene)
         
-        response = self.client.chat.completions.create(
-            model=settings.text_model,
-            messages=[
-                {"role": "system", "content": "你是一个专业的小说场景分析师。"},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.7
-        )
+        workers = max(1, min(settings.parser_max_workers, len(chunks)))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            chunk_results = list(pool.map(split_chunk, range(len(chunks))))
         
-        scenes_data = self._extract_json(response.choices[0].message.content)
-        return [Scene(**scene) for scene in scenes_data]
+        # 各片段内的场景编号各自从1开始，按片段顺序重新编号
+        scenes = []
+        for scenes_data in chunk_results:
+            for scene in scenes_data:
+                scene["scene_number"] = len(scenes) + 1
+                scenes.append(Scene(**scene))
+        
+        usage = self.usage.snapshot()
+        if usage["calls"]:
+            print(f"  LLM 用量: 输入 {usage['prompt_tokens']} tokens（缓存命中 {usage['cached_tokens']}，{usage['cache_hit_ratio']:.0%}），输出 {usage['completion_tokens']} tokens")
+        return scenes
+    
+    def _character_sheet(self, characters: List[Character]) -> str:
+        lines = [f"- {c.name}：{c.appearance}" for c in characters]
+        return "已知角色（场景中的角色名必须使用以下名字）：\n" + "\n".join(lines)
     
     def _split_scenes_simple(self, novel_text: str, characters: List[Character]) -> List[Scene]:
         paragraphs = [p.strip() for p in novel_text.split('\n\n') if p.strip()]
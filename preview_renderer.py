@@ -0,0 +1,56 @@
+import math
+from pathlib import Path
+from typing import Callable, Dict, Iterator, Optional
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+from config import settings
+from scene_store import metadata_scenes, total_scenes
+
+
+TEMPLATE_DIR = Path(__file__).resolve().parent / "templates"
+PREVIEW_TEMPLATE = "preview.html"
+
+# 模板只编译一次，auto_reload 关闭后不会在每次渲染时检查文件修改时间
+_environment = Environment(
+    loader=FileSystemLoader(str(TEMPLATE_DIR)),
+    autoescape=select_autoescape(["html"]),
+    auto_reload=False,
+    trim_blocks=True,
+    lstrip_blocks=True
+)
+
+
+def get_preview_template():
+    return _environment.get_template(PREVIEW_TEMPLATE)
+
+
+def page_count(total_scenes: int, per_page: Optional[int] = None) -> int:
+    per_page = per_page or settings.preview_page_size
+    return max(1, math.ceil(total_scenes / per_page))
+
+
+def static_page_name(page: int) -> str:
+    return "preview.html" if page == 1 else f"preview_page_{page}.html"
+
+
+def render_preview(
+    metadata: Dict,
+    asset_url: Callable[[str], str],
+    page: int = 1,
+    per_page: Optional[int] = None,
+    page_url: Callable[[int], str] = static_page_name,
+    output_dir: str = "."
+) -> Iterator[str]:
+    per_page = per_page or settings.preview_page_size
+    total_pages = page_count(total_scenes(metadata), per_page)
+    page = min(max(page, 1), total_pages)
+    start = (page - 1) * per_page
+    
+    return get_preview_template().generate(
+        metadata=metadata,
+        # 只读取本页的场景，渲染任意一页的内存占用与总场景数无关
+        scenes=metadata_scenes(output_dir, metadata, start, per_page),
+        page=page,
+        total_pages=total_pages,
+        asset_url=asset_url,
+        page_url=page_url
+    )
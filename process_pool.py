@@ -0,0 +1,148 @@
+import base64
+import io
+import multiprocessing
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Dict, Optional, Union
+from config import settings
+
+
+def _store_image(shm_name: str, size: int, encoded: bool, output_path: str, max_side: int = 0) -> Dict:
+    # 在子进程中执行：base64 解码、Pillow 校验与写文件都不占用主进程的 GIL
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        data = bytes(shm.buf[:size])
+    finally:
+        shm.close()
+    return _write_image(data, encoded, output_path, max_side)
+
+
+def _write_image(data: bytes, encoded: bool, output_path: str, max_side: int = 0) -> Dict:
+    if encoded:
+        data = base64.b64decode(data)
+    
+    width = height = None
+    try:
+        from PIL import Image
+        with Image.open(io.BytesIO(data)) as image:
+            image.load()
+            width, height = image.size
+            # 上游只支持较大尺寸时，按质量档位缩小后再保存
+            if max_side and max(width, height) > max_side:
+                image.thumbnail((max_side, max_side), Image.LANCZOS)
+                width, height = image.size
+                buffer = io.BytesIO()
+                image.save(buffer, format=image.format or "PNG")
+                data = buffer.getvalue()
+    except ImportError:
+        pass
+    
+    with open(output_path, 'wb') as f:
+        f.write(data)
+    return {"path": output_path, "bytes": len(data), "width": width, "height": height}
+
+
+class CpuPool:
+    def __init__(self, workers: int):
+        self.workers = workers
+        self._executor = None
+        self._lock = threading.Lock()
+        self.stats = {"submitted": 0, "completed": 0, "inline": 0, "wall_seconds": 0.0}
+    
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # 使用 spawn 启动子进程，避免在多线程进程中 fork 继承锁状态
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn")
+                )
+            return self._executor
+    
+    def store_image(self, image_data: Union[str, bytes], output_path: str, max_side: int = 0) -> Dict:
+        encoded = isinstance(image_data, str)
+        data = image_data.encode("ascii") if encoded else image_data
+        started = time.perf_counter()
+        
+        if self.workers <= 0:
+            with self._lock:
+                self.stats["inline"] += 1
+            return self._finish(started, _write_image(data, encoded, output_path, max_side))
+        
+        # 图片数据通过共享内存交给子进程，避免经由管道序列化大块字节
+        shm = shared_memory.SharedMemory(create=True, size=max(1, len(data)))
+        try:
+            shm.buf[:len(data)] = data
+            with self._lock:
+                self.stats["submitted"] += 1
+            future = self._get_executor().submit(_store_image, shm.name, len(data), encoded, output_path, max_side)
+            return self._finish(started, future.result())
+        finally:
+            shm.close()
+            shm.unlink()
+    
+    def _finish(self, started: float, result: Dict) -> Dict:
+        with self._lock:
+            self.stats["completed"] += 1
+            self.stats["wall_seconds"] += time.perf_counter() - started
+        return result
+    
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {"workers": self.workers, **self.stats}
+
+
+class GilLatencyProbe:
+    def __init__(self, interval: float = 0.005, window: int = 2000):
+        self.interval = interval
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self._thread = None
+    
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="gil-latency-probe", daemon=True)
+                self._thread.start()
+    
+    def _run(self):
+        # 线程按固定间隔休眠，醒来时的额外延迟就是等待 GIL 的时间
+        while True:
+            started = time.perf_counter()
+            time.sleep(self.interval)
+            lag = time.perf_counter() - started - self.interval
+            with self._lock:
+                self._samples.append(max(0.0, lag))
+    
+    def snapshot(self) -> Dict:
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return {"samples": 0, "avg_ms": 0.0, "p50_ms": 0.0, "p99_ms": 0.0, "max_ms": 0.0}
+        
+        def percentile(p: float) -> float:
+            return samples[min(len(samples) - 1, int(len(samples) * p))] * 1000
+        
+        return {
+            "samples": len(samples),
+            "avg_ms": sum(samples) / len(samples) * 1000,
+            "p50_ms": percentile(0.5),
+            "p99_ms": percentile(0.99),
+            "max_ms": samples[-1] * 1000
+        }
+
+
+_cpu_pool: Optional[CpuPool] = None
+_cpu_pool_lock = threading.Lock()
+gil_probe = GilLatencyProbe()
+
+
+def get_cpu_pool() -> CpuPool:
+    global _cpu_pool
+    with _cpu_pool_lock:
+        if _cpu_pool is None:
+            _cpu_pool = CpuPool(settings.cpu_pool_workers)
+        return _cpu_pool
@@ -0,0 +1,103 @@
+import math
+import re
+from typing import Dict, List
+from character_manager import CharacterManager
+from novel_parser import Scene
+from config import settings
+
+
+# 各图像模型可接受的提示词长度（近似 token 数）
+MODEL_PROMPT_TOKEN_BUDGETS = {
+    "gemini-2.5-flash-image": 1000,
+    "dall-e-3": 1000,
+    "dall-e-2": 250,
+}
+DEFAULT_PROMPT_TOKEN_BUDGET = 250
+
+SCENE_PREFIX = "anime style scene,"
+STYLE_SUFFIX = "high quality anime art style consistent character design detailed background cinematic composition"
+
+_CJK_RANGES = '\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uff00-\uffef'
+_CJK_PATTERN = re.compile('[' + _CJK_RANGES + ']')
+_WORD_PATTERN = re.compile('[' + _CJK_RANGES + ']|[^\\s' + _CJK_RANGES + ']+')
+
+
+def normalize_text(text: str) -> str:
+    return " ".join((text or "").split())
+
+
+def estimate_tokens(text: str) -> int:
+    # 本地近似：中日韩字符约 1 字 1 token，其余字符约 4 字符 1 token
+    cjk_count = len(_CJK_PATTERN.findall(text))
+    other_count = len(re.sub(r'\s', '', text)) - cjk_count
+    return cjk_count + math.ceil(other_count / 4)
+
+
+def truncate_to_tokens(text: str, budget: int) -> str:
+    if estimate_tokens(text) <= budget:
+        return text
+    
+    # 按词（或单个中文字符）截断，避免切断单词
+    kept: List[str] = []
+    used = 0
+    for match in _WORD_PATTERN.finditer(text):
+        cost = estimate_tokens(match.group(0))
+        if used + cost > budget:
+            break
+        kept.append(match.group(0))
+        used += cost
+    
+    result = ""
+    for word in kept:
+        if result and not (_CJK_PATTERN.match(word) and _CJK_PATTERN.match(result[-1])):
+            result += " "
+        result += word
+    return result
+
+
+def prompt_token_budget(model: str) -> int:
+    if settings.image_prompt_token_budget > 0:
+        return settings.image_prompt_token_budget
+    return MODEL_PROMPT_TOKEN_BUDGETS.get(model, DEFAULT_PROMPT_TOKEN_BUDGET)
+
+
+class PromptCompiler:
+    def __init__(self, character_manager: CharacterManager, model: str = None):
+        self.model = model or settings.image_model
+        self.budget = prompt_token_budget(self.model)
+        self.style_tokens = estimate_tokens(STYLE_SUFFIX)
+        
+        # 每个角色的提示词片段只构建一次，之后所有场景共享
+        self.fragments: Dict[str, str] = {}
+        self.fragment_tokens: Dict[str, int] = {}
+        for name in character_manager.characters:
+            fragment = normalize_text(f"{name}: {character_manager.get_character_fragment(name)}")
+            self.fragments[name] = fragment
+            self.fragment_tokens[name] = estimate_tokens(fragment)
+    
+    def compile(self, scene: Scene) -> str:
+        # 优先级：场景描述 > 角色 > 风格后缀；风格后缀的预算始终预留
+        remaining = self.budget - self.style_tokens
+        
+        scene_text = normalize_text(f"{SCENE_PREFIX} {scene.image_prompt} setting: {scene.setting}")
+        scene_text = truncate_to_tokens(scene_text, max(remaining, 0))
+        remaining -= estimate_tokens(scene_text)
+        
+        character_parts = []
+        label_tokens = estimate_tokens("characters:")
+        for name in dict.fromkeys(scene.characters):
+            if name not in self.fragments:
+                continue
+            cost = self.fragment_tokens[name] + (label_tokens if not character_parts else 1)
+            # 放不下的角色整体跳过，而不是截断成半句话
+            if cost > remaining:
+                continue
+            character_parts.append(self.fragments[name])
+            remaining -= cost
+        
+        parts = [scene_text]
+        if character_parts:
+            parts.append("characters: " + "; ".join(character_parts))
+        parts.append(STYLE_SUFFIX)
+        
+        return " ".join(parts)
@@ -0,0 +1,59 @@
+import threading
+import time
+from typing import Dict
+from config import settings
+
+
+class RateLimiter:
+    def __init__(self, name: str, max_concurrency: int, rate_per_minute: float = 0):
+        self.name = name
+        self._semaphore = threading.BoundedSemaphore(max(1, max_concurrency))
+        self._interval = 60.0 / rate_per_minute if rate_per_minute > 0 else 0.0
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+        self.stats = {"calls": 0, "active": 0, "wait_seconds": 0.0}
+    
+    def __enter__(self):
+        started = time.monotonic()
+        self._semaphore.acquire()
+        
+        if self._interval:
+            # 按固定间隔发放调用时间片，平滑突发请求
+            with self._lock:
+                now = time.monotonic()
+                slot = max(now, self._next_slot)
+                self._next_slot = slot + self._interval
+            if slot > now:
+                time.sleep(slot - now)
+        
+        with self._lock:
+            self.stats["calls"] += 1
+            self.stats["active"] += 1
+            self.stats["wait_seconds"] += time.monotonic() - started
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        with self._lock:
+            self.stats["active"] -= 1
+        self._semaphore.release()
+        return False
+
+
+_limiters: Dict[str, RateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(name: str) -> RateLimiter:
+    with _limiters_lock:
+        if name not in _limiters:
+            _limiters[name] = RateLimiter(
+                name,
+                getattr(settings, f"{name}_concurrency"),
+                getattr(settings, f"{name}_rate_per_minute")
+            )
+        return _limiters[name]
+
+
+def limiter_stats() -> Dict[str, Dict]:
+    with _limiters_lock:
+        return {name: dict(limiter.stats) for name, limiter in _limiters.items()}
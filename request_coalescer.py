@@ -0,0 +1,52 @@
+import hashlib
+import json
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict
+
+
+def request_key(kind: str, **payload) -> str:
+    normalized = json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return "{}:{}".format(kind, hashlib.sha256(normalized.encode("utf-8")).hexdigest())
+
+
+class RequestCoalescer:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, Future] = {}
+        self.stats = {"upstream": 0, "coalesced": 0}
+    
+    def run(self, key: str, func: Callable[..., Any], *args, **kwargs) -> Any:
+        with self._lock:
+            future = self._inflight.get(key)
+            is_leader = future is None
+            if is_leader:
+                future = Future()
+                self._inflight[key] = future
+                self.stats["upstream"] += 1
+            else:
+                self.stats["coalesced"] += 1
+        
+        # 相同请求正在进行时，直接等待并共享其结果（包括异常）
+        if not is_leader:
+            return future.result()
+        
+        try:
+            result = func(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+    
+    def inflight_count(self) -> int:
+        with self._lock:
+            return len(self._inflight)
+
+
+# 进程内共享，使不同任务、不同生成器实例的相同请求合并为一次上游调用
+coalescer = RequestCoalescer()
@@ -0,0 +1,129 @@
+import json
+import os
+import struct
+import threading
+from dataclasses import dataclass
+from itertools import islice
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+
+METADATA_NAME = "anime_metadata.json"
+SCENES_FILE = "scenes.jsonl"
+SCENE_INDEX_FILE = "scenes.idx"
+# 每个场景在 scenes.jsonl 中的起始字节偏移，定长记录便于按页直接定位
+OFFSET_STRUCT = struct.Struct("<Q")
+
+
+@dataclass
+class SceneRecord:
+    __slots__ = ("scene_number", "setting", "narration", "characters", "dialogue", "image_path", "audio_path")
+    scene_number: int
+    setting: str
+    narration: str
+    characters: List[str]
+    dialogue: List[Dict[str, str]]
+    image_path: Optional[str]
+    audio_path: Optional[str]
+    
+    def to_dict(self) -> Dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class SceneLog:
+    def __init__(self, output_dir: str):
+        self.path = Path(output_dir) / SCENES_FILE
+        self.index_path = Path(output_dir) / SCENE_INDEX_FILE
+        # 本次生成的场景先写入临时文件，完成后与元数据一起替换；生成期间已有的预览仍与旧元数据一致
+        self.pending_path = self.path.with_name(SCENES_FILE + ".tmp")
+        self.pending_index_path = self.index_path.with_name(SCENE_INDEX_FILE + ".tmp")
+        self._lock = threading.Lock()
+        self.count = 0
+    
+    def reset(self):
+        # 恢复生成时按场景顺序重新写入，已完成的素材来自检查点，不会重复生成
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            open(self.pending_path, 'wb').close()
+            open(self.pending_index_path, 'wb').close()
+            self.count = 0
+    
+    def append(self, record: SceneRecord):
+        line = (json.dumps(record.to_dict(), ensure_ascii=False) + "\n").encode("utf-8")
+        with self._lock:
+            with open(self.pending_path, 'ab') as f:
+                offset = f.tell()
+                f.write(line)
+            with open(self.pending_index_path, 'ab') as f:
+                f.write(OFFSET_STRUCT.pack(offset))
+            self.count += 1
+    
+    def publish(self):
+        # 在写入元数据之前调用；两次替换之间读到的偏移与记录不匹配时，read_scenes 会退回顺序读取
+        with self._lock:
+            os.replace(self.pending_path, self.path)
+            os.replace(self.pending_index_path, self.index_path)
+
+
+def scene_count(output_dir: str) -> int:
+    index_path = Path(output_dir) / SCENE_INDEX_FILE
+    if index_path.exists():
+        return index_path.stat().st_size // OFFSET_STRUCT.size
+    return sum(1 for _ in iter_scenes(output_dir))
+
+
+def iter_scenes(output_dir: str) -> Iterator[Dict]:
+    path = Path(output_dir) / SCENES_FILE
+    if not path.exists():
+        return
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def read_scenes(output_dir: str, start: int, limit: int) -> List[Dict]:
+    path = Path(output_dir) / SCENES_FILE
+    index_path = Path(output_dir) / SCENE_INDEX_FILE
+    if start < 0 or limit <= 0 or not path.exists():
+        return []
+    if not index_path.exists():
+        return list(islice(iter_scenes(output_dir), start, start + limit))
+    
+    # 通过偏移索引直接定位到该页的第一个场景，只读取本页的行
+    with open(index_path, 'rb') as f:
+        f.seek(start * OFFSET_STRUCT.size)
+        first = f.read(OFFSET_STRUCT.size)
+    if len(first) < OFFSET_STRUCT.size:
+        return []
+    
+    scenes = []
+    try:
+        with open(path, 'rb') as f:
+            f.seek(OFFSET_STRUCT.unpack(first)[0])
+            for line in islice(f, limit):
+                scenes.append(json.loads(line))
+    except ValueError:
+        return list(islice(iter_scenes(output_dir), start, start + limit))
+    return scenes
+
+
+def load_metadata(output_dir: str) -> Optional[Dict]:
+    metadata_path = Path(output_dir) / METADATA_NAME
+    if not metadata_path.exists():
+        return None
+    with open(metadata_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def total_scenes(metadata: Dict) -> int:
+    if "scenes" in metadata:
+        return len(metadata["scenes"])
+    return metadata.get("total_scenes", 0)
+
+
+def metadata_scenes(output_dir: str, metadata: Dict, start: int, limit: int) -> List[Dict]:
+    # 旧版本的元数据把所有场景内联在 JSON 中，新版本只保存概要，场景按页从 scenes.jsonl 读取
+    if "scenes" in metadata:
+        return metadata["scenes"][start:start + limit]
+    return read_scenes(output_dir, start, limit)
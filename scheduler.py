@@ -0,0 +1,277 @@
+import heapq
+import itertools
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional
+from config import settings
+
+
+RESOURCE_TYPES = ("llm", "image", "tts", "ffmpeg")
+# 空闲账户从调度表中移除，只保留最近若干个账户的等待统计
+RETIRED_ACCOUNTS = 100
+DEFAULT_ACCOUNT = "default"
+
+
+def completed_future(value: Any) -> Future:
+    future = Future()
+    future.set_result(value)
+    return future
+
+
+@dataclass(frozen=True)
+class Tenant:
+    # 账户（API Key 的摘要）与其下的任务；未指定时归入默认账户
+    account: str = DEFAULT_ACCOUNT
+    task: str = ""
+
+
+def tenant_weights() -> Dict[str, float]:
+    # 格式为 "账户:权重,账户:权重"，未列出的账户权重为 1
+    weights = {}
+    for item in settings.tenant_weights.split(","):
+        account, _, weight = item.strip().rpartition(":")
+        if account:
+            try:
+                weights[account] = max(0.01, float(weight))
+            except ValueError:
+                continue
+    return weights
+
+
+class FairShare:
+    def __init__(self, weight: float = 1.0):
+        self.weight = weight
+        # 步进调度：每执行一项工作 pass 值增加 1/权重，pass 值最小的先执行
+        self.pass_value = 0.0
+        self.queued = 0
+        self.active = 0
+        self.completed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+    
+    def wait_stats(self) -> Dict[str, Any]:
+        return {
+            "queued": self.queued,
+            "active": self.active,
+            "completed": self.completed,
+            "avg_wait": self.total_wait / self.completed if self.completed else 0.0,
+            "max_wait": self.max_wait
+        }
+
+
+class TaskShare(FairShare):
+    def __init__(self):
+        super().__init__()
+        self.heap: List[tuple] = []
+
+
+class AccountShare(FairShare):
+    def __init__(self, weight: float = 1.0):
+        super().__init__(weight)
+        self.tasks: Dict[str, TaskShare] = {}
+        self.virtual_time = 0.0
+
+
+class ResourceQueue:
+    def __init__(self, name: str, workers: int):
+        self.name = name
+        self.workers = max(1, workers)
+        # 账户之间按权重公平分配工作线程，同一账户内的任务之间轮流执行，任务内部按优先级执行
+        self._accounts: Dict[str, AccountShare] = {}
+        self._retired: 'OrderedDict[str, Dict[str, Any]]' = OrderedDict()
+        self._weights = tenant_weights()
+        self._virtual_time = 0.0
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self.active = 0
+        self.completed = 0
+        self.total_wait = 0.0
+        
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker_loop, name=f"{name}-worker-{i}", daemon=True)
+            thread.start()
+    
+    def submit(self, func: Callable, *args, priority: int = 0, tenant: Tenant = None, **kwargs) -> Future:
+        tenant = tenant or Tenant()
+        future = Future()
+        with self._cond:
+            account = self._accounts.get(tenant.account)
+            if account is None:
+                account = self._accounts[tenant.account] = AccountShare(self._weights.get(tenant.account, 1.0))
+                retired = self._retired.pop(tenant.account, None)
+                if retired:
+                    account.completed = retired["completed"]
+                    account.total_wait = retired["total_wait"]
+                    account.max_wait = retired["max_wait"]
+            task = account.tasks.get(tenant.task)
+            if task is None:
+                task = account.tasks[tenant.task] = TaskShare()
+                # 新任务从账户当前的进度开始计，不会因为之前空闲而连续占用工作线程
+                task.pass_value = account.virtual_time
+            if not account.queued and not account.active:
+                account.pass_value = max(account.pass_value, self._virtual_time)
+            
+            # 优先级数值越小越先执行，同优先级按提交顺序
+            heapq.heappush(task.heap, (priority, next(self._seq), time.monotonic(), future, func, args, kwargs))
+            account.queued += 1
+            task.queued += 1
+            self._cond.notify()
+        return future
+    
+    def _eligible(self, account: AccountShare) -> bool:
+        cap = settings.tenant_max_active
+        return account.queued > 0 and (cap <= 0 or account.active < cap)
+    
+    def _pop_next(self) -> Optional[tuple]:
+        accounts = [(name, account) for name, account in self._accounts.items() if self._eligible(account)]
+        if not accounts:
+            return None
+        
+        name, account = min(accounts, key=lambda item: item[1].pass_value)
+        task_name, task = min(
+            ((task_name, task) for task_name, task in account.tasks.items() if task.heap),
+            key=lambda item: (item[1].pass_value, item[1].heap[0][:2])
+        )
+        self._virtual_time = account.pass_value
+        account.virtual_time = task.pass_value
+        account.pass_value += 1.0 / account.weight
+        task.pass_value += 1.0
+        
+        item = heapq.heappop(task.heap)
+        account.queued -= 1
+        task.queued -= 1
+        account.active += 1
+        task.active += 1
+        return (name, task_name) + item
+    
+    def _worker_loop(self):
+        while True:
+            with self._cond:
+                item = self._pop_next()
+                while item is None:
+                    self._cond.wait()
+                    item = self._pop_next()
+                account_name, task_name, _, _, enqueued_at, future, func, args, kwargs = item
+                account = self._accounts[account_name]
+                task = account.tasks[task_name]
+                wait = time.monotonic() - enqueued_at
+                self.total_wait += wait
+                for share in (account, task):
+                    share.total_wait += wait
+                    share.max_wait = max(share.max_wait, wait)
+                self.active += 1
+            
+            try:
+                if future.set_running_or_notify_cancel():
+                    try:
+                        future.set_result(func(*args, **kwargs))
+                    except BaseException as e:
+                        future.set_exception(e)
+            finally:
+                with self._cond:
+                    self.active -= 1
+                    self.completed += 1
+                    for share in (account, task):
+                        share.active -= 1
+                        share.completed += 1
+                    # 没有排队与执行中工作的任务不再保留
+                    if not task.queued and not task.active and account.tasks.get(task_name) is task:
+                        del account.tasks[task_name]
+                    # 账户没有任何工作时同样移除，不断变换 API Key 也不会让调度表无限增长
+                    if not account.tasks and self._accounts.get(account_name) is account:
+                        del self._accounts[account_name]
+                        self._retire(account_name, account)
+                    # 释放的名额可能让受并发上限限制的账户重新可调度
+                    self._cond.notify()
+    
+    def _retire(self, name: str, account: AccountShare):
+        self._retired[name] = {
+            "completed": account.completed,
+            "total_wait": account.total_wait,
+            "max_wait": account.max_wait,
+            "weight": account.weight
+        }
+        self._retired.move_to_end(name)
+        while len(self._retired) > RETIRED_ACCOUNTS:
+            self._retired.popitem(last=False)
+    
+    def depth(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "queued": sum(account.queued for account in self._accounts.values()),
+                "active": self.active,
+                "workers": self.workers,
+                "completed": self.completed,
+                "avg_wait": self.total_wait / self.completed if self.completed else 0.0
+            }
+    
+    def queued_by_others(self, tenant: Tenant) -> int:
+        # 其他任务排队的工作数；任务自己预先提交的场景不算作负载
+        with self._cond:
+            queued = sum(account.queued for account in self._accounts.values())
+            account = self._accounts.get(tenant.account)
+            task = account.tasks.get(tenant.task) if account else None
+            return queued - (task.queued if task else 0)
+    
+    def tenant_stats(self) -> Dict[str, Dict[str, Any]]:
+        with self._cond:
+            stats = {
+                name: {
+                    "queued": 0,
+                    "active": 0,
+                    "completed": retired["completed"],
+                    "avg_wait": retired["total_wait"] / retired["completed"] if retired["completed"] else 0.0,
+                    "max_wait": retired["max_wait"],
+                    "weight": retired["weight"],
+                    "tasks": {}
+                }
+                for name, retired in self._retired.items()
+            }
+            for name, account in self._accounts.items():
+                stats[name] = dict(
+                    account.wait_stats(),
+                    weight=account.weight,
+                    tasks={task_name: task.wait_stats() for task_name, task in account.tasks.items()}
+                )
+            return stats
+
+
+class PipelineScheduler:
+    def __init__(self):
+        # 每类资源使用独立的队列与工作线程，互不阻塞
+        self.queues = {
+            name: ResourceQueue(name, getattr(settings, f"{name}_concurrency"))
+            for name in RESOURCE_TYPES
+        }
+    
+    def submit(self, resource: str, func: Callable, *args, priority: int = 0, tenant: Tenant = None, **kwargs) -> Future:
+        return self.queues[resource].submit(func, *args, priority=priority, tenant=tenant, **kwargs)
+    
+    def run(self, resource: str, func: Callable, *args, priority: int = 0, tenant: Tenant = None, **kwargs) -> Any:
+        return self.submit(resource, func, *args, priority=priority, tenant=tenant, **kwargs).result()
+    
+    def queue_depths(self) -> Dict[str, Dict[str, Any]]:
+        return {name: queue.depth() for name, queue in self.queues.items()}
+    
+    def tenant_stats(self) -> Dict[str, Dict[str, Any]]:
+        # 账户 -> 资源类型 -> 排队数、执行中数与等待时间（含该账户下各任务）
+        stats: Dict[str, Dict[str, Any]] = {}
+        for name, queue in self.queues.items():
+            for account, account_stats in queue.tenant_stats().items():
+                stats.setdefault(account, {})[name] = account_stats
+        return stats
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> PipelineScheduler:
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = PipelineScheduler()
+        return _scheduler
@@ -0,0 +1,183 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import shutil
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional
+from config import settings
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# 带内容哈希的文件名，例如 scene_001.3f2a9c1b7d4e.png
+HASHED_NAME_PATTERN = re.compile(r'\.[0-9a-f]{12}\.[A-Za-z0-9]+$')
+PRECOMPRESS_SUFFIXES = (".html", ".json")
+# /output/ 只发送生成的媒体、预览页与元数据；提交的小说原文、检查点等内部文件与其同目录但不对外提供
+SERVED_SUFFIXES = frozenset((".png", ".jpg", ".jpeg", ".webp", ".gif", ".mp3", ".wav", ".mp4", ".webm", ".html"))
+SERVED_NAMES = frozenset(("anime_metadata.json",))
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+# (路径, 修改时间, 大小) -> 内容哈希，避免每次渲染预览都重新读取大文件；只保留最近使用的条目
+DIGEST_CACHE_SIZE = 4096
+_digest_cache: "OrderedDict[tuple, str]" = OrderedDict()
+_digest_cache_lock = threading.Lock()
+
+
+def file_digest(path: Path) -> str:
+    stat = os.stat(path)
+    cache_key = (str(path), stat.st_mtime_ns, stat.st_size)
+    with _digest_cache_lock:
+        if cache_key in _digest_cache:
+            _digest_cache.move_to_end(cache_key)
+            return _digest_cache[cache_key]
+    
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    
+    value = digest.hexdigest()[:12]
+    with _digest_cache_lock:
+        _digest_cache[cache_key] = value
+        while len(_digest_cache) > DIGEST_CACHE_SIZE:
+            _digest_cache.popitem(last=False)
+    return value
+
+
+def is_hashed_name(filename: str) -> bool:
+    return bool(HASHED_NAME_PATTERN.search(filename))
+
+
+def is_served_file(filename: str) -> bool:
+    # 去掉内容哈希后按扩展名或文件名判断，例如 scene_001.3f2a9c1b7d4e.png -> scene_001.png
+    name = os.path.basename(filename)
+    name = HASHED_NAME_PATTERN.sub(lambda match: "." + match.group(0).rsplit(".", 1)[1], name)
+    return os.path.splitext(name)[1].lower() in SERVED_SUFFIXES or name in SERVED_NAMES
+
+
+def fingerprint_asset(file_path: str) -> str:
+    path = Path(file_path)
+    if not path.exists() or is_hashed_name(path.name):
+        return file_path
+    
+    hashed_path = path.with_name(f"{path.stem}.{file_digest(path)}{path.suffix}")
+    if not hashed_path.exists():
+        # 优先使用硬链接，避免重复占用磁盘空间
+        try:
+            os.link(path, hashed_path)
+        except OSError:
+            shutil.copyfile(path, hashed_path)
+    
+    return str(hashed_path)
+
+
+def precompress(file_path: str) -> List[str]:
+    path = Path(file_path)
+    if not path.exists() or path.suffix not in PRECOMPRESS_SUFFIXES:
+        return []
+    
+    data = path.read_bytes()
+    written = []
+    
+    gz_path = path.with_name(path.name + ".gz")
+    with open(gz_path, 'wb') as f:
+        f.write(gzip.compress(data, compresslevel=9, mtime=0))
+    written.append(str(gz_path))
+    
+    if brotli is not None:
+        br_path = path.with_name(path.name + ".br")
+        with open(br_path, 'wb') as f:
+            f.write(brotli.compress(data))
+        written.append(str(br_path))
+    
+    return written
+
+
+def _pick_precompressed(directory: str, filename: str, accept_encoding: str) -> Optional[tuple]:
+    from werkzeug.http import parse_accept_header
+    from werkzeug.security import safe_join
+    
+    original = safe_join(directory, filename)
+    if original is None or not os.path.isfile(original):
+        return None
+    
+    # 按客户端给出的 q 值排序，q=0 表示明确拒绝该编码；q 值相同时优先 br
+    accepted = parse_accept_header(accept_encoding)
+    candidates = sorted((("br", ".br"), ("gzip", ".gz")), key=lambda item: -accepted[item[0]])
+    for encoding, suffix in candidates:
+        if accepted[encoding] <= 0:
+            continue
+        candidate = original + suffix
+        # 压缩副本比原文件旧时视为过期，回退到原文件
+        if os.path.isfile(candidate) and os.path.getmtime(candidate) >= os.path.getmtime(original):
+            return filename + suffix, encoding
+    
+    return None
+
+
+def resolve_output_file(directory: str, filename: str, accept_encoding: str) -> Optional[tuple]:
+    # Flask 与 ASGI 两个入口共用：返回 (实际发送的文件名, MIME 类型, Content-Encoding)，路径越界时返回 None
+    from werkzeug.security import safe_join
+    
+    if safe_join(directory, filename) is None or not is_served_file(filename):
+        return None
+    
+    mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    if filename.endswith(PRECOMPRESS_SUFFIXES):
+        picked = _pick_precompressed(directory, filename, accept_encoding)
+        if picked:
+            return picked[0], mimetype, picked[1]
+    return filename, mimetype, None
+
+
+def cache_control_header(filename: str) -> str:
+    if is_hashed_name(filename):
+        return "public, max-age={}, immutable".format(IMMUTABLE_MAX_AGE)
+    # 非哈希文件名内容可能变化，依靠 ETag 重新验证
+    return "no-cache, max-age=0"
+
+
+def accel_redirect_path(served_name: str) -> str:
+    return "{}/{}".format(settings.static_accel_prefix.rstrip("/"), served_name)
+
+
+def send_output_file(directory: str, filename: str):
+    # 仅Web服务使用，命令行只需要指纹与预压缩功能，不导入 Flask
+    from flask import Response, request, send_from_directory
+    from werkzeug.exceptions import NotFound
+    from werkzeug.security import safe_join
+    
+    resolved = resolve_output_file(directory, filename, request.headers.get("Accept-Encoding", ""))
+    if resolved is None:
+        raise NotFound()
+    served_name, mimetype, content_encoding = resolved
+    
+    if settings.static_offload == "x-accel-redirect":
+        if not os.path.isfile(safe_join(directory, served_name)):
+            raise NotFound()
+        response = Response(mimetype=mimetype)
+        response.headers["X-Accel-Redirect"] = accel_redirect_path(served_name)
+    else:
+        # conditional=True 时 werkzeug 会处理 ETag、If-None-Match 与 Range 请求
+        response = send_from_directory(
+            directory,
+            served_name,
+            mimetype=mimetype,
+            conditional=True,
+            etag=True
+        )
+    
+    if content_encoding:
+        response.headers["Content-Encoding"] = content_encoding
+    if filename.endswith(PRECOMPRESS_SUFFIXES):
+        response.vary.add("Accept-Encoding")
+    
+    response.headers["Cache-Control"] = cache_control_header(filename)
+    return response
@@ -0,0 +1,288 @@
+import json
+import os
+import shutil
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+from config import settings
+from checkpoint import ASSET_JOURNAL_NAME, CHECKPOINT_NAME
+from static_assets import HASHED_NAME_PATTERN, file_digest
+
+
+# 步骤失败或进程中断后残留的中间文件
+ORPHAN_DIRS = ("videos/temp",)
+ORPHAN_PATTERNS = ("videos/concat_list.txt", "**/*.tmp", "**/*_concat.txt")
+# 命令行输出直接写在 output/ 下，与 tasks/、batch/ 等目录并列，只清理这些生成的条目
+CLI_ARTIFACTS = (
+    "images", "audio", "videos", "anime_metadata*.json*", "scenes.jsonl*", "scenes.idx*",
+    "preview*.html*", "checkpoint*", "novel.txt"
+)
+# 命令行与批量任务由其他进程生成，无法判断是否仍在运行；最近修改过的输出暂不清理
+EXTERNAL_IDLE_SECONDS = 3600
+
+
+def _file_bytes(path: Path) -> int:
+    # 硬链接的指纹副本与原文件共用磁盘空间，只有最后一个链接被删除时才真正释放
+    stat = path.stat()
+    return stat.st_size if stat.st_nlink <= 1 else 0
+
+
+def dir_size(path: Path) -> int:
+    sizes = {}
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                stat = os.stat(os.path.join(root, name))
+            except OSError:
+                continue
+            sizes[(stat.st_dev, stat.st_ino)] = stat.st_size
+    return sum(sizes.values())
+
+
+def remove_path(path: Path) -> int:
+    try:
+        if path.is_dir():
+            # 目录内的硬链接随目录一起删除，按 inode 统计实际释放的空间
+            links = {}
+            for p in path.rglob("*"):
+                if p.is_file():
+                    stat = p.stat()
+                    seen, size, nlink = links.get((stat.st_dev, stat.st_ino), (0, stat.st_size, stat.st_nlink))
+                    links[(stat.st_dev, stat.st_ino)] = (seen + 1, size, nlink)
+            reclaimed = sum(size for seen, size, nlink in links.values() if seen >= nlink)
+            shutil.rmtree(path, ignore_errors=True)
+            return reclaimed
+        reclaimed = _file_bytes(path)
+        path.unlink()
+        return reclaimed
+    except OSError:
+        return 0
+
+
+@dataclass
+class ArtifactDir:
+    # 一次生成的全部输出：Web任务与批量任务各占一个目录，命令行输出为 output/ 下的一组条目
+    path: Path
+    name: str
+    web: bool = False
+    patterns: Optional[Tuple[str, ...]] = None
+    
+    def entries(self) -> List[Path]:
+        if self.patterns is None:
+            return [self.path]
+        return sorted({p for pattern in self.patterns for p in self.path.glob(pattern)})
+    
+    def glob(self, pattern: str) -> List[Path]:
+        if self.patterns is None:
+            return list(self.path.glob(pattern))
+        names = {p.name for p in self.entries()}
+        return [p for p in self.path.glob(pattern) if p.relative_to(self.path).parts[0] in names]
+    
+    def last_modified(self) -> float:
+        # 检查点与素材记录随生成进度更新；目录本身的修改时间会因清理中间文件或新建同级目录而变化
+        times = []
+        for name in (CHECKPOINT_NAME, ASSET_JOURNAL_NAME):
+            try:
+                times.append((self.path / name).stat().st_mtime)
+            except OSError:
+                pass
+        return max(times) if times else self.path.stat().st_mtime
+    
+    def size(self) -> int:
+        return sum(dir_size(p) if p.is_dir() else _file_bytes(p) for p in self.entries())
+    
+    def remove(self) -> int:
+        return sum(remove_path(p) for p in self.entries())
+
+
+class TaskLifecycle:
+    def __init__(self, tasks_root: str, status: Dict[str, Dict], on_evict: Optional[Callable[[str], None]] = None):
+        self.tasks_root = Path(tasks_root)
+        self.output_root = Path(settings.output_dir)
+        self.status = status
+        self.on_evict = on_evict
+        self._lock = threading.Lock()
+        self._thread = None
+        self.totals = {
+            "runs": 0,
+            "reclaimed_bytes": 0,
+            "removed_files": 0,
+            "evicted_status": 0,
+            "removed_tasks": 0
+        }
+        self.last_run: Dict = {}
+    
+    def mark_finished(self, task_id: str):
+        entry = self.status.get(task_id)
+        if entry is not None:
+            entry["finished_at"] = time.time()
+    
+    def is_active(self, task_id: str) -> bool:
+        # 状态为 completed 后正式视频可能仍在后台渲染，以 finished_at 作为任务真正结束的标记
+        entry = self.status.get(task_id)
+        return entry is not None and "finished_at" not in entry
+    
+    def evict_expired_status(self, now: float = None) -> int:
+        # 只淘汰已结束的任务；磁盘上的检查点仍可通过 /api/status 查询
+        now = now or time.time()
+        expired = [
+            task_id for task_id, entry in list(self.status.items())
+            if "finished_at" in entry and now - entry["finished_at"] >= settings.task_status_ttl_seconds
+        ]
+        for task_id in expired:
+            self.status.pop(task_id, None)
+            if self.on_evict:
+                self.on_evict(task_id)
+        return len(expired)
+    
+    def roots(self) -> List[Path]:
+        # GC_ROOTS 中的相对路径以 output/ 为基准，"." 表示命令行直接写在 output/ 下的输出
+        return [self.output_root / root.strip() for root in settings.gc_roots.split(",") if root.strip()]
+    
+    def _outer_roots(self) -> List[Path]:
+        # 统计磁盘占用时跳过嵌套在其他根目录中的根目录，避免重复计算
+        roots = [root.resolve() for root in self.roots() if root.is_dir()]
+        return [root for root in set(roots) if not any(other != root and root.is_relative_to(other) for other in roots)]
+    
+    def _artifact_dirs(self, now: float) -> List[ArtifactDir]:
+        found = []
+        for root in self.roots():
+            if not root.is_dir():
+                continue
+            if root.resolve() == self.tasks_root.resolve():
+                found.extend(ArtifactDir(p, p.name, web=True) for p in root.iterdir() if p.is_dir())
+            elif root.resolve() == self.output_root.resolve():
+                if (root / CHECKPOINT_NAME).exists():
+                    found.append(ArtifactDir(root, ".", patterns=CLI_ARTIFACTS))
+            else:
+                found.extend(self._checkpoint_dirs(root))
+        
+        return [
+            artifact for artifact in found
+            if not (artifact.web and self.is_active(artifact.name))
+            and (artifact.web or now - artifact.last_modified() >= EXTERNAL_IDLE_SECONDS)
+        ]
+    
+    def _checkpoint_dirs(self, root: Path) -> List[ArtifactDir]:
+        # 批量任务按输入的相对路径嵌套输出，含检查点的目录即为一部小说的输出
+        found = []
+        for path in root.iterdir():
+            if not path.is_dir() or path.resolve() == self.tasks_root.resolve():
+                continue
+            if (path / CHECKPOINT_NAME).exists():
+                name = path.relative_to(self.output_root).as_posix() if path.is_relative_to(self.output_root) else str(path)
+                found.append(ArtifactDir(path, name))
+            else:
+                found.extend(self._checkpoint_dirs(path))
+        return found
+    
+    def _completed(self, task_dir: Path) -> bool:
+        try:
+            with open(task_dir / CHECKPOINT_NAME, 'r', encoding='utf-8') as f:
+                return bool(json.load(f).get("completed"))
+        except (OSError, json.JSONDecodeError):
+            return False
+    
+    def _remove_orphans(self, artifact: ArtifactDir) -> List[Path]:
+        task_dir = artifact.path
+        removable = []
+        # 未完成任务的视频段留给断点续传复用，只清理已完成任务的临时目录
+        if self._completed(task_dir):
+            removable.extend(task_dir / d for d in ORPHAN_DIRS if (task_dir / d).exists())
+        for pattern in ORPHAN_PATTERNS:
+            removable.extend(artifact.glob(pattern))
+        
+        # 素材重新生成后，旧内容哈希的指纹副本不再被任何预览页引用
+        for hashed in artifact.glob("**/*.*.*"):
+            match = HASHED_NAME_PATTERN.search(hashed.name)
+            if not match:
+                continue
+            original = hashed.with_name(hashed.name[:match.start()] + hashed.suffix)
+            if not original.exists() or file_digest(original) != match.group(0)[1:13]:
+                removable.append(hashed)
+        return removable
+    
+    def collect(self) -> Dict:
+        with self._lock:
+            started = time.monotonic()
+            report = {"reclaimed_bytes": 0, "removed_files": 0, "removed_tasks": [], "evicted_status": 0}
+            report["evicted_status"] = self.evict_expired_status()
+            
+            now = time.time()
+            kept = []
+            removed = []
+            for artifact in self._artifact_dirs(now):
+                modified = artifact.last_modified()
+                for path in self._remove_orphans(artifact):
+                    report["reclaimed_bytes"] += remove_path(path)
+                    report["removed_files"] += 1
+                
+                age_hours = (now - modified) / 3600
+                size = artifact.size()
+                expired = settings.artifact_ttl_hours > 0 and age_hours >= settings.artifact_ttl_hours
+                over_quota = settings.task_disk_quota_mb > 0 and size > settings.task_disk_quota_mb * 1024 * 1024
+                if expired or over_quota:
+                    report["reclaimed_bytes"] += artifact.remove()
+                    removed.append(artifact)
+                else:
+                    kept.append((modified, size, artifact))
+            
+            # 超出全局配额时，从最久未修改的任务开始删除
+            if settings.global_disk_quota_mb > 0:
+                total = sum(size for _, size, _ in kept)
+                quota = settings.global_disk_quota_mb * 1024 * 1024
+                for _, size, artifact in sorted(kept, key=lambda item: item[0]):
+                    if total <= quota:
+                        break
+                    total -= size
+                    report["reclaimed_bytes"] += artifact.remove()
+                    removed.append(artifact)
+            
+            report["removed_tasks"] = [artifact.name for artifact in removed]
+            for artifact in removed:
+                if not artifact.web:
+                    continue
+                self.status.pop(artifact.name, None)
+                if self.on_evict:
+                    self.on_evict(artifact.name)
+            
+            report["elapsed"] = time.monotonic() - started
+            self.totals["runs"] += 1
+            self.totals["reclaimed_bytes"] += report["reclaimed_bytes"]
+            self.totals["removed_files"] += report["removed_files"]
+            self.totals["evicted_status"] += report["evicted_status"]
+            self.totals["removed_tasks"] += len(report["removed_tasks"])
+            self.last_run = {**report, "finished_at": time.time()}
+        
+        if report["reclaimed_bytes"] or report["removed_tasks"] or report["evicted_status"]:
+            print(f"🧹 清理完成: 释放 {report['reclaimed_bytes'] / 1024 / 1024:.1f} MB，"
+                  f"删除 {report['removed_files']} 个中间文件、{len(report['removed_tasks'])} 个任务目录，"
+                  f"淘汰 {report['evicted_status']} 条任务状态")
+        return report
+    
+    def start(self, interval: float = None):
+        interval = interval or settings.gc_interval_seconds
+        if interval <= 0 or self._thread is not None:
+            return
+        
+        def loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.collect()
+                except Exception as e:
+                    print(f"⚠️ 后台清理失败: {e}")
+        
+        self._thread = threading.Thread(target=loop, name="task-gc", daemon=True)
+        self._thread.start()
+    
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                "status_entries": len(self.status),
+                "totals": dict(self.totals),
+                "last_run": dict(self.last_run),
+                "disk_bytes": sum(dir_size(root) for root in self._outer_roots())
+            }
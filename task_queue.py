@@ -0,0 +1,283 @@
+import json
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from dataclasses import dataclass, field, asdict
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+from config import settings
+
+
+TASK_KINDS = ("reference", "image", "audio", "segment")
+
+
+@dataclass
+class SceneTask:
+    job_id: str
+    kind: str
+    key: str
+    payload: Dict[str, Any] = field(default_factory=dict)
+    
+    @property
+    def task_id(self) -> str:
+        # 同一任务的同一工作单元只入队一次，重复提交是幂等的
+        return f"{self.job_id}:{self.kind}:{self.key}"
+    
+    def to_json(self) -> str:
+        return json.dumps(asdict(self), ensure_ascii=False)
+    
+    @classmethod
+    def from_json(cls, data: str) -> "SceneTask":
+        return cls(**json.loads(data))
+
+
+class SQLiteTaskQueue:
+    def __init__(self, db_path: str = None):
+        self.db_path = Path(db_path or Path(settings.cache_dir) / "task_queue.db")
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._init_lock = threading.Lock()
+        with self._init_lock, closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS tasks ("
+                " task_id TEXT PRIMARY KEY,"
+                " job_id TEXT NOT NULL,"
+                " kind TEXT NOT NULL,"
+                " body TEXT NOT NULL,"
+                " status TEXT NOT NULL DEFAULT 'pending',"
+                " attempts INTEGER NOT NULL DEFAULT 0,"
+                " worker TEXT,"
+                " lease_until REAL,"
+                " result TEXT,"
+                " error TEXT,"
+                " created_at REAL NOT NULL,"
+                " updated_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS tasks_claim ON tasks (kind, status, created_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS tasks_job ON tasks (job_id)")
+    
+    def _connect(self) -> sqlite3.Connection:
+        # 每次操作使用独立连接，多个线程与进程可同时访问同一个数据库文件
+        return sqlite3.connect(str(self.db_path), timeout=30, isolation_level=None)
+    
+    def put(self, task: SceneTask) -> bool:
+        now = time.time()
+        with closing(self._connect()) as conn:
+            # 重复提交时已失败的任务重置为待领取，重新计算尝试次数；其余状态保持不变
+            cursor = conn.execute(
+                "INSERT INTO tasks (task_id, job_id, kind, body, created_at, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)"
+                " ON CONFLICT (task_id) DO UPDATE SET status = 'pending', attempts = 0, body = excluded.body,"
+                " worker = NULL, lease_until = NULL, error = NULL, updated_at = excluded.updated_at"
+                " WHERE tasks.status = 'failed'",
+                (task.task_id, task.job_id, task.kind, task.to_json(), now, now)
+            )
+            return cursor.rowcount == 1
+    
+    def claim(self, worker_id: str, kinds: List[str], lease_seconds: float = None) -> Optional[SceneTask]:
+        lease_seconds = lease_seconds or settings.task_lease_seconds
+        now = time.time()
+        placeholders = ",".join("?" for _ in kinds)
+        with closing(self._connect()) as conn:
+            # BEGIN IMMEDIATE 保证同一任务只会被一个工作节点领取；租约过期的任务视为节点已崩溃，重新领取
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    f"SELECT task_id, body FROM tasks WHERE kind IN ({placeholders})"
+                    " AND (status = 'pending' OR (status = 'running' AND lease_until < ?))"
+                    " ORDER BY created_at LIMIT 1",
+                    (*kinds, now)
+                ).fetchone()
+                if row is None:
+                    conn.execute("COMMIT")
+                    return None
+                conn.execute(
+                    "UPDATE tasks SET status = 'running', worker = ?, lease_until = ?,"
+                    " attempts = attempts + 1, updated_at = ? WHERE task_id = ?",
+                    (worker_id, now + lease_seconds, now, row[0])
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return SceneTask.from_json(row[1])
+    
+    def complete(self, task: SceneTask, result: Dict[str, Any], worker_id: str) -> bool:
+        # 只有仍持有租约的节点可以提交结果；租约过期后被其他节点领取的任务以新节点的结果为准
+        with closing(self._connect()) as conn:
+            cursor = conn.execute(
+                "UPDATE tasks SET status = 'done', result = ?, error = NULL, updated_at = ?"
+                " WHERE task_id = ? AND status = 'running' AND worker = ?",
+                (json.dumps(result, ensure_ascii=False), time.time(), task.task_id, worker_id)
+            )
+            return cursor.rowcount == 1
+    
+    def fail(self, task: SceneTask, error: str, worker_id: str, max_attempts: int = None) -> bool:
+        max_attempts = max_attempts or settings.task_max_attempts
+        with closing(self._connect()) as conn:
+            cursor = conn.execute(
+                "UPDATE tasks SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END,"
+                " error = ?, lease_until = NULL, updated_at = ?"
+                " WHERE task_id = ? AND status = 'running' AND worker = ?",
+                (max_attempts, error, time.time(), task.task_id, worker_id)
+            )
+            return cursor.rowcount == 1
+    
+    def results(self, job_id: str) -> Dict[str, Dict[str, Any]]:
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                "SELECT task_id, status, worker, result, error FROM tasks WHERE job_id = ?",
+                (job_id,)
+            ).fetchall()
+        return {
+            task_id: {
+                "status": status,
+                "worker": worker,
+                "result": json.loads(result) if result else None,
+                "error": error
+            }
+            for task_id, status, worker, result, error in rows
+        }
+
+
+# 领取、完成、失败与回收都以 Lua 脚本在 Redis 中原子执行，多个节点不会同时持有同一任务
+REDIS_PUT_SCRIPT = """
+local status = redis.call('HGET', KEYS[1], 'status')
+if status and status ~= 'failed' then
+    return 0
+end
+redis.call('HSET', KEYS[1], 'body', ARGV[1], 'kind', ARGV[2], 'attempts', 0, 'error', '', 'status', 'pending')
+redis.call('SADD', KEYS[2], ARGV[3])
+redis.call('RPUSH', KEYS[3], ARGV[3])
+return 1
+"""
+
+REDIS_CLAIM_SCRIPT = """
+while true do
+    local task_id = redis.call('LPOP', KEYS[1])
+    if not task_id then
+        return false
+    end
+    local key = ARGV[1] .. 'task:' .. task_id
+    -- 重复入队的条目在第一次领取后已不是待领取状态，直接丢弃
+    if redis.call('HGET', key, 'status') == 'pending' then
+        redis.call('HSET', key, 'status', 'running', 'worker', ARGV[2])
+        redis.call('HINCRBY', key, 'attempts', 1)
+        redis.call('ZADD', KEYS[2], ARGV[3], task_id)
+        return redis.call('HGET', key, 'body')
+    end
+end
+"""
+
+REDIS_RECLAIM_SCRIPT = """
+local expired = redis.call('ZRANGEBYSCORE', KEYS[1], 0, ARGV[2])
+for _, task_id in ipairs(expired) do
+    redis.call('ZREM', KEYS[1], task_id)
+    local key = ARGV[1] .. 'task:' .. task_id
+    if redis.call('HGET', key, 'status') == 'running' then
+        redis.call('HSET', key, 'status', 'pending')
+        redis.call('RPUSH', ARGV[1] .. 'pending:' .. redis.call('HGET', key, 'kind'), task_id)
+    end
+end
+return #expired
+"""
+
+REDIS_COMPLETE_SCRIPT = """
+if redis.call('HGET', KEYS[1], 'status') ~= 'running' or redis.call('HGET', KEYS[1], 'worker') ~= ARGV[2] then
+    return 0
+end
+redis.call('ZREM', KEYS[2], ARGV[1])
+redis.call('HSET', KEYS[1], 'status', 'done', 'result', ARGV[3], 'error', '')
+return 1
+"""
+
+REDIS_FAIL_SCRIPT = """
+if redis.call('HGET', KEYS[1], 'status') ~= 'running' or redis.call('HGET', KEYS[1], 'worker') ~= ARGV[2] then
+    return 0
+end
+redis.call('ZREM', KEYS[2], ARGV[1])
+if tonumber(redis.call('HGET', KEYS[1], 'attempts') or '0') >= tonumber(ARGV[4]) then
+    redis.call('HSET', KEYS[1], 'status', 'failed', 'error', ARGV[3])
+else
+    redis.call('HSET', KEYS[1], 'status', 'pending', 'error', ARGV[3])
+    redis.call('RPUSH', KEYS[3], ARGV[1])
+end
+return 1
+"""
+
+
+class RedisTaskQueue:
+    def __init__(self, url: str):
+        # redis 为可选依赖，只有配置了 redis:// 队列地址时才需要安装
+        import redis
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+        self.prefix = "anime:"
+        self._put_script = self.client.register_script(REDIS_PUT_SCRIPT)
+        self._claim_script = self.client.register_script(REDIS_CLAIM_SCRIPT)
+        self._reclaim_script = self.client.register_script(REDIS_RECLAIM_SCRIPT)
+        self._complete_script = self.client.register_script(REDIS_COMPLETE_SCRIPT)
+        self._fail_script = self.client.register_script(REDIS_FAIL_SCRIPT)
+    
+    def _task_key(self, task_id: str) -> str:
+        return f"{self.prefix}task:{task_id}"
+    
+    def _pending_key(self, kind: str) -> str:
+        return f"{self.prefix}pending:{kind}"
+    
+    def _running_key(self) -> str:
+        # 执行中的任务按租约到期时间排序，到期未完成的视为节点已崩溃
+        return f"{self.prefix}running"
+    
+    def put(self, task: SceneTask) -> bool:
+        # 重复提交时已失败的任务重置为待领取，重新计算尝试次数；其余状态保持不变
+        return bool(self._put_script(
+            keys=[self._task_key(task.task_id), f"{self.prefix}job:{task.job_id}", self._pending_key(task.kind)],
+            args=[task.to_json(), task.kind, task.task_id]
+        ))
+    
+    def claim(self, worker_id: str, kinds: List[str], lease_seconds: float = None) -> Optional[SceneTask]:
+        lease_seconds = lease_seconds or settings.task_lease_seconds
+        self._reclaim_script(keys=[self._running_key()], args=[self.prefix, time.time()])
+        for kind in kinds:
+            body = self._claim_script(
+                keys=[self._pending_key(kind), self._running_key()],
+                args=[self.prefix, worker_id, time.time() + lease_seconds]
+            )
+            if body:
+                return SceneTask.from_json(body)
+        return None
+    
+    def complete(self, task: SceneTask, result: Dict[str, Any], worker_id: str) -> bool:
+        return bool(self._complete_script(
+            keys=[self._task_key(task.task_id), self._running_key()],
+            args=[task.task_id, worker_id, json.dumps(result, ensure_ascii=False)]
+        ))
+    
+    def fail(self, task: SceneTask, error: str, worker_id: str, max_attempts: int = None) -> bool:
+        max_attempts = max_attempts or settings.task_max_attempts
+        return bool(self._fail_script(
+            keys=[self._task_key(task.task_id), self._running_key(), self._pending_key(task.kind)],
+            args=[task.task_id, worker_id, error, max_attempts]
+        ))
+    
+    def results(self, job_id: str) -> Dict[str, Dict[str, Any]]:
+        results = {}
+        for task_id in self.client.smembers(f"{self.prefix}job:{job_id}"):
+            entry = self.client.hgetall(self._task_key(task_id))
+            results[task_id] = {
+                "status": entry.get("status"),
+                "worker": entry.get("worker"),
+                "result": json.loads(entry["result"]) if entry.get("result") else None,
+                "error": entry.get("error")
+            }
+        return results
+
+
+def get_task_queue(url: str = None):
+    url = url if url is not None else settings.task_queue_url
+    if url.startswith("redis://") or url.startswith("rediss://"):
+        return RedisTaskQueue(url)
+    if url.startswith("sqlite:///"):
+        return SQLiteTaskQueue(url[len("sqlite:///"):])
+    return SQLiteTaskQueue(url or None)
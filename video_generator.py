@@ -1,30 +1,134 @@
 import subprocess
 import json
+import functools
+import threading
+from dataclasses import dataclass, field
 from pathlib import Path
 from typing import List, Optional, Dict
 from config import settings
+from ffmpeg_supervisor import TaskCancelled, run_ffmpeg
+
+
+@dataclass(frozen=True)
+class FFmpegCapabilities:
+    available: bool
+    version: str = ""
+    encoders: frozenset = field(default_factory=frozenset)
+    hwaccels: frozenset = field(default_factory=frozenset)
+
+
+def _run_ffmpeg_query(*args: str) -> str:
+    result = subprocess.run(
+        ["ffmpeg", "-hide_banner", *args],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+        check=True
+    )
+    return result.stdout
+
+
+@functools.lru_cache(maxsize=1)
+def probe_ffmpeg() -> FFmpegCapabilities:
+    # ffmpeg 的探测结果在进程内只计算一次，后续生成器直接复用
+    try:
+        version_line = _run_ffmpeg_query("-version").splitlines()[0]
+    except (subprocess.CalledProcessError, FileNotFoundError, IndexError):
+        return FFmpegCapabilities(available=False)
+    
+    encoders = set()
+    try:
+        for line in _run_ffmpeg_query("-encoders").splitlines():
+            parts = line.split()
+            # 编码器行形如 " V....D libx264  ..."
+            if len(parts) >= 2 and len(parts[0]) == 6 and parts[0][0] in "VAS":
+                encoders.add(parts[1])
+    except subprocess.CalledProcessError:
+        pass
+    
+    hwaccels = set()
+    try:
+        lines = _run_ffmpeg_query("-hwaccels").splitlines()
+        hwaccels = {line.strip() for line in lines[1:] if line.strip()}
+    except subprocess.CalledProcessError:
+        pass
+    
+    return FFmpegCapabilities(
+        available=True,
+        version=version_line,
+        encoders=frozenset(encoders),
+        hwaccels=frozenset(hwaccels)
+    )
+
+
+# 草稿渲染：低分辨率、最快预设，用于尽快提供可观看的视频检查节奏
+DRAFT_ENCODE_OPTIONS = {"size": 480, "preset": "ultrafast", "crf": "32", "audio_bitrate": "48k"}
+
+
+def _scale_filter(size: int) -> str:
+    return f"scale={size}:{size}:force_original_aspect_ratio=decrease,pad={size}:{size}:(ow-iw)/2:(oh-ih)/2"
+
+
+_missing_warning_lock = threading.Lock()
+_missing_warning_shown = False
 
 
 class VideoGenerator:
-    def __init__(self):
-        self.output_dir = Path(settings.output_dir) / "videos"
+    def __init__(self, output_dir: str = None):
+        self.output_dir = Path(output_dir or settings.output_dir) / "videos"
         self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.checkpoint = None
+        # 由 AnimeGenerator 设置，按 ffmpeg 队列负载选择编码预设与音频码率
+        self.policy = None
+        # 由 AnimeGenerator 设置：取消任务时终止编码进程；编码进度（fps、速度、已编码时长）回调
+        self.cancel_token = None
+        self.progress_callback = None
+        self._options_lock = threading.Lock()
         self._check_ffmpeg()
     
     def _check_ffmpeg(self):
-        try:
-            subprocess.run(
-                ["ffmpeg", "-version"],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                check=True
-            )
-        except (subprocess.CalledProcessError, FileNotFoundError):
-            print("⚠️ 未检测到 ffmpeg，请安装 ffmpeg 以使用视频生成功能")
-            print("   安装方法：")
-            print("   - Ubuntu/Debian: sudo apt-get install ffmpeg")
-            print("   - macOS: brew install ffmpeg")
-            print("   - Windows: 从 https://ffmpeg.org/download.html 下载")
+        global _missing_warning_shown
+        self.capabilities = probe_ffmpeg()
+        if self.capabilities.available:
+            return
+        
+        with _missing_warning_lock:
+            if _missing_warning_shown:
+                return
+            _missing_warning_shown = True
+        print("⚠️ 未检测到 ffmpeg，请安装 ffmpeg 以使用视频生成功能")
+        print("   安装方法：")
+        print("   - Ubuntu/Debian: sudo apt-get install ffmpeg")
+        print("   - macOS: brew install ffmpeg")
+        print("   - Windows: 从 https://ffmpeg.org/download.html 下载")
+    
+    def _run_ffmpeg(self, cmd: List[str], label: str, duration: float = None, timeout: float = None):
+        return run_ffmpeg(
+            cmd,
+            label,
+            timeout=timeout,
+            cancel_token=self.cancel_token,
+            on_progress=self.progress_callback,
+            duration=duration
+        )
+    
+    def _encode_options(self, profile: str = "final") -> Dict[str, str]:
+        if profile == "draft":
+            return DRAFT_ENCODE_OPTIONS
+        
+        # 同一视频的所有视频段必须使用相同的编码参数，才能无损拼接；
+        # 参数在首个视频段编码时按负载确定，并写入检查点供恢复时沿用
+        with self._options_lock:
+            if self.checkpoint and self.checkpoint.get("encode_options"):
+                return self.checkpoint.get("encode_options")
+            
+            options = {"preset": "medium", "audio_bitrate": "160k"}
+            if self.policy:
+                level = self.policy.level_for("ffmpeg")
+                options = {"preset": level.x264_preset, "audio_bitrate": level.audio_bitrate}
+            if self.checkpoint:
+                self.checkpoint.save_stage("encode_options", options)
+            return options
     
     def generate_video_from_scenes(
         self,
@@ -50,6 +154,8 @@ class VideoGenerator:
             else:
                 return self._generate_video_without_audio(scenes_with_images, output_path, fps)
         
+        except TaskCancelled:
+            raise
         except Exception as e:
             print(f"生成视频时出错: {e}")
             import traceback
@@ -76,24 +182,25 @@ class VideoGenerator:
             if last_image and Path(last_image).exists():
                 f.write(f"file '{Path(last_image).absolute()}'\n")
         
+        options = self._encode_options()
         cmd = [
             "ffmpeg",
             "-f", "concat",
             "-safe", "0",
             "-i", str(concat_file),
-            "-vf", "scale=1024:1024:force_original_aspect_ratio=decrease,pad=1024:1024:(ow-iw)/2:(oh-ih)/2",
+            "-vf", _scale_filter(options.get("size", 1024)),
             "-c:v", "libx264",
+            "-preset", options["preset"],
             "-pix_fmt", "yuv420p",
             "-y",
             str(output_path)
         ]
         
-        result = subprocess.run(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True
-        )
+        try:
+            # 整段视频的编码时长随场景数增长，不设固定超时，只由停滞检测终止卡住的进程
+            result = self._run_ffmpeg(cmd, output_path.name, duration=len(scenes) / fps, timeout=0)
+        finally:
+            concat_file.unlink(missing_ok=True)
         
         if result.returncode != 0:
             print(f"❌ FFmpeg 错误: {result.stderr}")
@@ -107,77 +214,82 @@ class VideoGenerator:
         scenes: List[Dict],
         output_path: Path
     ) -> Optional[str]:
-        temp_dir = self.output_dir / "temp"
-        temp_dir.mkdir(exist_ok=True)
-        
         segment_files = []
         
         for idx, scene in enumerate(scenes):
-            image_path = scene.get("image_path")
-            audio_path = scene.get("audio_path")
-            
-            if not image_path or not Path(image_path).exists():
-                continue
-            
-            segment_output = temp_dir / f"segment_{idx:03d}.mp4"
-            
-            if audio_path and Path(audio_path).exists():
-                cmd = [
-                    "ffmpeg",
-                    "-loop", "1",
-                    "-i", str(Path(image_path).absolute()),
-                    "-i", str(Path(audio_path).absolute()),
-                    "-vf", "scale=1024:1024:force_original_aspect_ratio=decrease,pad=1024:1024:(ow-iw)/2:(oh-ih)/2",
-                    "-c:v", "libx264",
-                    "-tune", "stillimage",
-                    "-c:a", "aac",
-                    "-b:a", "160k",
-                    "-ar", "24000",
-                    "-ac", "1",
-                    "-pix_fmt", "yuv420p",
-                    "-shortest",
-                    "-y",
-                    str(segment_output)
-                ]
-            else:
-                # 为没有音频的场景生成3秒视频，并添加静音音频轨道（匹配源音频参数：24000 Hz 单声道）
-                cmd = [
-                    "ffmpeg",
-                    "-loop", "1",
-                    "-i", str(Path(image_path).absolute()),
-                    "-f", "lavfi",
-                    "-i", "anullsrc=channel_layout=mono:sample_rate=24000",
-                    "-t", "3",
-                    "-vf", "scale=1024:1024:force_original_aspect_ratio=decrease,pad=1024:1024:(ow-iw)/2:(oh-ih)/2",
-                    "-c:v", "libx264",
-                    "-tune", "stillimage",
-                    "-c:a", "aac",
-                    "-b:a", "160k",
-                    "-ar", "24000",
-                    "-ac", "1",
-                    "-pix_fmt", "yuv420p",
-                    "-shortest",
-                    "-y",
-                    str(segment_output)
-                ]
-            
-            result = subprocess.run(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True
+            segment_output = self.encode_segment(
+                scene.get("scene_number", idx),
+                scene.get("image_path"),
+                scene.get("audio_path")
             )
-            
-            if result.returncode == 0:
+            if segment_output:
                 segment_files.append(segment_output)
-            else:
-                print(f"⚠️ 场景 {idx} 视频段生成失败: {result.stderr}")
         
+        return self.concat_segments(segment_files, output_path)
+    
+    def encode_segment(self, segment_key: int, image_path: Optional[str], audio_path: Optional[str], profile: str = "final") -> Optional[Path]:
+        if not self.capabilities.available or not image_path or not Path(image_path).exists():
+            return None
+        
+        temp_dir = self.output_dir / "temp"
+        temp_dir.mkdir(exist_ok=True)
+        suffix = "" if profile == "final" else f"_{profile}"
+        segment_output = temp_dir / f"segment_{segment_key:03d}{suffix}.mp4"
+        
+        if self.checkpoint and self.checkpoint.segment(segment_key, image_path, audio_path, profile):
+            print(f"  ↻ 复用已编码的视频段 {segment_key}")
+            return segment_output
+        
+        options = self._encode_options(profile)
+        if audio_path and Path(audio_path).exists():
+            inputs = ["-i", str(Path(audio_path).absolute())]
+        else:
+            # 为没有音频的场景生成3秒视频，并添加静音音频轨道（匹配源音频参数：24000 Hz 单声道）
+            inputs = ["-f", "lavfi", "-i", "anullsrc=channel_layout=mono:sample_rate=24000", "-t", "3"]
+        
+        cmd = [
+            "ffmpeg",
+            "-loop", "1",
+            "-i", str(Path(image_path).absolute()),
+            *inputs,
+            "-vf", _scale_filter(options.get("size", 1024)),
+            "-c:v", "libx264",
+            "-preset", options["preset"],
+            *(["-crf", options["crf"]] if options.get("crf") else []),
+            "-tune", "stillimage",
+            "-c:a", "aac",
+            "-b:a", options["audio_bitrate"],
+            "-ar", "24000",
+            "-ac", "1",
+            "-pix_fmt", "yuv420p",
+            "-shortest",
+            "-y",
+            str(segment_output)
+        ]
+        
+        try:
+            result = self._run_ffmpeg(cmd, segment_output.name)
+        except FileNotFoundError:
+            print(f"⚠️ 未检测到 ffmpeg，跳过场景 {segment_key} 的视频段")
+            return None
+        
+        if result.returncode != 0:
+            print(f"⚠️ 场景 {segment_key} 视频段生成失败: {result.stderr}")
+            return None
+        
+        if self.checkpoint:
+            self.checkpoint.record_segment(segment_key, image_path, audio_path, str(segment_output), profile)
+        return segment_output
+    
+    def concat_segments(self, segment_files: List[Path], output_path: Path) -> Optional[str]:
         if not segment_files:
             print("❌ 没有成功生成任何视频段")
             return None
         
-        concat_file = temp_dir / "segments_concat.txt"
+        temp_dir = self.output_dir / "temp"
+        temp_dir.mkdir(exist_ok=True)
+        # 草稿与正式视频可能同时拼接，各自使用独立的列表文件
+        concat_file = temp_dir / f"{Path(output_path).stem}_concat.txt"
         with open(concat_file, 'w', encoding='utf-8') as f:
             for segment in segment_files:
                 f.write(f"file '{segment.absolute()}'\n")
@@ -192,12 +304,14 @@ class VideoGenerator:
             str(output_path)
         ]
         
-        result = subprocess.run(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True
-        )
+        try:
+            # 拼接时长随视频段数增长，同样只做停滞检测
+            result = self._run_ffmpeg(cmd, Path(output_path).name, timeout=0)
+        except FileNotFoundError:
+            print("❌ 未检测到 ffmpeg，无法合并视频")
+            return None
+        finally:
+            concat_file.unlink(missing_ok=True)
         
         if result.returncode != 0:
             print(f"❌ 视频合并失败: {result.stderr}")
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+import socket
+import tempfile
+import time
+import traceback
+from pathlib import Path
+from typing import Dict, List, Optional
+from novel_parser import Character, Scene
+from task_queue import SceneTask, TASK_KINDS, get_task_queue
+from asset_store import SharedAssetStore
+
+
+class SceneWorker:
+    def __init__(self, kinds: List[str] = None, queue=None, store: SharedAssetStore = None, worker_id: str = None):
+        self.kinds = list(kinds or TASK_KINDS)
+        self.queue = queue or get_task_queue()
+        self.store = store or SharedAssetStore()
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+    
+    def run(self, poll_interval: float = 1.0, max_tasks: int = 0, exit_when_idle: bool = False) -> int:
+        processed = 0
+        print(f"👷 工作节点 {self.worker_id} 已启动，处理: {', '.join(self.kinds)}")
+        while not max_tasks or processed < max_tasks:
+            task = self.queue.claim(self.worker_id, self.kinds)
+            if task is None:
+                if exit_when_idle:
+                    break
+                time.sleep(poll_interval)
+                continue
+            
+            self.process(task)
+            processed += 1
+        return processed
+    
+    def process(self, task: SceneTask):
+        try:
+            # 每个工作单元在独立的临时目录中生成，节点本身不保留任何状态
+            with tempfile.TemporaryDirectory(prefix="anime-worker-") as work_dir:
+                asset = self._execute(task, Path(work_dir))
+        except Exception as e:
+            print(f"  ❌ {task.task_id}: {e}")
+            if not self.queue.fail(task, f"{e}\n{traceback.format_exc()}", self.worker_id):
+                print(f"  ⚠️ {task.task_id} 的租约已失效，失败结果未记录")
+            return
+        
+        if self.queue.complete(task, {"asset": asset}, self.worker_id):
+            print(f"  ✓ {task.task_id}")
+        else:
+            print(f"  ⚠️ {task.task_id} 的租约已失效，结果由重新领取的节点提交")
+    
+    def _execute(self, task: SceneTask, work_dir: Path) -> Optional[str]:
+        payload = task.payload
+        if task.kind == "segment":
+            return self._encode_segment(task, work_dir)
+        
+        from character_manager import CharacterManager
+        character_manager = CharacterManager([Character(**c) for c in payload["characters"]])
+        
+        if task.kind == "reference":
+            from image_generator import ImageGenerator
+            generator = ImageGenerator(character_manager, output_dir=str(work_dir))
+            local_path = generator.generate_character_reference(payload["name"])
+        elif task.kind == "image":
+            from image_generator import ImageGenerator
+            scene = Scene(**payload["scene"])
+            generator = ImageGenerator(character_manager, output_dir=str(work_dir))
+            local_path = generator.generate_scene_image(scene, f"scene_{scene.scene_number:03d}.png")
+        elif task.kind == "audio":
+            from audio_generator import AudioGenerator
+            scene = Scene(**payload["scene"])
+            generator = AudioGenerator(character_manager, output_dir=str(work_dir))
+            local_path = generator.generate_scene_audio(scene, f"scene_{scene.scene_number:03d}.mp3")
+        else:
+            raise ValueError(f"未知的任务类型: {task.kind}")
+        
+        if not local_path:
+            return None
+        return self.store.put(task.job_id, local_path, payload.get("asset_name"))
+    
+    def _encode_segment(self, task: SceneTask, work_dir: Path) -> Optional[str]:
+        from video_generator import VideoGenerator
+        
+        payload = task.payload
+        image_path = self.store.fetch(task.job_id, payload["image"], work_dir / payload["image"])
+        audio_path = None
+        if payload.get("audio"):
+            audio_path = self.store.fetch(task.job_id, payload["audio"], work_dir / payload["audio"])
+        
+        generator = VideoGenerator(output_dir=str(work_dir))
+        segment_path = generator.encode_segment(
+            payload["scene_number"],
+            str(image_path),
+            str(audio_path) if audio_path else None
+        )
+        if not segment_path:
+            raise RuntimeError(f"场景 {payload['scene_number']} 视频段编码失败")
+        return self.store.put(task.job_id, str(segment_path), payload.get("asset_name"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="从共享队列领取场景任务的无状态工作节点")
+    parser.add_argument("--kinds", default=",".join(TASK_KINDS), help="处理的任务类型，逗号分隔（默认全部）")
+    parser.add_argument("--queue", help="任务队列地址（默认使用 TASK_QUEUE_URL）")
+    parser.add_argument("--max-tasks", type=int, default=0, help="处理指定数量的任务后退出（0 表示不限）")
+    parser.add_argument("--exit-when-idle", action="store_true", help="队列为空时退出")
+    args = parser.parse_args()
+    
+    kinds = [kind.strip() for kind in args.kinds.split(",") if kind.strip()]
+    worker = SceneWorker(kinds=kinds, queue=get_task_queue(args.queue) if args.queue else None)
+    processed = worker.run(max_tasks=args.max_tasks, exit_when_idle=args.exit_when_idle)
+    print(f"✓ 共处理 {processed} 个任务")
+
+
+if __name__ == "__main__":
+    main()